@@ -1,9 +1,20 @@
+import time
+
+# As close to process start as app.py gets; the imports below count towards startup
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import sys
 from flask import Flask, jsonify
 from flask_cors import CORS
 from extensions import db, logger # Import extensions
-from waitress import serve
+from config import Config
+from database import archive_path, engine_options, init_database
+
+# Modules that are only needed for some requests (mail, PDFs, CSV, ZIP,
+# email validation) are imported where they are used, so they do not
+# delay the first /health the desktop app waits for
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 def resource_path(relative_path):
     """Get absolute path to resource, works for dev and for PyInstaller"""
@@ -15,36 +26,58 @@ def resource_path(relative_path):
     
     return os.path.join(base_path, relative_path)
 
-def create_app():
+class StartupTimer:
+    """Milliseconds spent in each phase of create_app, logged as one line when it is done."""
+
+    def __init__(self):
+        self._last = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self._last) * 1000, 1)
+        self._last = now
+
+def create_app(config_overrides=None):
+    timer = StartupTimer()
     app = Flask(__name__, 
                 template_folder=resource_path('templates'),
                 static_folder=resource_path('static'))
 
+    # Load defaults and environment overrides from config.py
+    app.config.from_object(Config)
+    if config_overrides:
+        app.config.update(config_overrides)
+
+    from logs import init_logging
+    init_logging(app)
+    timer.mark('config')
+
     # Ensure instance directory exists
-    instance_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
-    os.makedirs(instance_path, exist_ok=True)
+    db_path = app.config['DATABASE_PATH']
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
     
     # Database configuration
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(instance_path, "stitchpay.db")}'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-    # Default Email Configuration (can be overridden by environment variables)
-    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
-    app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'True').lower() in ('true', 'yes', '1')
-    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
-    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
-    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'StitchPay <noreply@example.com>')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
 
     # Initialize extensions with the app
+    from serialization import init_json
+    init_json(app)
     db.init_app(app)
+    init_database(app)
+    timer.mark('database')
+
+    from metrics import init_metrics
+    init_metrics(app)
 
     # Enable CORS
     CORS(app, resources={
         r"/api/*": {
             "origins": "*",  # Allow all origins temporarily for debugging
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type"],
+            "allow_headers": ["Content-Type", "If-Match", "If-None-Match", "Last-Event-ID"],
+            "expose_headers": ["ETag", "Last-Modified"],
             "supports_credentials": True
         }
     })
@@ -52,17 +85,48 @@ def create_app():
     # Import and register blueprints AFTER app and extensions are initialized
     from routes import bp as api_blueprint 
     app.register_blueprint(api_blueprint, url_prefix='/api')
+    timer.mark('routes')
 
-    # Create database tables if they don't exist
-    with app.app_context():
-        # Import models here, only when needed for create_all, or ensure models.py only imports db from extensions
-        # from models import PurchaseOrder # If needed for create_all to see them
-        db.create_all()
-        logger.info("Database tables checked/created.")
+    # Create or upgrade the schema; costs one query when it is current
+    from migrations import migrate_database
+    migrate_database(db_path, batch_size=app.config['MIGRATION_BATCH_SIZE'],
+                     timeout=app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0,
+                     archive_path=archive_path(app.config))
+    timer.mark('migrations')
 
-    # Use the init_mail function to initialize mail
-    from extensions import init_mail
-    init_mail(app)
+    # Flask-Mail is set up by the mail worker when it sends its first email
+    # (extensions.get_mail); the PDF renderer compiles its templates and
+    # starts its process pool on first use
+    from pdf_generator import init_pdf
+    init_pdf(app)
+
+    from order_numbers import init_order_numbers
+    init_order_numbers(app)
+
+    from reports import init_reports
+    init_reports(app)
+
+    from customers import init_customers
+    init_customers(app)
+
+    from archive import init_archive
+    init_archive(app)
+
+    from changes import init_change_streams
+    init_change_streams(app)
+    timer.mark('services')
+
+    # The workers hold off their first pass for BACKGROUND_START_DELAY seconds,
+    # like the customer index load started above
+    from backup import init_backups
+    init_backups(app)
+
+    from mailer import init_mail_worker
+    init_mail_worker(app)
+
+    from scheduler import init_scheduler
+    init_scheduler(app)
+    timer.mark('workers')
     
     # Add global error handler
     @app.errorhandler(Exception)
@@ -73,13 +137,11 @@ def create_app():
     # Add a direct health check route (not part of blueprints)
     @app.route('/health', methods=['GET'])
     def health_check():
-        logger.info("Health check endpoint accessed")
         return jsonify({"status": "ok", "message": "Flask backend is running"}), 200
 
     # Add a root endpoint for direct access to the server
     @app.route('/', methods=['GET'])
     def root():
-        logger.info("Root endpoint accessed")
         # List all registered routes for debugging
         routes = []
         for rule in app.url_map.iter_rules():
@@ -93,17 +155,34 @@ def create_app():
             "endpoints": ["/", "/health", "/api/health", "/api/test"]
         }), 200
 
+    global _IMPORT_SECONDS
+    phases = dict(timer.phases)
+    # Only the first app created in a process paid for the imports
+    if _IMPORT_SECONDS is not None:
+        phases = {'imports': round(_IMPORT_SECONDS * 1000, 1), **phases}
+        _IMPORT_SECONDS = None
+    app.extensions['startup_ms'] = phases
+    logger.info("App created in %.0f ms (%s)", sum(phases.values()),
+                ', '.join(f"{phase} {ms:.0f}" for phase, ms in phases.items()),
+                extra={'startupMs': phases})
+
     return app
 
 if __name__ == '__main__':
+    import multiprocessing
+    # PDF rendering uses a process pool; required for the PyInstaller build on Windows
+    multiprocessing.freeze_support()
     app = create_app()
     logger.info("Starting StitchPay backend server...")
     # Check if running as packaged app
     is_packaged = getattr(sys, 'frozen', False)
-    logger.info(f"Running as packaged app: {is_packaged}")
+    logger.info("Running as packaged app: %s", is_packaged)
 
     # Use Waitress for production
     if is_packaged:
-        serve(app, host='0.0.0.0', port=5000)
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=5000, threads=app.config['WAITRESS_THREADS'])
     else:
-        app.run(host='0.0.0.0', debug=True, port=5000)
+        # The reloader would run create_app() in its file-watcher process as well,
+        # starting a second backup worker, scheduler and mail worker
+        app.run(host='0.0.0.0', debug=True, port=5000, use_reloader=False)
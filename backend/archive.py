@@ -0,0 +1,348 @@
+"""Archive tier: settled purchase orders moved out of the main database.
+
+Orders in one of ARCHIVE_STATUSES that have not changed for
+ARCHIVE_AFTER_DAYS are moved, with their line items and search documents,
+to the same tables in a second SQLite file. Every connection attaches that
+file as the "archive" schema (database.install_archive). The main database,
+and with it every scan, the search index, the WAL and the backups, then
+only holds the orders still in use.
+
+Each batch of ARCHIVE_BATCH_SIZE orders is one transaction that copies the
+orders into the archive and deletes them from the main tables. In WAL mode
+SQLite commits the two files one after the other, so a crash in the middle
+of a commit can leave an order in both. Readers prefer the main copy, and
+the next run drops archived copies of orders that are in the main tables.
+
+Archived orders keep counting in the summary and report rollups: where an
+order is stored does not change the history. They leave the change feed as
+deletions, as they leave the default listing. The detail, listing and search
+endpoints return them with includeArchived=true, marked "archived": true.
+They are read-only; restore_orders() moves one back to be edited.
+
+After a run that moved orders, the archive database is snapshotted into the
+archive folder of the backup directory, since backups of the main database
+no longer hold those orders. To run by hand:
+
+    python archive.py               # archive the orders that are due
+    python archive.py status        # orders in each tier
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+from backup import BackupStore, backup_dir, take_snapshot
+from changes import record_changes
+from database import archive_path, begin_write
+from extensions import db, logger
+from models import ArchivedPurchaseOrder, PurchaseOrder
+from pdf_generator import get_renderer
+from search import reindex_orders
+
+# SQLite caps bound parameters per statement; stay well under the old 999 limit
+_ID_CHUNK = 500
+
+# The archive has the main tables' columns, so a migration that changes
+# purchase_orders or line_items has to change these as well. Tables are only
+# ever created here: the archive file is not versioned by migrations.py.
+_ORDER_COLUMNS = ('id, order_number, customer_id, subtotal_cents, tax_rate, tax_amount_cents, total_cents, '
+                  'notes, status, created_at, due_date')
+_LINE_ITEM_COLUMNS = 'purchase_order_id, position, item_id, description, quantity, unit_price_cents'
+
+_ARCHIVE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS archive.purchase_orders (
+        doc_id INTEGER NOT NULL,
+        id VARCHAR(36) NOT NULL,
+        order_number VARCHAR(100) NOT NULL,
+        customer_id INTEGER NOT NULL,
+        subtotal_cents INTEGER NOT NULL,
+        tax_rate FLOAT NOT NULL,
+        tax_amount_cents INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        notes TEXT,
+        status VARCHAR(20) NOT NULL,
+        created_at DATETIME NOT NULL,
+        due_date DATETIME,
+        updated_at DATETIME NOT NULL,
+        version INTEGER NOT NULL,
+        archived_at DATETIME NOT NULL,
+        PRIMARY KEY (doc_id),
+        UNIQUE (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS archive.ix_purchase_orders_created_at_id ON purchase_orders (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS archive.ix_purchase_orders_customer_id ON purchase_orders (customer_id)",
+    """CREATE TABLE IF NOT EXISTS archive.line_items (
+        row_id INTEGER NOT NULL,
+        purchase_order_id VARCHAR(36) NOT NULL,
+        position INTEGER NOT NULL,
+        item_id VARCHAR(100),
+        description TEXT NOT NULL,
+        quantity FLOAT NOT NULL,
+        unit_price_cents INTEGER NOT NULL,
+        PRIMARY KEY (row_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS archive.ix_line_items_order_position ON line_items (purchase_order_id, position)",
+    # Same columns and options as the main index; rowids are purchase_orders.doc_id
+    """CREATE VIRTUAL TABLE IF NOT EXISTS archive.purchase_order_fts USING fts5(
+        order_number, customer_name, customer_email, items, notes,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+]
+
+
+def _ids_statement(sql):
+    return text(sql).bindparams(bindparam('ids', expanding=True))
+
+
+_DUE_ORDERS = text(
+    "SELECT id FROM purchase_orders WHERE status IN :statuses AND updated_at < :cutoff ORDER BY updated_at"
+).bindparams(bindparam('statuses', expanding=True))
+
+# Repeats the due check inside the write transaction: an order may have
+# changed since the run listed it
+_LOCK_DUE_ORDERS = text(
+    "SELECT id, customer_id FROM purchase_orders WHERE id IN :ids AND status IN :statuses AND updated_at < :cutoff"
+).bindparams(bindparam('ids', expanding=True), bindparam('statuses', expanding=True))
+
+_FORGET_ARCHIVED = [
+    _ids_statement("DELETE FROM archive.purchase_order_fts WHERE rowid IN "
+                   "(SELECT doc_id FROM archive.purchase_orders WHERE id IN :ids)"),
+    _ids_statement("DELETE FROM archive.line_items WHERE purchase_order_id IN :ids"),
+    _ids_statement("DELETE FROM archive.purchase_orders WHERE id IN :ids"),
+]
+
+_ARCHIVE_ORDERS = _ids_statement(
+    f"INSERT INTO archive.purchase_orders ({_ORDER_COLUMNS}, updated_at, version, archived_at) "
+    f"SELECT {_ORDER_COLUMNS}, updated_at, version, :now FROM main.purchase_orders WHERE id IN :ids")
+
+_ARCHIVE_LINE_ITEMS = _ids_statement(
+    f"INSERT INTO archive.line_items ({_LINE_ITEM_COLUMNS}) "
+    f"SELECT {_LINE_ITEM_COLUMNS} FROM main.line_items WHERE purchase_order_id IN :ids "
+    "ORDER BY purchase_order_id, position")
+
+# Built like the main index's documents (search.py)
+_ARCHIVE_DOCUMENTS = _ids_statement(
+    "INSERT INTO archive.purchase_order_fts (rowid, order_number, customer_name, customer_email, items, notes) "
+    "SELECT a.doc_id, a.order_number, c.name, c.email, "
+    "       (SELECT group_concat(li.description, ' ') FROM archive.line_items li "
+    "        WHERE li.purchase_order_id = a.id), "
+    "       a.notes "
+    "FROM archive.purchase_orders a LEFT JOIN main.customers c ON c.id = a.customer_id "
+    "WHERE a.id IN :ids")
+
+_DELETE_ORDERS = [
+    _ids_statement("DELETE FROM main.line_items WHERE purchase_order_id IN :ids"),
+    _ids_statement("DELETE FROM main.purchase_orders WHERE id IN :ids"),
+]
+
+# Archived copies left behind by a commit that only reached the archive file
+_DUPLICATES = text(
+    "SELECT a.id FROM archive.purchase_orders a JOIN main.purchase_orders po ON po.id = a.id")
+
+_LOCK_ARCHIVED = _ids_statement(
+    "SELECT a.id, a.customer_id, po.id IS NOT NULL AS in_main FROM archive.purchase_orders a "
+    "LEFT JOIN main.purchase_orders po ON po.id = a.id WHERE a.id IN :ids")
+
+_TAKEN_NUMBERS = _ids_statement(
+    "SELECT po.order_number FROM archive.purchase_orders a "
+    "JOIN main.purchase_orders po ON po.order_number = a.order_number WHERE a.id IN :ids")
+
+# A restored order counts as changed: it gets a new version, and a new
+# updated_at keeps the next run from archiving it again straight away
+_RESTORE_ORDERS = _ids_statement(
+    f"INSERT INTO main.purchase_orders ({_ORDER_COLUMNS}, updated_at, version) "
+    f"SELECT {_ORDER_COLUMNS}, :now, version + 1 FROM archive.purchase_orders WHERE id IN :ids")
+
+_RESTORE_LINE_ITEMS = _ids_statement(
+    f"INSERT INTO main.line_items ({_LINE_ITEM_COLUMNS}) "
+    f"SELECT {_LINE_ITEM_COLUMNS} FROM archive.line_items WHERE purchase_order_id IN :ids "
+    "ORDER BY purchase_order_id, position")
+
+
+class ArchiveError(RuntimeError):
+    """Raised when orders cannot be restored from the archive."""
+
+
+def create_archive_schema(engine, journal_mode='WAL'):
+    """Create the archive tables in the attached archive database if they are missing."""
+    connection = engine.raw_connection()
+    try:
+        # Persistent in the file; the connection pragmas only reach the main database
+        connection.execute(f"PRAGMA archive.journal_mode={journal_mode}")
+        for statement in _ARCHIVE_SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def parse_statuses(value):
+    return [status.strip() for status in value.split(',') if status.strip()]
+
+
+def _chunks(order_ids, size=_ID_CHUNK):
+    for start in range(0, len(order_ids), size):
+        yield order_ids[start:start + size]
+
+
+def _execute(statements, order_ids, **params):
+    for ids in _chunks(order_ids):
+        for statement in statements:
+            db.session.execute(statement, dict(params, ids=ids))
+
+
+def _changed_customers(customer_ids):
+    # Customer order counts changed; see customers.py
+    db.session.info.setdefault('customer_ids', set()).update(customer_ids)
+
+
+def drop_duplicates():
+    """Delete archived copies of orders that are also in the main tables; returns how many."""
+    try:
+        begin_write()
+        order_ids = [row.id for row in db.session.execute(_DUPLICATES)]
+        _execute(_FORGET_ARCHIVED, order_ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if order_ids:
+        logger.warning("Dropped %s archived copies of orders still in the main database", len(order_ids))
+    return len(order_ids)
+
+
+def _archive_batch(order_ids, statuses, cutoff):
+    try:
+        begin_write()
+        rows = db.session.execute(_LOCK_DUE_ORDERS, {'ids': order_ids, 'statuses': statuses, 'cutoff': cutoff}).all()
+        order_ids = [row.id for row in rows]
+        if order_ids:
+            _execute([_ARCHIVE_ORDERS, _ARCHIVE_LINE_ITEMS, _ARCHIVE_DOCUMENTS], order_ids, now=datetime.utcnow())
+            _execute(_DELETE_ORDERS, order_ids)
+            reindex_orders(order_ids)
+            record_changes(order_ids, deleted=True)
+            _changed_customers(row.customer_id for row in rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    get_renderer().invalidate_orders(order_ids)
+    return len(order_ids)
+
+
+def archive_orders(after_days, statuses, batch_size=_ID_CHUNK, now=None, pause=0):
+    """Move the orders in statuses unchanged for after_days to the archive; returns how many moved.
+
+    Sleeps pause seconds between batches, so requests get the write lock in between.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=after_days)
+    drop_duplicates()
+    order_ids = [row.id for row in db.session.execute(_DUE_ORDERS, {'statuses': statuses, 'cutoff': cutoff})]
+    moved = 0
+    for ids in _chunks(order_ids, min(batch_size, _ID_CHUNK)):
+        if moved and pause:
+            time.sleep(pause)
+        moved += _archive_batch(ids, statuses, cutoff)
+    return moved
+
+
+def restore_orders(order_ids):
+    """Move archived orders back to the main tables; returns the ids restored.
+
+    Raises ArchiveError when a restored order's number has been given to
+    another order since it was archived.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    try:
+        begin_write()
+        rows = []
+        for ids in _chunks(order_ids):
+            rows.extend(db.session.execute(_LOCK_ARCHIVED, {'ids': ids}))
+        # An order in both files is restored by dropping its archived copy
+        restored = [row.id for row in rows if not row.in_main]
+        for ids in _chunks(restored):
+            taken = db.session.execute(_TAKEN_NUMBERS, {'ids': ids}).first()
+            if taken:
+                raise ArchiveError(f"Order number {taken.order_number} is in use by another order")
+        _execute([_RESTORE_ORDERS, _RESTORE_LINE_ITEMS], restored, now=datetime.utcnow())
+        _execute(_FORGET_ARCHIVED, [row.id for row in rows])
+        if restored:
+            reindex_orders(restored)
+            record_changes(restored)
+            _changed_customers(row.customer_id for row in rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return restored
+
+
+def snapshot_archive(config):
+    """Back up the archive database next to the main database's backups."""
+    store = BackupStore(os.path.join(backup_dir(config), 'archive'), compress=config['BACKUP_COMPRESS'])
+    manifest = take_snapshot(archive_path(config), store)
+    store.prune(config['BACKUP_KEEP'])
+    return manifest
+
+
+def run_archive(config):
+    """Archive the orders that are due under the app's settings; returns how many moved."""
+    started = time.perf_counter()
+    moved = archive_orders(config['ARCHIVE_AFTER_DAYS'], parse_statuses(config['ARCHIVE_STATUSES']),
+                           config['ARCHIVE_BATCH_SIZE'], pause=config['SCHEDULER_BATCH_PAUSE_MS'] / 1000)
+    if moved:
+        # The WAL checkpoint thread gets to the archive database too, but only
+        # every SQLITE_WAL_CHECKPOINT_INTERVAL; shrink it right after a big move
+        db.session.execute(text("PRAGMA archive.wal_checkpoint(TRUNCATE)"))
+        db.session.commit()
+        if config['BACKUP_ENABLED']:
+            snapshot_archive(config)
+    logger.info("Archived %s orders in %.1fs", moved, time.perf_counter() - started)
+    return moved
+
+
+def archive_counts():
+    return {
+        'main': db.session.query(PurchaseOrder).count(),
+        'archived': db.session.query(ArchivedPurchaseOrder).count(),
+    }
+
+
+def init_archive(app):
+    """Create the archive tables; scheduler.py runs the archiving itself."""
+    create_archive_schema(db.get_engine(app), app.config['SQLITE_JOURNAL_MODE'])
+
+
+def main(argv=None):
+    from app import create_app
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Move settled purchase orders to the archive database")
+    parser.add_argument('command', nargs='?', choices=('run', 'status'), default='run')
+    parser.add_argument('--after-days', type=int, help='archive orders unchanged for this many days '
+                                                       '(default: ARCHIVE_AFTER_DAYS)')
+    args = parser.parse_args(argv)
+
+    app = create_app({'MAIL_WORKER_ENABLED': False, 'SQLITE_WAL_CHECKPOINT_INTERVAL': 0, 'ARCHIVE_AFTER_DAYS': 0,
+                      'BACKUP_ENABLED': False})
+    with app.app_context():
+        if args.command == 'status':
+            counts = archive_counts()
+            print(f"{counts['main']} orders in the main database, {counts['archived']} archived "
+                  f"in {archive_path(app.config)}")
+            return 0
+        after_days = args.after_days if args.after_days is not None else Config.ARCHIVE_AFTER_DAYS
+        if after_days <= 0:
+            print("Set ARCHIVE_AFTER_DAYS or pass --after-days to choose which orders to archive.", file=sys.stderr)
+            return 1
+        app.config.update(ARCHIVE_AFTER_DAYS=after_days, BACKUP_ENABLED=Config.BACKUP_ENABLED)
+        print(f"Archived {run_archive(app.config)} purchase orders.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,646 @@
+"""Online database backups with WAL archiving and point-in-time restore.
+
+Snapshots are taken with SQLite's online backup API inside a read
+transaction. In WAL mode that never blocks writers, so the server keeps
+serving while a snapshot runs, and the copy is a consistent state of the
+database. Snapshots are optionally gzipped and stored with a manifest that
+holds their SHA-256.
+
+Between snapshots, the BackupWorker archives the WAL. Every pass copies the
+committed frames appended since the last pass into a segment file. Then it
+checkpoints, but only up to the frames it has archived. For that to work,
+the app's connections run with wal_autocheckpoint=0, and the periodic
+WalCheckpointer only steps in when the WAL grows past
+SQLITE_WAL_SIZE_LIMIT_MB. If the WAL was reset without the
+worker seeing all of its frames (another process checkpointed it, or the
+server restarted), the worker takes a new snapshot. Each archived WAL
+generation records whether it continues the previous one.
+
+A restore decompresses the newest snapshot taken before the target time.
+It replays the archived frames of its generation, and of the generations
+that continue it, up to the target. Checksums and PRAGMA integrity_check
+are verified before anything is swapped in:
+
+    python backup.py snapshot                  # take a snapshot now
+    python backup.py list                      # snapshots and archived WAL
+    python backup.py verify                    # check every file's checksum
+    python backup.py restore --output copy.db --at "2025-05-16 14:30"
+    python backup.py restore --replace         # stop the server first
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from extensions import logger
+from metrics import BACKUP_SECONDS
+
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+# WAL magic numbers; the last bit gives the byte order of checksum words
+WAL_MAGIC = (0x377f0682, 0x377f0683)
+
+_COPY_CHUNK = 1024 * 1024
+
+
+class BackupError(RuntimeError):
+    """Raised when a backup cannot be taken, verified or restored."""
+
+
+def wal_archiving_enabled(config):
+    return (config['BACKUP_ENABLED'] and config['BACKUP_WAL_ARCHIVE_SECONDS'] > 0
+            and config['SQLITE_JOURNAL_MODE'].upper() == 'WAL')
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_COPY_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _store(tmp, path, compress):
+    """Move tmp to path, gzipping it on the way if compress is set; return the stored file's SHA-256."""
+    if compress:
+        with open(tmp, 'rb') as src, gzip.open(path + '.part', 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, _COPY_CHUNK)
+        os.remove(tmp)
+        os.replace(path + '.part', path)
+    else:
+        os.replace(tmp, path)
+    return _sha256(path)
+
+
+def _open_stored(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _wal_checksum(data, s0, s1, byte_order):
+    words = struct.unpack(f'{byte_order}{len(data) // 4}I', data)
+    for i in range(0, len(words), 2):
+        s0 = (s0 + words[i] + s1) & 0xFFFFFFFF
+        s1 = (s1 + words[i + 1] + s0) & 0xFFFFFFFF
+    return s0, s1
+
+
+class WalHeader:
+    def __init__(self, raw):
+        magic, _, self.page_size, _, salt1, salt2, cksum1, cksum2 = struct.unpack('>8I', raw)
+        if magic not in WAL_MAGIC:
+            raise ValueError("not a WAL file")
+        self.raw = raw
+        self.byte_order = '>' if magic & 1 else '<'
+        self.salt = (salt1, salt2)
+        self.checksum = (cksum1, cksum2)
+        if _wal_checksum(raw[:24], 0, 0, self.byte_order) != self.checksum:
+            raise ValueError("WAL header checksum mismatch")
+
+    @property
+    def frame_size(self):
+        return WAL_FRAME_HEADER_SIZE + self.page_size
+
+
+def read_committed_frames(data, header, checksum):
+    """Return (frames up to the last commit, commit count, checksum after them).
+
+    data holds whole frames following earlier ones whose running checksum
+    is ``checksum``. Reading stops at the first frame from another WAL
+    generation, with a bad checksum or partly written.
+    """
+    frame_size = header.frame_size
+    committed_end, committed_checksum, commits = 0, checksum, 0
+    offset = 0
+    while offset + frame_size <= len(data):
+        frame_header = data[offset:offset + WAL_FRAME_HEADER_SIZE]
+        _, commit_size, salt1, salt2, cksum1, cksum2 = struct.unpack('>6I', frame_header)
+        if (salt1, salt2) != header.salt:
+            break
+        checksum = _wal_checksum(frame_header[:8], *checksum, header.byte_order)
+        checksum = _wal_checksum(data[offset + WAL_FRAME_HEADER_SIZE:offset + frame_size], *checksum,
+                                 header.byte_order)
+        if checksum != (cksum1, cksum2):
+            break
+        offset += frame_size
+        if commit_size:
+            committed_end, committed_checksum = offset, checksum
+            commits += 1
+    return data[:committed_end], commits, committed_checksum
+
+
+class BackupStore:
+    """The snapshot and WAL archive files under one backup directory.
+
+    snapshots/<time>.db[.gz] with a <time>.json manifest, and
+    wal/<generation>/ holding generation.json and one segment per archive
+    pass, <first frame>-<last frame>.wal[.gz] with its .json manifest.
+    """
+
+    def __init__(self, directory, compress=True):
+        self.directory = directory
+        self.compress = compress
+        self.snapshot_dir = os.path.join(directory, 'snapshots')
+        self.wal_dir = os.path.join(directory, 'wal')
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        os.makedirs(self.wal_dir, exist_ok=True)
+
+    def snapshots(self):
+        """Snapshot manifests, oldest first."""
+        names = sorted(name for name in os.listdir(self.snapshot_dir) if name.endswith('.json'))
+        return [_read_json(os.path.join(self.snapshot_dir, name)) for name in names]
+
+    def write_snapshot(self, source, generation=None, wal_frames=0):
+        """Copy the database behind the source connection (in its current read transaction, if any)."""
+        created = datetime.utcnow()
+        name = created.strftime('%Y%m%dT%H%M%S%f')
+        tmp = os.path.join(self.snapshot_dir, name + '.db.tmp')
+        dest = sqlite3.connect(tmp)
+        try:
+            # One step: a single read transaction, so the copy is consistent
+            source.backup(dest)
+        finally:
+            dest.close()
+        size = os.path.getsize(tmp)
+        filename = name + ('.db.gz' if self.compress else '.db')
+        manifest = {
+            'name': name,
+            'file': filename,
+            'createdAt': created.isoformat(' '),
+            'size': size,
+            'sha256': _store(tmp, os.path.join(self.snapshot_dir, filename), self.compress),
+            # WAL generation the snapshot was taken in, and the frames archived at the time
+            'generation': generation,
+            'walFrames': wal_frames,
+        }
+        _write_json(os.path.join(self.snapshot_dir, name + '.json'), manifest)
+        return manifest
+
+    def generations(self):
+        """Generation manifests, oldest first."""
+        return [_read_json(os.path.join(self.wal_dir, name, 'generation.json'))
+                for name in sorted(os.listdir(self.wal_dir))
+                if os.path.exists(os.path.join(self.wal_dir, name, 'generation.json'))]
+
+    def start_generation(self, header, continues=None):
+        existing = sorted(os.listdir(self.wal_dir))
+        sequence = int(existing[-1].split('-')[0]) + 1 if existing else 1
+        generation = f"{sequence:06d}-{header.salt[0]:08x}{header.salt[1]:08x}"
+        os.makedirs(os.path.join(self.wal_dir, generation))
+        _write_json(os.path.join(self.wal_dir, generation, 'generation.json'), {
+            'id': generation,
+            'startedAt': datetime.utcnow().isoformat(' '),
+            'header': header.raw.hex(),
+            # The previous generation, when all of its frames were archived before this one began
+            'continues': continues,
+        })
+        return generation
+
+    def segments(self, generation):
+        directory = os.path.join(self.wal_dir, generation)
+        names = sorted(name for name in os.listdir(directory)
+                       if name.endswith('.json') and name != 'generation.json')
+        return [_read_json(os.path.join(directory, name)) for name in names]
+
+    def write_segment(self, generation, first_frame, last_frame, frames, read_at):
+        directory = os.path.join(self.wal_dir, generation)
+        name = f"{first_frame:010d}-{last_frame:010d}"
+        tmp = os.path.join(directory, name + '.wal.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(frames)
+        filename = name + ('.wal.gz' if self.compress else '.wal')
+        _write_json(os.path.join(directory, name + '.json'), {
+            'generation': generation,
+            'file': filename,
+            'firstFrame': first_frame,
+            'lastFrame': last_frame,
+            # Every commit before this time is in this segment or an earlier one
+            'archivedAt': read_at.isoformat(' '),
+            'sha256': _store(tmp, os.path.join(directory, filename), self.compress),
+        })
+
+    def prune(self, keep):
+        """Delete all but the newest ``keep`` snapshots and the WAL only they could replay."""
+        snapshots = self.snapshots()
+        for manifest in snapshots[:-keep] if keep > 0 else []:
+            for filename in (manifest['file'], manifest['name'] + '.json'):
+                path = os.path.join(self.snapshot_dir, filename)
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.info("Deleted backup snapshot %s", manifest['name'])
+        kept = [manifest['generation'] for manifest in snapshots[-keep:] if manifest['generation']]
+        generations = sorted(os.listdir(self.wal_dir))
+        # The newest generation may still be written to
+        oldest_needed = min(kept) if kept else generations[-1] if generations else None
+        for generation in generations:
+            if oldest_needed and generation < oldest_needed:
+                shutil.rmtree(os.path.join(self.wal_dir, generation))
+                logger.info("Deleted archived WAL generation %s", generation)
+
+    def verify(self):
+        """Return a list of problems: missing files and checksum mismatches."""
+        problems = []
+        files = [(os.path.join(self.snapshot_dir, m['file']), m['sha256']) for m in self.snapshots()]
+        for generation in self.generations():
+            directory = os.path.join(self.wal_dir, generation['id'])
+            files.extend((os.path.join(directory, s['file']), s['sha256']) for s in self.segments(generation['id']))
+        for path, expected in files:
+            if not os.path.exists(path):
+                problems.append(f"{path}: missing")
+            elif _sha256(path) != expected:
+                problems.append(f"{path}: checksum mismatch")
+        return problems
+
+
+class WalArchiver:
+    """Takes snapshots and archives committed WAL frames of one database."""
+
+    def __init__(self, db_path, store, busy_timeout=30.0):
+        self.db_path = db_path
+        self.wal_path = db_path + '-wal'
+        self.store = store
+        self.busy_timeout = busy_timeout
+        self.generation = None
+        self.header = None
+        self.frames = 0
+        self.checksum = None
+        # All archived frames were checkpointed by the last pass, so a WAL reset loses nothing
+        self.sealed = False
+        # The archived WAL cannot be replayed until a snapshot is taken in this generation
+        self.needs_snapshot = True
+        # Passes run on the backup worker and, for an oversized WAL, the WAL checkpoint thread
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, isolation_level=None, timeout=self.busy_timeout,
+                               check_same_thread=False)
+
+    def run_pass(self, archive=True, snapshot=False):
+        """Archive new WAL frames, take a snapshot if asked or needed, then checkpoint.
+
+        Everything happens inside one read transaction. It keeps the
+        checkpoint from going past frames this pass has not archived.
+        Returns the snapshot manifest, if one was taken.
+        """
+        with self._lock:
+            return self._run_pass(archive, snapshot)
+
+    def _run_pass(self, archive, snapshot):
+        reader = self._connect()
+        manifest = None
+        try:
+            reader.execute("BEGIN")
+            reader.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            if archive:
+                self._archive()
+            if snapshot or (archive and self.needs_snapshot and self.generation is not None):
+                started = time.perf_counter()
+                manifest = self.store.write_snapshot(reader, self.generation, self.frames)
+                BACKUP_SECONDS.observe(time.perf_counter() - started, 'snapshot', 'ok')
+                self.needs_snapshot = self.generation is None
+                logger.info("Backup snapshot %s taken (%s bytes) in %.2fs",
+                            manifest['name'], manifest['size'], time.perf_counter() - started)
+            if archive:
+                self._checkpoint()
+            reader.execute("COMMIT")
+        finally:
+            reader.close()
+        return manifest
+
+    def _archive(self):
+        started = time.perf_counter()
+        read_at = datetime.utcnow()
+        try:
+            with open(self.wal_path, 'rb') as f:
+                header = WalHeader(f.read(WAL_HEADER_SIZE))
+                new_generation = header.salt != (self.header.salt if self.header else None)
+                f.seek(WAL_HEADER_SIZE + (0 if new_generation else self.frames) * header.frame_size)
+                data = f.read()
+        except (OSError, ValueError, struct.error):
+            # No WAL yet (or an empty one); unless everything was archived and
+            # checkpointed, whatever comes next cannot be replayed from the old snapshot
+            if not self.sealed:
+                self.generation = None
+                self.header = None
+                self.needs_snapshot = True
+            return
+        # Outside the try, so that a backup directory we cannot write to is an error
+        if new_generation:
+            self._start_generation(header)
+
+        frames, _, checksum = read_committed_frames(data, header, self.checksum)
+        if not frames:
+            return
+        count = len(frames) // header.frame_size
+        self.store.write_segment(self.generation, self.frames + 1, self.frames + count, frames, read_at)
+        self.frames += count
+        self.checksum = checksum
+        BACKUP_SECONDS.observe(time.perf_counter() - started, 'wal', 'ok')
+        logger.debug("Archived WAL frames up to %s of generation %s", self.frames, self.generation)
+
+    def _start_generation(self, header):
+        continues = self.generation if self.generation is not None and self.sealed else None
+        if self.generation is not None and continues is None:
+            logger.warning("WAL generation %s was reset before it was fully archived; taking a new snapshot",
+                           self.generation)
+            self.needs_snapshot = True
+        self.generation = self.store.start_generation(header, continues)
+        self.header = header
+        self.frames = 0
+        self.checksum = header.checksum
+        self.sealed = False
+
+    def _checkpoint(self):
+        conn = self._connect()
+        try:
+            busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        finally:
+            conn.close()
+        self.sealed = self.generation is not None and log_frames == checkpointed
+        logger.debug("WAL checkpoint: %s/%s frames, busy=%s", checkpointed, log_frames, busy)
+
+    def checkpoint_unarchived(self, mode='PASSIVE'):
+        """Keep the WAL bounded after an archiving failure; the next pass starts a new generation."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(f"PRAGMA wal_checkpoint({mode})")
+            finally:
+                conn.close()
+            self.generation = None
+            self.header = None
+            self.sealed = False
+            self.needs_snapshot = True
+
+
+class BackupWorker(threading.Thread):
+    """Background thread taking scheduled snapshots and archiving the WAL."""
+
+    def __init__(self, archiver, snapshot_interval, archive_interval, keep, start_delay=0):
+        super().__init__(name='backup', daemon=True)
+        self.archiver = archiver
+        self.snapshot_interval = snapshot_interval
+        self.archive_interval = archive_interval
+        self.keep = keep
+        self.start_delay = start_delay
+        self._stop_event = threading.Event()
+        self._last_snapshot = None
+
+    def run(self):
+        # The first pass may copy the whole database; keep it clear of startup
+        if self._stop_event.wait(self.start_delay):
+            return
+        last = self.archiver.store.snapshots()
+        self._last_snapshot = datetime.fromisoformat(last[-1]['createdAt']) if last else None
+        interval = self.archive_interval or min(self.snapshot_interval, 3600)
+        while True:
+            self.run_once()
+            if self._stop_event.wait(interval):
+                return
+
+    def run_once(self):
+        now = datetime.utcnow()
+        snapshot_due = (self._last_snapshot is None or
+                        now - self._last_snapshot >= timedelta(seconds=self.snapshot_interval))
+        if not self.archive_interval and not snapshot_due:
+            return
+        try:
+            manifest = self.archiver.run_pass(archive=bool(self.archive_interval), snapshot=snapshot_due)
+        except Exception as e:
+            BACKUP_SECONDS.observe(0, 'wal' if self.archive_interval else 'snapshot', 'error')
+            logger.error("Backup pass failed: %s", e, exc_info=True)
+            if self.archive_interval:
+                try:
+                    self.archiver.checkpoint_unarchived()
+                except Exception as checkpoint_error:
+                    logger.warning("WAL checkpoint failed: %s", checkpoint_error)
+            return
+        if manifest is not None:
+            self._last_snapshot = now
+            try:
+                self.archiver.store.prune(self.keep)
+            except OSError as e:
+                logger.warning("Could not prune old backups: %s", e)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def take_snapshot(db_path, store):
+    """Snapshot a database file that is not WAL-archived into store; returns the manifest."""
+    source = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        manifest = store.write_snapshot(source)
+        source.execute("COMMIT")
+    finally:
+        source.close()
+    return manifest
+
+
+def backup_dir(config):
+    return config['BACKUP_DIR'] or os.path.join(os.path.dirname(config['DATABASE_PATH']), 'backups')
+
+
+def init_backups(app):
+    """Start the backup worker unless BACKUP_ENABLED is off."""
+    worker = None
+    config = app.config
+    if config['BACKUP_ENABLED']:
+        store = BackupStore(backup_dir(config), compress=config['BACKUP_COMPRESS'])
+        archiver = WalArchiver(config['DATABASE_PATH'], store, config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0)
+        worker = BackupWorker(
+            archiver,
+            snapshot_interval=config['BACKUP_INTERVAL_HOURS'] * 3600,
+            archive_interval=config['BACKUP_WAL_ARCHIVE_SECONDS'] if wal_archiving_enabled(config) else 0,
+            keep=config['BACKUP_KEEP'],
+            start_delay=config['BACKGROUND_START_DELAY'],
+        )
+        worker.start()
+        checkpointer = app.extensions.get('wal_checkpointer')
+        if checkpointer is not None and wal_archiving_enabled(config):
+            checkpointer.archiver = archiver
+        logger.debug("Backups go to %s", store.directory)
+    app.extensions['backup_worker'] = worker
+    return worker
+
+
+def restore(store, output, at=None):
+    """Rebuild the database as of ``at`` (default: the latest archived state) into output.
+
+    Returns a description of what was restored. The result is checked with
+    PRAGMA integrity_check before it is moved to output.
+    """
+    at = at or datetime.max
+    candidates = [m for m in store.snapshots() if datetime.fromisoformat(m['createdAt']) <= at]
+    if not candidates:
+        raise BackupError("No snapshot was taken before the requested time")
+    snapshot = candidates[-1]
+    # A snapshot taken outside the worker (python backup.py snapshot) has no WAL to
+    # replay; a PITR base replayed up to a later point beats it
+    based = [m for m in candidates if m['generation']]
+    if not snapshot['generation'] and based:
+        archived = [s['archivedAt'] for g in store.generations() for s in store.segments(g['id'])
+                    if datetime.fromisoformat(s['archivedAt']) <= at]
+        if archived and max(archived) > snapshot['createdAt']:
+            snapshot = based[-1]
+    snapshot_path = os.path.join(store.snapshot_dir, snapshot['file'])
+    if _sha256(snapshot_path) != snapshot['sha256']:
+        raise BackupError(f"Snapshot {snapshot['name']} does not match its checksum")
+
+    tmp = output + '.restoring'
+    with _open_stored(snapshot_path) as src, open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, _COPY_CHUNK)
+
+    replayed, restored_to = 0, snapshot['createdAt']
+    try:
+        if snapshot['generation']:
+            replayed, restored_to = _replay_wal(store, snapshot, tmp, at)
+        conn = sqlite3.connect(tmp)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if result != 'ok':
+            raise BackupError(f"Restored database failed the integrity check: {result}")
+    except Exception:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, output)
+    return {'snapshot': snapshot['name'], 'framesReplayed': replayed, 'restoredTo': restored_to}
+
+
+def _segments_to_replay(store, snapshot, at):
+    """Yield (generation header, segment path, manifest) to apply on top of the snapshot, in order."""
+    generations = {g['id']: g for g in store.generations()}
+    generation = generations.get(snapshot['generation'])
+    while generation is not None:
+        header = WalHeader(bytes.fromhex(generation['header']))
+        expected_frame = 1
+        for segment in store.segments(generation['id']):
+            # Frames archived up to the snapshot are needed whatever the target
+            required = generation['id'] == snapshot['generation'] and segment['lastFrame'] <= snapshot['walFrames']
+            if not required and datetime.fromisoformat(segment['archivedAt']) > at:
+                return
+            if segment['firstFrame'] != expected_frame:
+                raise BackupError(f"Archived WAL of generation {generation['id']} has a gap "
+                                  f"before frame {segment['firstFrame']}")
+            expected_frame = segment['lastFrame'] + 1
+            yield header, os.path.join(store.wal_dir, generation['id'], segment['file']), segment
+        generation = next((g for g in generations.values() if g['continues'] == generation['id']), None)
+
+
+def _replay_wal(store, snapshot, path, at):
+    """Write the page images of the archived frames into the restored file; return (frames, time)."""
+    replayed, restored_to, db_pages, page_size = 0, snapshot['createdAt'], None, None
+    checksums = {}
+    with open(path, 'r+b') as db:
+        for header, segment_path, segment in _segments_to_replay(store, snapshot, at):
+            if _sha256(segment_path) != segment['sha256']:
+                raise BackupError(f"{segment_path} does not match its checksum")
+            with _open_stored(segment_path) as f:
+                data = f.read()
+            # The frame checksums chain through the whole generation
+            checksum = checksums.get(segment['generation'], header.checksum)
+            frames, _, checksums[segment['generation']] = read_committed_frames(data, header, checksum)
+            if len(frames) != len(data):
+                raise BackupError(f"{segment_path} holds invalid WAL frames")
+
+            page_size = header.page_size
+            for offset in range(0, len(frames), header.frame_size):
+                page_no, commit_size = struct.unpack('>2I', frames[offset:offset + 8])
+                db.seek((page_no - 1) * page_size)
+                db.write(frames[offset + WAL_FRAME_HEADER_SIZE:offset + header.frame_size])
+                if commit_size:
+                    db_pages = commit_size
+            replayed += len(frames) // header.frame_size
+            restored_to = segment['archivedAt']
+        if db_pages is not None:
+            db.truncate(db_pages * page_size)
+    return replayed, restored_to
+
+
+def replace_database(restored, db_path):
+    """Swap a restored database in, keeping the current one (and its WAL) as <name>.before-restore-<time>."""
+    suffix = datetime.now().strftime('%Y%m%d%H%M%S')
+    for extension in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + extension):
+            os.replace(db_path + extension, f"{db_path}.before-restore-{suffix}{extension}")
+    os.replace(restored, db_path)
+
+
+def main(argv=None):
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="StitchPay database backups")
+    parser.add_argument('--db', default=Config.DATABASE_PATH, help='database file (default: %(default)s)')
+    parser.add_argument('--dir', help='backup directory (default: BACKUP_DIR or a backups folder next to the database)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('snapshot', help='take a snapshot now')
+    commands.add_parser('list', help='list snapshots and archived WAL')
+    commands.add_parser('verify', help='check the checksum of every backup file')
+    restore_parser = commands.add_parser('restore', help='restore a snapshot plus archived WAL')
+    restore_parser.add_argument('--at', type=datetime.fromisoformat,
+                                help='UTC time to restore to (default: the latest archived state)')
+    target = restore_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--output', help='write the restored database here')
+    target.add_argument('--replace', action='store_true', help='replace --db; stop the server first')
+    args = parser.parse_args(argv)
+
+    store = BackupStore(args.dir or backup_dir({'BACKUP_DIR': Config.BACKUP_DIR, 'DATABASE_PATH': args.db}),
+                        compress=Config.BACKUP_COMPRESS)
+    if args.command == 'snapshot':
+        manifest = take_snapshot(args.db, store)
+        print(f"Snapshot {manifest['name']} written to {store.snapshot_dir}")
+    elif args.command == 'list':
+        for manifest in store.snapshots():
+            print(f"snapshot   {manifest['name']}  {manifest['createdAt']}  {manifest['size']:>12} bytes  "
+                  f"generation {manifest['generation'] or '-'}")
+        for generation in store.generations():
+            segments = store.segments(generation['id'])
+            last = f"{segments[-1]['lastFrame']} frames up to {segments[-1]['archivedAt']}" if segments else "empty"
+            print(f"generation {generation['id']}  started {generation['startedAt']}  {last}  "
+                  f"continues {generation['continues'] or '-'}")
+    elif args.command == 'verify':
+        problems = store.verify()
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        print("All backup files match their checksums." if not problems else f"{len(problems)} problems found.")
+        return 1 if problems else 0
+    else:
+        output = args.output or args.db + '.restored'
+        try:
+            result = restore(store, output, args.at)
+        except BackupError as e:
+            print(f"Restore failed: {e}", file=sys.stderr)
+            return 1
+        if args.replace:
+            replace_database(output, args.db)
+            output = args.db
+        print(f"Restored snapshot {result['snapshot']} plus {result['framesReplayed']} WAL frames "
+              f"(state as of {result['restoredTo']}) to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
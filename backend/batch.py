@@ -0,0 +1,217 @@
+"""Batch updates and deletes of purchase orders, selected by id or by listing filter.
+
+A batch is one transaction that takes SQLite's write lock before reading
+anything (database.begin_write), so the orders cannot change between the
+read and the write. The orders' current state is read with two queries,
+the change is applied with set-based UPDATE and DELETE statements, and
+everything derived from the orders is kept in step as the single-order
+handlers do it: the summary and rollup tables, the search index, the
+change feed and, after the commit, cached PDFs.
+
+Every requested order gets an outcome: 'updated' or 'deleted',
+'not_found', or 'conflict' when the client sent the version it last read
+and the order has changed since.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from changes import record_changes
+from database import begin_write
+from extensions import db
+from models import Customer, LineItem, PurchaseOrder
+from money import line_amount_cents, parse_number, tax_cents
+from pdf_generator import get_renderer
+from search import reindex_orders
+from stats import record_order_changes
+from validation import parse_date
+
+# API fields a batch update may set
+BATCH_FIELDS = ('status', 'notes', 'dueDate', 'taxRate')
+
+# SQLite caps bound parameters per statement; stay well under the old 999 limit
+_ID_CHUNK = 500
+
+
+class BatchError(ValueError):
+    """Raised for a batch request that is malformed or names too many orders."""
+
+
+def parse_targets(items):
+    """Parse the "ids" of a batch request into (order id, expected version or None) pairs.
+
+    Each item is an order id, or an object with "id" and optionally the
+    "version" the client last read.
+    """
+    if not isinstance(items, list) or not items:
+        raise BatchError("ids must be a non-empty list")
+    targets = {}
+    for item in items:
+        version = None
+        if isinstance(item, dict):
+            order_id, version = item.get('id'), item.get('version')
+            if version is not None and (isinstance(version, bool) or not isinstance(version, int)):
+                raise BatchError("version must be an integer")
+        else:
+            order_id = item
+        if not isinstance(order_id, str) or not order_id:
+            raise BatchError("Each item of ids must be an order id or an object with an id")
+        targets[order_id] = version
+    return list(targets.items())
+
+
+def parse_changes(data):
+    """Validate the "set" object of a batch update and return PurchaseOrder column values."""
+    if not isinstance(data, dict) or not data:
+        raise BatchError(f"set must be an object with any of: {', '.join(BATCH_FIELDS)}")
+    unknown = sorted(set(data) - set(BATCH_FIELDS))
+    if unknown:
+        raise BatchError(f"Cannot change {', '.join(unknown)} in a batch; allowed: {', '.join(BATCH_FIELDS)}")
+
+    values = {}
+    if 'status' in data:
+        status = data['status']
+        if not isinstance(status, str) or not 1 <= len(status) <= 20:
+            raise BatchError("status must be a string of 1-20 characters")
+        values['status'] = status
+    if 'notes' in data:
+        if data['notes'] is not None and not isinstance(data['notes'], str):
+            raise BatchError("notes must be a string")
+        values['notes'] = data['notes']
+    try:
+        if 'dueDate' in data:
+            # null clears the due date
+            values['due_date'] = parse_date(data['dueDate'])
+        if 'taxRate' in data:
+            values['tax_rate'] = parse_number(data['taxRate'], 'taxRate')
+    except ValueError as e:
+        raise BatchError(str(e))
+    return values
+
+
+def _chunks(order_ids):
+    for start in range(0, len(order_ids), _ID_CHUNK):
+        yield order_ids[start:start + _ID_CHUNK]
+
+
+def _load_orders(order_ids):
+    """Map each existing order id to (version, subtotal cents, stats snapshot)."""
+    found = {}
+    for ids in _chunks(order_ids):
+        items = defaultdict(list)
+        for item in (db.session.query(LineItem.purchase_order_id, LineItem.description, LineItem.quantity,
+                                      LineItem.unit_price_cents)
+                     .filter(LineItem.purchase_order_id.in_(ids))
+                     .order_by(LineItem.purchase_order_id, LineItem.position)):
+            items[item.purchase_order_id].append(
+                (item.description, item.quantity, line_amount_cents(item.quantity, item.unit_price_cents)))
+        rows = (db.session.query(PurchaseOrder.id, PurchaseOrder.version, PurchaseOrder.status,
+                                 PurchaseOrder.subtotal_cents, PurchaseOrder.total_cents, PurchaseOrder.created_at,
+                                 PurchaseOrder.due_date, PurchaseOrder.customer_id, Customer.name)
+                .outerjoin(Customer, Customer.id == PurchaseOrder.customer_id)
+                .filter(PurchaseOrder.id.in_(ids)))
+        for row in rows:
+            # Same shape as stats.order_snapshot()
+            found[row.id] = (row.version, row.subtotal_cents, {
+                'status': row.status,
+                'total_cents': row.total_cents or 0,
+                'created_at': row.created_at,
+                'due_date': row.due_date,
+                'customer': row.name or '',
+                'customer_id': row.customer_id,
+                'items': items[row.id],
+            })
+    return found
+
+
+def _check_targets(targets, found):
+    """Split targets into the ids to change and the outcomes of the others."""
+    eligible, outcomes = [], {}
+    for order_id, version in targets:
+        current = found.get(order_id)
+        if current is None:
+            outcomes[order_id] = {'id': order_id, 'outcome': 'not_found'}
+        elif version is not None and version != current[0]:
+            outcomes[order_id] = {'id': order_id, 'outcome': 'conflict', 'version': current[0]}
+        else:
+            eligible.append(order_id)
+    return eligible, outcomes
+
+
+def update_orders(targets, values):
+    """Apply parse_changes() values to the targeted orders; return their outcomes in request order.
+
+    A new tax rate recalculates each order's tax and total from its stored
+    subtotal. Every updated order gets a new version and updated_at.
+    """
+    table = PurchaseOrder.__table__
+    try:
+        begin_write()
+        found = _load_orders([order_id for order_id, _ in targets])
+        eligible, outcomes = _check_targets(targets, found)
+        now = datetime.utcnow()
+        if eligible:
+            assignments = dict(values, updated_at=now, version=table.c.version + 1)
+            if 'tax_rate' in values:
+                # Tax and total differ per order: one parameter set per order for the same statement
+                statement = table.update().where(table.c.id == bindparam('order_id')).values(
+                    tax_amount_cents=bindparam('tax'), total_cents=bindparam('total'), **assignments)
+                parameters = []
+                for order_id in eligible:
+                    subtotal = found[order_id][1]
+                    tax = tax_cents(subtotal, values['tax_rate'])
+                    parameters.append({'order_id': order_id, 'tax': tax, 'total': subtotal + tax})
+                db.session.execute(statement, parameters)
+            else:
+                for ids in _chunks(eligible):
+                    db.session.execute(table.update().where(table.c.id.in_(ids)).values(**assignments))
+
+            changes = []
+            for order_id in eligible:
+                _, subtotal, old = found[order_id]
+                new = dict(old)
+                new['status'] = values.get('status', old['status'])
+                new['due_date'] = values['due_date'] if 'due_date' in values else old['due_date']
+                if 'tax_rate' in values:
+                    new['total_cents'] = subtotal + tax_cents(subtotal, values['tax_rate'])
+                changes.append((old, new))
+            record_order_changes(changes)
+            if 'notes' in values:
+                reindex_orders(eligible)
+            record_changes(eligible)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    get_renderer().invalidate_orders(eligible)
+    for order_id in eligible:
+        outcomes[order_id] = {'id': order_id, 'outcome': 'updated', 'version': found[order_id][0] + 1,
+                              'updatedAt': now.isoformat()}
+    return [outcomes[order_id] for order_id, _ in targets]
+
+
+def delete_orders(targets):
+    """Delete the targeted orders with their line items; return their outcomes in request order."""
+    try:
+        begin_write()
+        found = _load_orders([order_id for order_id, _ in targets])
+        eligible, outcomes = _check_targets(targets, found)
+        if eligible:
+            record_order_changes([(found[order_id][2], None) for order_id in eligible])
+            # Explicit, so it does not depend on SQLITE_FOREIGN_KEYS for the cascade
+            for ids in _chunks(eligible):
+                db.session.execute(LineItem.__table__.delete().where(LineItem.purchase_order_id.in_(ids)))
+                db.session.execute(PurchaseOrder.__table__.delete().where(PurchaseOrder.id.in_(ids)))
+            reindex_orders(eligible)
+            record_changes(eligible, deleted=True)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    get_renderer().invalidate_orders(eligible)
+    for order_id in eligible:
+        outcomes[order_id] = {'id': order_id, 'outcome': 'deleted'}
+    return [outcomes[order_id] for order_id, _ in targets]
@@ -0,0 +1,132 @@
+"""Time from process start to the first successful GET /health.
+
+Starts the backend the way the packaged app does (create_app served by
+waitress) in a fresh interpreter, polls /health until it answers and kills
+the process, --runs times. The database is created and migrated by a
+warm-up run first, so the timed runs start against a current schema, as
+the desktop app usually does. Reports the minimum, median and maximum
+time to the first /health, and the startup phase breakdown that
+create_app logs, averaged over the runs.
+
+    python benchmarks/cold_start.py --runs 10
+    python benchmarks/cold_start.py --db instance/stitchpay.db --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+BOOTSTRAP = """
+import sys
+sys.path.insert(0, {backend!r})
+from app import create_app
+from waitress import serve
+serve(create_app(), host='127.0.0.1', port={port}, threads=4)
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def startup_phases(stderr):
+    """The phase timings from create_app's JSON startup log line, if any."""
+    for line in stderr.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and 'startupMs' in record:
+            return record['startupMs']
+    return {}
+
+
+def start_once(db_path, timeout):
+    """Start the backend, wait for /health, stop it; returns (seconds, phases)."""
+    port = free_port()
+    env = dict(os.environ, STITCHPAY_DB_PATH=db_path, LOG_FORMAT='json', LOG_LEVEL='INFO',
+               BACKUP_ENABLED='false', MAIL_WORKER_ENABLED='false')
+    url = f"http://127.0.0.1:{port}/health"
+    with tempfile.TemporaryFile() as stderr:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', BOOTSTRAP.format(backend=BACKEND_DIR, port=port)],
+                                   env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        try:
+            while True:
+                if process.poll() is not None:
+                    stderr.seek(0)
+                    raise RuntimeError(f"Backend exited with {process.returncode}:\n"
+                                       f"{stderr.read().decode(errors='replace')}")
+                try:
+                    with urllib.request.urlopen(url, timeout=1) as response:
+                        if response.status == 200:
+                            elapsed = time.perf_counter() - started
+                            break
+                except (urllib.error.URLError, ConnectionError):
+                    pass
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"No answer from /health within {timeout}s")
+                time.sleep(0.01)
+        finally:
+            process.kill()
+            process.wait()
+        stderr.seek(0)
+        return elapsed, startup_phases(stderr.read().decode(errors='replace'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--db', help="copy of this database to start against (default: a new one)")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for one start")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stitchpay-bench-')
+    try:
+        db_path = os.path.join(workdir, 'stitchpay.db')
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+        warmup, _ = start_once(db_path, args.timeout)
+        print(f"warm-up (creates or migrates the database): {warmup * 1000:.0f} ms")
+
+        times, phases = [], defaultdict(list)
+        for _ in range(args.runs):
+            elapsed, run_phases = start_once(db_path, args.timeout)
+            times.append(elapsed)
+            for phase, ms in run_phases.items():
+                phases[phase].append(ms)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        'runs': args.runs,
+        'min_ms': round(min(times) * 1000, 1),
+        'median_ms': round(statistics.median(times) * 1000, 1),
+        'max_ms': round(max(times) * 1000, 1),
+        'phases_ms': {phase: round(statistics.mean(values), 1) for phase, values in phases.items()},
+    }
+    print(f"time to first /health over {args.runs} runs: min {result['min_ms']} ms  "
+          f"median {result['median_ms']} ms  max {result['max_ms']} ms")
+    for phase, ms in result['phases_ms'].items():
+        print(f"{phase:>16}: {ms:>7} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
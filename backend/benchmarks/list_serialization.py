@@ -0,0 +1,78 @@
+"""Time a full purchase order list response: to_dict() + json vs. OrderEncoder.
+
+Seeds a scratch database per size (through the load test's generator) and
+encodes every order both ways, checking that the two outputs decode to the
+same list.
+
+    python benchmarks/list_serialization.py --sizes 10000 100000
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from load_test import seed_database  # noqa: E402
+
+
+def encode_with_to_dict():
+    from models import PurchaseOrder
+
+    orders = PurchaseOrder.query.order_by(PurchaseOrder.created_at, PurchaseOrder.id).all()
+    return json.dumps([order.to_dict() for order in orders]).encode('utf-8')
+
+
+def encode_with_encoder():
+    from models import PurchaseOrder
+    from serialization import stream_json_array
+
+    return b''.join(stream_json_array(PurchaseOrder.query))
+
+
+def run(size, repeat):
+    from app import create_app
+    from extensions import db
+
+    workdir = tempfile.mkdtemp(prefix='stitchpay-serialization-')
+    try:
+        db_path = os.path.join(workdir, 'stitchpay.db')
+        seed_database(db_path, size)
+        app = create_app({'DATABASE_PATH': db_path, 'MAIL_WORKER_ENABLED': False,
+                          'SQLITE_WAL_CHECKPOINT_INTERVAL': 0, 'METRICS_ENABLED': False})
+        results = {}
+        with app.app_context():
+            for label, encode in (('to_dict + json', encode_with_to_dict), ('OrderEncoder', encode_with_encoder)):
+                timings = []
+                for _ in range(repeat):
+                    db.session.expunge_all()
+                    started = time.perf_counter()
+                    body = encode()
+                    timings.append(time.perf_counter() - started)
+                results[label] = (min(timings), body)
+        baseline, fast = results['to_dict + json'][1], results['OrderEncoder'][1]
+        if json.loads(baseline) != json.loads(fast):
+            raise SystemExit(f"Encoded output differs at {size} orders")
+        for label, (seconds, body) in results.items():
+            print(f"{size:>8} orders  {label:<15} {seconds:>7.2f}s  {len(body) / 1e6:>7.1f} MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3, help="runs per encoder; the fastest is reported")
+    args = parser.parse_args()
+
+    logging.getLogger('stitchpay').setLevel(logging.WARNING)
+    for size in args.sizes:
+        run(size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
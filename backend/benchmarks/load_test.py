@@ -0,0 +1,467 @@
+"""Load test of the API served by waitress, with JSON results and regression checks.
+
+Seeds a scratch stitchpay.db with realistic purchase orders, starts the app
+under waitress in a child process and drives it with concurrent HTTP
+clients running a weighted mix of create, list, get, update, delete and
+PDF requests. Latency percentiles, throughput and the server's peak RSS are
+written to a JSON file that a later run can be compared against.
+
+    python benchmarks/load_test.py run --orders 10000 --clients 8 --duration 30 --output results.json
+    python benchmarks/load_test.py compare baseline.json results.json --threshold 10
+
+compare exits with status 1 when any operation regressed by more than the
+threshold (percent), so it can gate a CI job.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+DEFAULT_MIX = 'create=15,list=30,get=35,update=10,delete=5,pdf=5'
+OPERATIONS = ('create', 'list', 'get', 'update', 'delete', 'pdf')
+STATUSES = ('unpaid', 'unpaid', 'paid', 'paid', 'paid', 'cancelled')
+CATALOGUE = [
+    ('Embroidered cap', 4.5), ('Polo shirt, left chest logo', 11.25), ('Hoodie, back print', 18.0),
+    ('Tote bag', 3.8), ('Work jacket, name patch', 24.5), ('Digitizing fee', 35.0),
+    ('Beanie, 3D puff', 6.75), ('Apron', 9.1), ('Towel monogram', 7.2), ('Setup charge', 15.0),
+]
+FIRST_NAMES = ('Ava', 'Ben', 'Chloe', 'Diego', 'Emma', 'Farah', 'Gus', 'Hana', 'Ivan', 'June')
+LAST_NAMES = ('Smith', 'Garcia', 'Nguyen', 'Okafor', 'Rossi', 'Kim', 'Novak', 'Larsen', 'Haddad', 'Ortiz')
+
+# Metrics compared between runs: (key, higher is better)
+COMPARED_METRICS = (('p50_ms', False), ('p95_ms', False), ('p99_ms', False), ('throughput', True))
+
+
+def make_order(rng, customers=1000, created_at=None):
+    """A purchase order payload with a repeat customer and a few catalogue items."""
+    n = rng.randrange(customers)
+    name = f"{FIRST_NAMES[n % 10]} {LAST_NAMES[n // 10 % 10]} {n}"
+    items = []
+    for _ in range(rng.randint(1, 6)):
+        description, price = rng.choice(CATALOGUE)
+        items.append({'id': str(uuid.uuid4()), 'description': description,
+                      'quantity': rng.choice((1, 6, 12, 24, 48)), 'unitPrice': price})
+    subtotal = round(sum(item['quantity'] * item['unitPrice'] for item in items), 2)
+    tax_rate = rng.choice((0.0, 6.0, 7.5, 8.25))
+    tax_amount = round(subtotal * tax_rate / 100, 2)
+    created_at = created_at or datetime.utcnow()
+    return {
+        'orderNumber': f"LT-{uuid.uuid4().hex[:12].upper()}",
+        'customer': {'name': name, 'email': f"customer{n}@example.com",
+                     'phone': f"555-{n:04d}", 'address': f"{n} Main St"},
+        'lineItems': items,
+        'subtotal': subtotal, 'taxRate': tax_rate, 'taxAmount': tax_amount,
+        'total': round(subtotal + tax_amount, 2),
+        'notes': rng.choice(('', '', 'Rush order', 'Pick up Friday', 'Thread colour to match logo')),
+        'status': rng.choice(STATUSES),
+        'createdAt': created_at.isoformat(),
+        'dueDate': (created_at + timedelta(days=rng.choice((7, 14, 30)))).date().isoformat(),
+    }
+
+
+def seed_database(db_path, orders, seed=1):
+    """Fill db_path with orders spread over the last two years; returns their ids."""
+    from app import create_app
+    from bulk import import_orders
+
+    rng = random.Random(seed)
+    app = create_app({'DATABASE_PATH': db_path, 'MAIL_WORKER_ENABLED': False,
+                      'SQLITE_WAL_CHECKPOINT_INTERVAL': 0, 'METRICS_ENABLED': False})
+    now = datetime.utcnow()
+    rows = ((i, make_order(rng, customers=max(orders // 20, 10),
+                           created_at=now - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))))
+            for i in range(orders))
+    with app.app_context():
+        result = import_orders(rows, batch_size=1000)
+    if result['failed']:
+        raise RuntimeError(f"Seeding failed for {result['failed']} orders: {result['errors'][:3]}")
+    with sqlite3.connect(db_path) as conn:
+        return [row[0] for row in conn.execute("SELECT id FROM purchase_orders")]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}'; use {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Server:
+    """The app under waitress in a child process (see the serve command)."""
+
+    def __init__(self, db_path, port, threads, log_level):
+        with socket.socket() as probe:
+            if probe.connect_ex(('127.0.0.1', port)) == 0:
+                raise RuntimeError(f"Port {port} is already in use; pass --port")
+        self.port = port
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'serve', '--db', db_path, '--port', str(port),
+             '--threads', str(threads), '--log-level', log_level],
+            cwd=BACKEND_DIR,
+            # A process group of its own, so that stop() reaches the PDF pool's workers too
+            start_new_session=os.name == 'posix')
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with status {self.process.returncode}")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                conn.request('GET', '/health')
+                if conn.getresponse().status == 200:
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("Server did not become ready")
+
+    def peak_rss_mb(self):
+        """High-water RSS of the server process, from /proc where available."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        return None
+
+    def stop(self):
+        peak = self.peak_rss_mb()
+        if os.name == 'posix':
+            os.killpg(self.process.pid, signal.SIGTERM)
+        else:
+            self.process.terminate()
+        self.process.wait(timeout=30)
+        if os.name == 'posix':
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        if peak is None and resource is not None:
+            # ru_maxrss of reaped children: KiB on Linux, bytes on macOS
+            maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            peak = round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+        return peak
+
+
+class Client(threading.Thread):
+    """One keep-alive HTTP connection issuing requests until the deadline."""
+
+    def __init__(self, n, port, mix, order_ids, deadline, pdf_enabled):
+        super().__init__(name=f"client-{n}", daemon=True)
+        self.rng = random.Random(n)
+        self.port = port
+        self.mix = mix
+        self.order_ids = order_ids
+        self.deadline = deadline
+        self.pdf_enabled = pdf_enabled
+        self.created = []
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            return 0, b''
+
+    def run(self):
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        while time.perf_counter() < self.deadline:
+            name = self.rng.choices(names, weights)[0]
+            if name == 'pdf' and not self.pdf_enabled:
+                continue
+            started = time.perf_counter()
+            status, body, expected = self.call(name)
+            elapsed = time.perf_counter() - started
+            if status == expected:
+                self.latencies[name].append(elapsed)
+            else:
+                self.errors[name] += 1
+
+    def call(self, name):
+        """Issue one operation; returns (status, body, expected status)."""
+        if name == 'create':
+            status, body = self.request('POST', '/api/purchase-orders', make_order(self.rng))
+            if status == 201:
+                self.created.append(json.loads(body)['id'])
+            return status, body, 201
+        if name == 'list':
+            query = self.rng.choice(('limit=50', 'limit=50&status=unpaid', 'limit=20&sort=total',
+                                     'limit=50&customer=Smith'))
+            return (*self.request('GET', f"/api/purchase-orders?{query}"), 200)
+        if name == 'get':
+            return (*self.request('GET', f"/api/purchase-orders/{self.rng.choice(self.order_ids)}"), 200)
+        if name == 'update':
+            order_id = self.rng.choice(self.order_ids)
+            update = {'status': self.rng.choice(STATUSES), 'notes': f"Updated {uuid.uuid4().hex[:6]}"}
+            return (*self.request('PUT', f"/api/purchase-orders/{order_id}", update), 200)
+        if name == 'delete':
+            # Only delete this client's own orders so reads of seeded ids keep succeeding
+            if not self.created:
+                status, body = self.request('POST', '/api/purchase-orders', make_order(self.rng))
+                if status != 201:
+                    return status, body, 204
+                self.created.append(json.loads(body)['id'])
+            return (*self.request('DELETE', f"/api/purchase-orders/{self.created.pop()}"), 204)
+        return (*self.request('GET', f"/api/purchase-orders/{self.rng.choice(self.order_ids)}/pdf"), 200)
+
+
+def pdf_available(port, order_id):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    conn.request('GET', f"/api/purchase-orders/{order_id}/pdf")
+    response = conn.getresponse()
+    response.read()
+    return response.status == 200
+
+
+def summarize(clients, elapsed):
+    operations = {}
+    for name in OPERATIONS:
+        latencies = sorted(value for client in clients for value in client.latencies[name])
+        errors = sum(client.errors[name] for client in clients)
+        if not latencies and not errors:
+            continue
+        operations[name] = {
+            'count': len(latencies),
+            'errors': errors,
+            'throughput': round(len(latencies) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+        }
+    all_latencies = sorted(value for client in clients for name in OPERATIONS for value in client.latencies[name])
+    total = {
+        'count': len(all_latencies),
+        'errors': sum(op['errors'] for op in operations.values()),
+        'throughput': round(len(all_latencies) / elapsed, 2),
+        'p50_ms': round(percentile(all_latencies, 50) * 1000, 2) if all_latencies else None,
+        'p95_ms': round(percentile(all_latencies, 95) * 1000, 2) if all_latencies else None,
+        'p99_ms': round(percentile(all_latencies, 99) * 1000, 2) if all_latencies else None,
+    }
+    return operations, total
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='stitchpay-load-')
+    db_path = os.path.join(workdir, 'stitchpay.db')
+    try:
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+            with sqlite3.connect(db_path) as conn:
+                order_ids = [row[0] for row in conn.execute("SELECT id FROM purchase_orders")]
+        else:
+            print(f"Seeding {args.orders} orders...")
+            started = time.perf_counter()
+            order_ids = seed_database(db_path, args.orders, seed=args.seed)
+            print(f"Seeded in {time.perf_counter() - started:.1f}s")
+        if not order_ids:
+            raise SystemExit("The database has no purchase orders to read")
+
+        server = Server(db_path, args.port, args.threads, args.log_level)
+        try:
+            server.wait_ready()
+            mix = parse_mix(args.mix)
+            pdf_enabled = 'pdf' in mix and pdf_available(args.port, order_ids[0])
+            if 'pdf' in mix and not pdf_enabled:
+                print("PDF rendering is unavailable on this machine; leaving pdf out of the mix")
+
+            if args.warmup > 0:
+                warmup = [Client(n, args.port, mix, order_ids, time.perf_counter() + args.warmup, pdf_enabled)
+                          for n in range(args.clients)]
+                for client in warmup:
+                    client.start()
+                for client in warmup:
+                    client.join()
+
+            deadline = time.perf_counter() + args.duration
+            clients = [Client(1000 + n, args.port, mix, order_ids, deadline, pdf_enabled)
+                       for n in range(args.clients)]
+            started = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            peak_rss = server.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    operations, total = summarize(clients, elapsed)
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'orders': len(order_ids),
+            'clients': args.clients,
+            'server_threads': args.threads,
+            'duration': args.duration,
+            'mix': args.mix,
+            'pdf': pdf_enabled,
+        },
+        'server': {'peak_rss_mb': peak_rss},
+        'total': total,
+        'operations': operations,
+    }
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return results
+
+
+def print_results(results):
+    print(f"{'operation':>10} {'count':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = list(results['operations'].items()) + [('total', results['total'])]
+    for name, op in rows:
+        print(f"{name:>10} {op['count']:>8} {op['errors']:>7} {op['throughput']:>9} "
+              f"{op['p50_ms'] or '-':>9} {op['p95_ms'] or '-':>9} {op['p99_ms'] or '-':>9}")
+    print(f"server peak RSS: {results['server']['peak_rss_mb']} MB")
+
+
+def compare(args):
+    """Print per-operation changes between two result files; returns the regressions."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    regressions = []
+    print(f"{'operation':>10} {'metric':>11} {'baseline':>10} {'current':>10} {'change':>8}")
+    names = [name for name in current['operations'] if name in baseline['operations']] + ['total']
+    for name in names:
+        old = baseline['total'] if name == 'total' else baseline['operations'][name]
+        new = current['total'] if name == 'total' else current['operations'][name]
+        for key, higher_is_better in COMPARED_METRICS:
+            if not old.get(key) or new.get(key) is None:
+                continue
+            change = (new[key] - old[key]) / old[key] * 100
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > args.threshold:
+                flag = 'REGRESSION'
+                regressions.append((name, key, old[key], new[key], change))
+            print(f"{name:>10} {key:>11} {old[key]:>10} {new[key]:>10} {change:>+7.1f}% {flag}")
+
+    old_rss, new_rss = baseline['server'].get('peak_rss_mb'), current['server'].get('peak_rss_mb')
+    if old_rss and new_rss:
+        change = (new_rss - old_rss) / old_rss * 100
+        flag = ''
+        if change > args.threshold:
+            flag = 'REGRESSION'
+            regressions.append(('server', 'peak_rss_mb', old_rss, new_rss, change))
+        print(f"{'server':>10} {'peak_rss_mb':>11} {old_rss:>10} {new_rss:>10} {change:>+7.1f}% {flag}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold}%")
+    else:
+        print(f"No regressions above {args.threshold}%")
+    return regressions
+
+
+def serve(args):
+    from waitress import serve as waitress_serve
+    from app import create_app
+
+    app = create_app({'DATABASE_PATH': args.db, 'MAIL_WORKER_ENABLED': False})
+    logging.getLogger('stitchpay').setLevel(args.log_level)
+    waitress_serve(app, host='127.0.0.1', port=args.port, threads=args.threads, _quiet=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="seed a scratch database and run the load test")
+    run_parser.add_argument('--orders', type=int, default=10000, help="orders to seed")
+    run_parser.add_argument('--db', help="copy this database instead of seeding one")
+    run_parser.add_argument('--seed', type=int, default=1, help="random seed for the generated data")
+    run_parser.add_argument('--clients', type=int, default=8, help="concurrent HTTP clients")
+    run_parser.add_argument('--threads', type=int, default=8, help="waitress threads")
+    run_parser.add_argument('--duration', type=float, default=30.0, help="seconds of measured load")
+    run_parser.add_argument('--warmup', type=float, default=3.0, help="seconds of unmeasured load first")
+    run_parser.add_argument('--mix', default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    run_parser.add_argument('--port', type=int, default=5055)
+    run_parser.add_argument('--log-level', default='WARNING', help="server log level")
+    run_parser.add_argument('--output', help="write results JSON to this file")
+
+    compare_parser = commands.add_parser('compare', help="compare two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help="percent change counted as a regression")
+
+    serve_parser = commands.add_parser('serve', help=argparse.SUPPRESS)
+    serve_parser.add_argument('--db', required=True)
+    serve_parser.add_argument('--port', type=int, required=True)
+    serve_parser.add_argument('--threads', type=int, default=8)
+    serve_parser.add_argument('--log-level', default='WARNING')
+
+    args = parser.parse_args()
+    logging.getLogger('stitchpay').setLevel(logging.WARNING)
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        sys.exit(1 if compare(args) else 0)
+    else:
+        serve(args)
+
+
+if __name__ == '__main__':
+    main()
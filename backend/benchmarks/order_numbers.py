@@ -0,0 +1,131 @@
+"""Throughput and uniqueness of server-side order number allocation.
+
+Runs two measurements against a scratch database:
+
+* allocator: threads call the allocator directly, split over two allocator
+  instances that stand in for two server processes sharing the database,
+  once per block size;
+* create: threads POST orders without an orderNumber, compared with clients
+  sending the old timestamp-based fallback number (PO-%Y%m%d%H%M%S).
+
+Every run reports allocations (or created orders) per second and the number
+of duplicate order numbers, which must be zero.
+
+    python benchmarks/order_numbers.py --threads 8 --allocations 5000 --block-sizes 1 20 100
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def make_app(block_size=20):
+    from app import create_app
+
+    workdir = tempfile.mkdtemp(prefix='stitchpay-bench-')
+    return create_app({
+        'DATABASE_PATH': os.path.join(workdir, 'stitchpay.db'),
+        'ORDER_NUMBER_BLOCK_SIZE': block_size,
+        'MAIL_WORKER_ENABLED': False,
+        'BACKUP_ENABLED': False,
+        'SQLITE_WAL_CHECKPOINT_INTERVAL': 0,
+    })
+
+
+def run_threads(threads, target):
+    workers = [threading.Thread(target=target, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def bench_allocator(block_size, args):
+    from order_numbers import OrderNumberAllocator
+
+    app = make_app(block_size)
+    allocators = [OrderNumberAllocator(block_size=block_size) for _ in range(2)]
+    numbers = [[] for _ in range(args.threads)]
+
+    def worker(n):
+        allocator = allocators[n % len(allocators)]
+        with app.app_context():
+            numbers[n] = [allocator.allocate() for _ in range(args.allocations)]
+
+    elapsed = run_threads(args.threads, worker)
+    issued = [number for chunk in numbers for number in chunk]
+    return {
+        'label': f'allocator, block {block_size}',
+        'count': len(issued),
+        'per_sec': round(len(issued) / elapsed, 1),
+        'duplicates': sum(count - 1 for count in Counter(issued).values() if count > 1),
+        'errors': 0,
+    }
+
+
+def bench_create(label, order_number, args):
+    app = make_app()
+    created, errors = [[] for _ in range(args.threads)], [0] * args.threads
+
+    def worker(n):
+        client = app.test_client()
+        for i in range(args.orders):
+            payload = {
+                'customer': {'name': f"Customer {n}"},
+                'lineItems': [{'id': str(i), 'description': 'Embroidered cap', 'quantity': 12, 'unitPrice': 4.5}],
+                'taxRate': 7.5,
+            }
+            if order_number:
+                payload['orderNumber'] = order_number()
+            response = client.post('/api/purchase-orders', json=payload)
+            if response.status_code == 201:
+                created[n].append(response.get_json()['orderNumber'])
+            else:
+                errors[n] += 1
+
+    elapsed = run_threads(args.threads, worker)
+    issued = [number for chunk in created for number in chunk]
+    return {
+        'label': label,
+        'count': len(issued),
+        'per_sec': round(len(issued) / elapsed, 1),
+        'duplicates': sum(count - 1 for count in Counter(issued).values() if count > 1),
+        'errors': sum(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--allocations', type=int, default=5000, help="allocations per thread")
+    parser.add_argument('--block-sizes', type=int, nargs='+', default=[1, 20, 100])
+    parser.add_argument('--orders', type=int, default=100, help="orders created per thread")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger('stitchpay').setLevel(logging.WARNING)
+
+    results = [bench_allocator(block_size, args) for block_size in args.block_sizes]
+    results.append(bench_create('create, timestamp number',
+                                lambda: f"PO-{datetime.now().strftime('%Y%m%d%H%M%S')}", args))
+    results.append(bench_create('create, allocated number', None, args))
+    for result in results:
+        print(f"{result['label']:>26}: {result['count']:>7} numbers  {result['per_sec']:>9}/s  "
+              f"{result['duplicates']} duplicates  {result['errors']} errors")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Time full-text search over a seeded database: prefix queries and bm25-ranked queries.
+
+Seeds a scratch database per size (through the load test's generator) and
+runs each query repeatedly, both as search_order_ids() (the FTS5 lookup and
+bm25 ranking alone) and through GET /api/purchase-orders/search (lookup,
+order rows and JSON). Prefix queries are the short, single-word input of a
+search box being typed into; they match many documents, all of which are
+ranked. Ranked queries combine several words, as when looking for one order.
+
+    python benchmarks/search_latency.py --sizes 100000
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from load_test import percentile, seed_database  # noqa: E402
+
+# Words of the load test's generator: customer names and emails, catalogue
+# items, notes and the LT- order number prefix
+PREFIX_QUERIES = ('s', 'sm', 'emb', 'hood', 'cust', 'rush', 'lt')
+RANKED_QUERIES = ('ava smith', 'hoodie back print', 'polo logo rush', 'beanie puff friday', 'customer42 cap')
+
+
+def time_calls(call, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)
+
+
+def run(size, repeat, limit):
+    from sqlalchemy import text
+
+    from app import create_app
+    from extensions import db
+    from search import build_match_query, search_order_ids
+
+    workdir = tempfile.mkdtemp(prefix='stitchpay-search-')
+    try:
+        db_path = os.path.join(workdir, 'stitchpay.db')
+        seed_database(db_path, size)
+        app = create_app({'DATABASE_PATH': db_path, 'MAIL_WORKER_ENABLED': False,
+                          'SQLITE_WAL_CHECKPOINT_INTERVAL': 0, 'METRICS_ENABLED': False})
+        client = app.test_client()
+        print(f"{size} orders")
+        print(f"{'':>8}  {'query':<26} {'matches':>8}  {'search p50':>10} {'p95':>7}  {'endpoint p50':>12} {'p95':>7}")
+        for kind, queries in (('prefix', PREFIX_QUERIES), ('ranked', RANKED_QUERIES)):
+            for query in queries:
+                with app.app_context():
+                    matches = db.session.execute(
+                        text("SELECT COUNT(*) FROM purchase_order_fts WHERE purchase_order_fts MATCH :match"),
+                        {'match': build_match_query(query)}).scalar()
+                    search = time_calls(lambda: search_order_ids(query, limit), repeat)
+
+                def endpoint():
+                    response = client.get('/api/purchase-orders/search', query_string={'q': query, 'limit': limit})
+                    if response.status_code != 200:
+                        raise SystemExit(f"Search for {query!r} failed with {response.status_code}")
+
+                endpoint_ms = time_calls(endpoint, repeat)
+                print(f"{kind:>8}  {query!r:<26} {matches:>8}  {percentile(search, 50):>8.1f}ms "
+                      f"{percentile(search, 95):>5.1f}ms  {percentile(endpoint_ms, 50):>10.1f}ms "
+                      f"{percentile(endpoint_ms, 95):>5.1f}ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000])
+    parser.add_argument('--repeat', type=int, default=20, help="runs per query")
+    parser.add_argument('--limit', type=int, default=20, help="results per search, as in one page of the UI")
+    args = parser.parse_args()
+
+    logging.getLogger('stitchpay').setLevel(logging.WARNING)
+    for size in args.sizes:
+        run(size, args.repeat, args.limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Concurrent read/write throughput of the API before and after SQLite tuning.
+
+Runs the same mixed workload twice against a scratch database: once with the
+original engine setup (rollback journal, synchronous=FULL, a new connection
+per checkout) and once with the tuned settings from config.py.
+
+    python benchmarks/sqlite_concurrency.py --threads 8 --duration 10 --write-ratio 0.2
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# The original engine setup: Flask-SQLAlchemy's NullPool and SQLite defaults
+BASELINE_CONFIG = {
+    'SQLALCHEMY_ENGINE_OPTIONS': {},
+    'SQLITE_JOURNAL_MODE': 'DELETE',
+    'SQLITE_SYNCHRONOUS': 'FULL',
+    'SQLITE_MMAP_SIZE': 0,
+    'SQLITE_CACHE_SIZE': -2000,
+    'SQLITE_TEMP_STORE': 'DEFAULT',
+    'SQLITE_WAL_CHECKPOINT_INTERVAL': 0,
+}
+
+
+def make_order(i):
+    return {
+        'orderNumber': f"BENCH-{uuid.uuid4().hex[:12]}",
+        'customer': {'name': f"Customer {i % 500}", 'email': f"c{i % 500}@example.com", 'phone': '', 'address': ''},
+        'lineItems': [{'id': str(uuid.uuid4()), 'description': 'Embroidered cap', 'quantity': 12, 'unitPrice': 4.5}],
+        'subtotal': 54.0, 'taxRate': 7.5, 'taxAmount': 4.05, 'total': 58.05,
+        'status': random.choice(['paid', 'unpaid']),
+    }
+
+
+def run_workload(label, config, args):
+    from app import create_app
+
+    workdir = tempfile.mkdtemp(prefix='stitchpay-bench-')
+    overrides = dict(config, DATABASE_PATH=os.path.join(workdir, 'stitchpay.db'), WAITRESS_THREADS=args.threads)
+    app = create_app(overrides)
+
+    seed_client = app.test_client()
+    order_ids = []
+    for i in range(args.seed_orders):
+        order_ids.append(seed_client.post('/api/purchase-orders', json=make_order(i)).get_json()['id'])
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        local = {'reads': 0, 'writes': 0, 'errors': 0}
+        while time.perf_counter() < deadline:
+            if rng.random() < args.write_ratio:
+                response = client.post('/api/purchase-orders', json=make_order(rng.randrange(10 ** 6)))
+                kind = 'writes'
+            elif rng.random() < 0.5:
+                response = client.get(f"/api/purchase-orders/{rng.choice(order_ids)}")
+                kind = 'reads'
+            else:
+                response = client.get('/api/purchase-orders?limit=50')
+                kind = 'reads'
+            local[kind if response.status_code < 400 else 'errors'] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    checkpointer = app.extensions.get('wal_checkpointer')
+    if checkpointer:
+        checkpointer.stop()
+
+    return {
+        'label': label,
+        'threads': args.threads,
+        'seconds': round(elapsed, 2),
+        'reads_per_sec': round(counts['reads'] / elapsed, 1),
+        'writes_per_sec': round(counts['writes'] / elapsed, 1),
+        'errors': counts['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per run")
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--seed-orders', type=int, default=500)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger('stitchpay').setLevel(logging.WARNING)
+
+    results = [run_workload('baseline', BASELINE_CONFIG, args), run_workload('tuned', {}, args)]
+    for result in results:
+        print(f"{result['label']:>9}: {result['reads_per_sec']:>8} reads/s  "
+              f"{result['writes_per_sec']:>8} writes/s  {result['errors']} errors")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""Streaming bulk import and export of purchase orders (NDJSON and CSV)."""
+import codecs
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+
+from extensions import db, logger
+from changes import record_changes
+from models import Customer, LineItem, PurchaseOrder, CUSTOMER_FIELDS
+from money import line_amount_cents
+from pagination import keyset_filter, keyset_order
+from search import reindex_orders
+from serialization import iter_order_chunks
+from stats import record_order_changes
+from validation import ValidationError, validate_order_data, parse_date
+
+# Rows inserted per transaction during an import
+IMPORT_BATCH_SIZE = 500
+# Rows fetched per query during an export
+EXPORT_CHUNK_SIZE = 500
+# Per-row errors returned in an import response before truncating
+MAX_REPORTED_ERRORS = 1000
+
+# Flat CSV layout shared by import and export; lineItems is a JSON array
+CSV_COLUMNS = ['id', 'orderNumber', 'customerName', 'customerEmail', 'customerPhone', 'customerAddress',
+               'lineItems', 'subtotal', 'taxRate', 'taxAmount', 'total', 'notes', 'status',
+               'createdAt', 'dueDate']
+# Written with exactly two decimals
+MONEY_COLUMNS = ('subtotal', 'taxAmount', 'total')
+
+
+def iter_ndjson(stream):
+    """Yield (line number, payload or error) for each non-blank NDJSON line."""
+    for line_no, raw in enumerate(codecs.iterdecode(stream, 'utf-8-sig'), start=1):
+        line = raw.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, ValidationError(f"Invalid JSON: {e}")
+
+
+def csv_row_to_payload(row):
+    """Turn a flat CSV row into the JSON payload create_purchase_order accepts."""
+    payload = {key: value for key, value in row.items()
+               if key and not key.startswith('customer') and value not in (None, '')}
+    payload.pop('id', None)
+    payload['customer'] = {field: row.get('customer' + field.capitalize()) or '' for field in CUSTOMER_FIELDS}
+    if 'lineItems' in payload:
+        try:
+            payload['lineItems'] = json.loads(payload['lineItems'])
+        except ValueError:
+            raise ValidationError("lineItems must be a JSON array")
+    return payload
+
+
+def iter_csv(stream):
+    """Yield (line number, payload or error) for each CSV data row."""
+    reader = csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+    for row in reader:
+        try:
+            yield reader.line_num, csv_row_to_payload(row)
+        except ValidationError as e:
+            yield reader.line_num, e
+
+
+class OrderImporter:
+    """Validates parsed rows and inserts them in batched transactions."""
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self._customers = {}
+        self._batch = []
+
+    def add_error(self, line_no, message, order_number=None):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_no, 'orderNumber': order_number, 'error': message})
+
+    def add(self, line_no, payload):
+        if isinstance(payload, Exception):
+            self.add_error(line_no, str(payload))
+            return
+        try:
+            values = validate_order_data(payload)
+            values['created_at'] = parse_date(payload.get('createdAt'), 'createdAt') or datetime.utcnow()
+        except ValidationError as e:
+            order_number = payload.get('orderNumber') if isinstance(payload, dict) else None
+            self.add_error(line_no, str(e), order_number)
+            return
+        self._batch.append((line_no, values))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def _customer(self, values):
+        """(id, stored name) of the customer; upserted again only when the details differ from the last row's."""
+        details = tuple(values[field] for field in CUSTOMER_FIELDS)
+        key = Customer.make_match_key(values['name'], values['email'])
+        cached = self._customers.get(key)
+        if cached is None or cached[0] != details:
+            self._customers[key] = (details, Customer.upsert(values))
+        return self._customers[key][1]
+
+    def flush(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        numbers = [values['order_number'] for _, values in batch]
+        taken = {number for (number,) in
+                 db.session.query(PurchaseOrder.order_number).filter(PurchaseOrder.order_number.in_(numbers))}
+
+        order_rows, item_rows, snapshots, accepted = [], [], [], []
+        for line_no, values in batch:
+            number = values['order_number']
+            if number in taken:
+                self.add_error(line_no, f"Duplicate orderNumber: {number}", number)
+                continue
+            taken.add(number)
+
+            order_id = str(uuid.uuid4())
+            line_items = values.pop('line_items')
+            customer = values.pop('customer')
+            values['customer_id'], customer_name = self._customer(customer)
+            order_rows.append(dict(values, id=order_id))
+            snapshot_items = []
+            for position, item in enumerate(line_items):
+                line_item = LineItem.from_dict(item, position=position)
+                item_rows.append({'purchase_order_id': order_id, 'position': position,
+                                  'item_id': line_item.item_id, 'description': line_item.description,
+                                  'quantity': line_item.quantity,
+                                  'unit_price_cents': line_item.unit_price_cents})
+                snapshot_items.append((line_item.description, line_item.quantity,
+                                       line_amount_cents(line_item.quantity, line_item.unit_price_cents)))
+            snapshots.append((None, {'status': values['status'], 'total_cents': values['total_cents'],
+                                     'created_at': values['created_at'], 'due_date': values['due_date'],
+                                     'customer': customer_name, 'customer_id': values['customer_id'],
+                                     'items': snapshot_items}))
+            accepted.append((line_no, number))
+
+        try:
+            if order_rows:
+                db.session.execute(PurchaseOrder.__table__.insert(), order_rows)
+            if item_rows:
+                db.session.execute(LineItem.__table__.insert(), item_rows)
+            record_order_changes(snapshots)
+            reindex_orders([row['id'] for row in order_rows])
+            record_changes([row['id'] for row in order_rows])
+            db.session.commit()
+            self.created += len(order_rows)
+        except Exception as e:
+            db.session.rollback()
+            # Customers inserted in this transaction were rolled back too
+            self._customers.clear()
+            logger.error("Bulk import batch failed: %s", e, exc_info=True)
+            for line_no, number in accepted:
+                self.add_error(line_no, f"Batch insert failed: {e}", number)
+
+    def result(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+            'errorsTruncated': self.failed > len(self.errors),
+        }
+
+
+def import_orders(rows, batch_size=IMPORT_BATCH_SIZE):
+    """Import (line number, payload) rows and return the summary dict."""
+    importer = OrderImporter(batch_size)
+    for line_no, payload in rows:
+        importer.add(line_no, payload)
+    importer.flush()
+    return importer.result()
+
+
+def iter_orders(query, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield every order matched by query in (created_at, id) order, one chunk at a time."""
+    order = keyset_order(PurchaseOrder.created_at, PurchaseOrder.id, 'asc')
+    last = None
+    while True:
+        chunk_query = query
+        if last:
+            chunk_query = chunk_query.filter(
+                keyset_filter(PurchaseOrder.created_at, PurchaseOrder.id, 'asc', *last))
+        chunk = chunk_query.order_by(*order).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield from chunk
+        last = (chunk[-1].created_at, chunk[-1].id)
+        # Exported rows are no longer needed; keep the identity map small
+        db.session.expunge_all()
+
+
+def export_ndjson(query):
+    for documents in iter_order_chunks(query, EXPORT_CHUNK_SIZE):
+        yield b'\n'.join(documents) + b'\n'
+
+
+def order_to_csv_row(order):
+    data = order.to_dict()
+    customer = data['customer'] or {}
+    row = {key: data.get(key) for key in CSV_COLUMNS if key in data}
+    for field in CUSTOMER_FIELDS:
+        row['customer' + field.capitalize()] = customer.get(field, '')
+    row['lineItems'] = json.dumps(data['lineItems'], separators=(',', ':'))
+    for key in MONEY_COLUMNS:
+        row[key] = f"{data[key]:.2f}"
+    return row
+
+
+def export_csv(orders):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for order in orders:
+        writer.writerow(order_to_csv_row(order))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
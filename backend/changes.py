@@ -0,0 +1,189 @@
+"""Change feed for clients that keep a local copy of the order list.
+
+Every write gives the orders it touched a new sequence number in
+order_changes, in the same transaction as the write itself. SQLite has one
+writer at a time, so sequence numbers become visible in commit order and a
+client that remembers the last one it saw can ask for everything after it:
+the orders changed since then, and the ids of the ones deleted.
+
+The same feed is offered as a Server-Sent Events stream. Commits made by
+this process wake the streams at once; writes from other processes are
+picked up by polling.
+"""
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, event, func, text
+
+from extensions import db
+from models import OrderChange, PurchaseOrder
+from serialization import ORDER_COLUMNS, OrderEncoder, dumps
+
+# Changes returned per feed page or stream event
+DEFAULT_CHANGE_LIMIT = 500
+MAX_CHANGE_LIMIT = 5000
+# Seconds between comment lines on an idle stream, so proxies keep it open
+STREAM_HEARTBEAT_SECONDS = 15
+
+# SQLite caps bound parameters per statement; stay well under the old 999 limit
+_ID_CHUNK = 500
+
+_FORGET_CHANGES = text(
+    "DELETE FROM order_changes WHERE order_id IN :ids"
+).bindparams(bindparam('ids', expanding=True))
+
+
+class ChangeNotifier:
+    """Wakes stream threads when this process commits order changes."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def notify(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """Block until a commit after ``generation`` was seen, or timeout seconds pass."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._generation != generation, timeout)
+
+
+NOTIFIER = ChangeNotifier()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_streams(session):
+    if session.info.pop('orders_changed', False):
+        NOTIFIER.notify()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_pending_notification(session):
+    session.info.pop('orders_changed', None)
+
+
+def record_changes(order_ids, deleted=False):
+    """Move the given orders to the end of the change log in the current transaction.
+
+    Pass deleted=True for orders that were removed; their entries stay in
+    the log as tombstones. Call before the commit.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    if not order_ids:
+        return
+    now = datetime.utcnow()
+    table = OrderChange.__table__
+    for start in range(0, len(order_ids), _ID_CHUNK):
+        ids = order_ids[start:start + _ID_CHUNK]
+        db.session.execute(_FORGET_CHANGES, {'ids': ids})
+        db.session.execute(table.insert(), [{'order_id': order_id, 'deleted': deleted, 'changed_at': now}
+                                            for order_id in ids])
+    db.session.info['orders_changed'] = True
+
+
+def latest_sequence():
+    return db.session.query(func.max(OrderChange.seq)).scalar() or 0
+
+
+def read_changes(since, limit=DEFAULT_CHANGE_LIMIT):
+    """Return the feed page after cursor ``since`` as (JSON bytes, new cursor, number of changes, reset).
+
+    The page holds "items", the current state of created and updated
+    orders, and "deleted", the ids of deleted ones. When ``since`` is ahead
+    of the log (the database was restored from an older backup)
+    "resetRequired" tells the client to drop its copy and sync from 0.
+    """
+    latest = latest_sequence()
+    if since > latest:
+        return dumps({"cursor": 0, "hasMore": latest > 0, "resetRequired": True,
+                      "items": [], "deleted": []}), 0, 0, True
+
+    rows = (db.session.query(OrderChange.seq, OrderChange.order_id, OrderChange.deleted)
+            .filter(OrderChange.seq > since).order_by(OrderChange.seq).limit(limit + 1).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = rows[-1].seq if rows else since
+
+    changed_ids = [row.order_id for row in rows if not row.deleted]
+    documents = {}
+    for start in range(0, len(changed_ids), _ID_CHUNK):
+        order_rows = (PurchaseOrder.query.filter(PurchaseOrder.id.in_(changed_ids[start:start + _ID_CHUNK]))
+                      .with_entities(*ORDER_COLUMNS).all())
+        documents.update(zip((row.id for row in order_rows), OrderEncoder().encode(order_rows)))
+
+    head = dumps({
+        "cursor": cursor,
+        "hasMore": has_more,
+        "resetRequired": False,
+        "deleted": [row.order_id for row in rows if row.deleted],
+    })
+    # Changed orders in sequence order
+    items = [documents[order_id] for order_id in changed_ids if order_id in documents]
+    body = b''.join((head[:-1], b',"items":[', b','.join(items), b']}'))
+    return body, cursor, len(rows), False
+
+
+class ChangeStreams:
+    """Limits the number of open event streams, each of which holds a server thread."""
+
+    def __init__(self, max_clients, poll_seconds, max_seconds):
+        self.max_clients = max_clients
+        self.poll_seconds = poll_seconds
+        self.max_seconds = max_seconds
+        self._slots = threading.BoundedSemaphore(max_clients) if max_clients > 0 else None
+
+    def acquire(self):
+        return self._slots is not None and self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def events(self, since, limit):
+        """Yield SSE messages for changes after ``since`` until max_seconds have passed.
+
+        Clients reconnect with Last-Event-ID to continue where the stream
+        ended. The database connection is released while waiting.
+        """
+        started = last_sent = time.monotonic()
+        while True:
+            generation = NOTIFIER.generation
+            body, cursor, count, reset = read_changes(since, limit)
+            db.session.close()
+            if reset:
+                yield b'event: reset\ndata: ' + body + b'\n\n'
+                return
+            now = time.monotonic()
+            if count:
+                yield f'id: {cursor}\nevent: changes\ndata: '.encode('utf-8') + body + b'\n\n'
+                since, last_sent = cursor, now
+                if count >= limit:
+                    continue
+            elif now - last_sent >= STREAM_HEARTBEAT_SECONDS:
+                yield b': keep-alive\n\n'
+                last_sent = now
+            if now - started >= self.max_seconds:
+                return
+            NOTIFIER.wait(generation, min(self.poll_seconds, STREAM_HEARTBEAT_SECONDS))
+
+
+def init_change_streams(app):
+    streams = ChangeStreams(
+        max_clients=app.config['CHANGE_STREAM_MAX_CLIENTS'],
+        poll_seconds=app.config['CHANGE_STREAM_POLL_SECONDS'],
+        max_seconds=app.config['CHANGE_STREAM_MAX_SECONDS'],
+    )
+    app.extensions['change_streams'] = streams
+    return streams
+
+
+def get_change_streams():
+    return current_app.extensions['change_streams']
@@ -0,0 +1,163 @@
+import os
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+
+def env_bool(name, default):
+    """Read a boolean setting from the environment."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('true', 'yes', '1')
+
+
+def env_int(name, default):
+    """Read an integer setting from the environment."""
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+class Config:
+    """Default settings; every value can be overridden by an environment variable."""
+
+    # Database location
+    INSTANCE_PATH = os.environ.get('STITCHPAY_INSTANCE_PATH', os.path.join(BASE_DIR, 'instance'))
+    DATABASE_PATH = os.environ.get('STITCHPAY_DB_PATH', os.path.join(INSTANCE_PATH, 'stitchpay.db'))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # SQLite connection settings, applied to every pooled connection
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+    SQLITE_MMAP_SIZE = env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    # Negative values are KiB, so this is a 64 MiB page cache per connection
+    SQLITE_CACHE_SIZE = env_int('SQLITE_CACHE_SIZE', -64000)
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+    SQLITE_FOREIGN_KEYS = env_bool('SQLITE_FOREIGN_KEYS', True)
+    # Seconds between background WAL checkpoints, 0 disables the checkpoint thread
+    SQLITE_WAL_CHECKPOINT_INTERVAL = env_int('SQLITE_WAL_CHECKPOINT_INTERVAL', 300)
+    # WAL files are cut back to this size when they restart. With WAL archiving
+    # on, the checkpoint thread also checkpoints a WAL grown past it, in case
+    # the backup worker has stopped keeping up
+    SQLITE_WAL_SIZE_LIMIT_MB = env_int('SQLITE_WAL_SIZE_LIMIT_MB', 64)
+
+    # Rows changed per transaction by batched data migrations at startup
+    MIGRATION_BATCH_SIZE = env_int('MIGRATION_BATCH_SIZE', 5000)
+    # Seconds after startup before the backup and mail workers and the job
+    # scheduler make their first pass and the customer suggestion index is
+    # loaded, so they do not compete with the desktop app's first requests
+    BACKGROUND_START_DELAY = env_int('BACKGROUND_START_DELAY', 5)
+    # Most orders one batch update or delete may change
+    BATCH_MAX_ORDERS = env_int('BATCH_MAX_ORDERS', 5000)
+
+    # Waitress worker threads; the connection pool is sized to match
+    WAITRESS_THREADS = env_int('WAITRESS_THREADS', 8)
+    DB_POOL_OVERFLOW = env_int('DB_POOL_OVERFLOW', 4)
+    DB_POOL_TIMEOUT = env_int('DB_POOL_TIMEOUT', 30)
+
+    # 'development' or 'production'; only picks defaults for the settings below
+    ENVIRONMENT = os.environ.get('STITCHPAY_ENV', 'production')
+
+    # Logging: LOG_LEVEL for everything, LOG_LEVELS for single loggers
+    # ("stitchpay.access=WARNING,sqlalchemy.engine=INFO"), LOG_FORMAT 'json'
+    # (one object per line) or 'text'. Requests to LOG_SAMPLED_PATHS get an
+    # access log line once every LOG_SAMPLE_EVERY requests, unless they fail
+    # or are slower than SLOW_REQUEST_MS.
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or ('DEBUG' if ENVIRONMENT == 'development' else 'INFO')
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or ('text' if ENVIRONMENT == 'development' else 'json')
+    LOG_SAMPLED_PATHS = os.environ.get('LOG_SAMPLED_PATHS', '/health,/api/health,/metrics')
+    LOG_SAMPLE_EVERY = env_int('LOG_SAMPLE_EVERY', 100)
+
+    # Instrumentation served at /metrics; statements and requests slower than
+    # these thresholds (milliseconds) are logged as warnings
+    METRICS_ENABLED = env_bool('METRICS_ENABLED', True)
+    SLOW_QUERY_MS = env_int('SLOW_QUERY_MS', 250)
+    SLOW_REQUEST_MS = env_int('SLOW_REQUEST_MS', 1000)
+
+    # Server-Sent Events change streams: each open stream holds a server thread,
+    # so at most CHANGE_STREAM_MAX_CLIENTS run at once (0 disables them). Streams
+    # check for changes from other processes every CHANGE_STREAM_POLL_SECONDS
+    # and end after CHANGE_STREAM_MAX_SECONDS, when clients reconnect.
+    CHANGE_STREAM_MAX_CLIENTS = env_int('CHANGE_STREAM_MAX_CLIENTS', 2)
+    CHANGE_STREAM_POLL_SECONDS = env_int('CHANGE_STREAM_POLL_SECONDS', 5)
+    CHANGE_STREAM_MAX_SECONDS = env_int('CHANGE_STREAM_MAX_SECONDS', 300)
+
+    # Report results are cached in memory, at most REPORT_CACHE_ENTRIES of them;
+    # commits in this process drop the ones they affect, and REPORT_CACHE_SECONDS
+    # bounds how stale writes from other processes can leave them
+    REPORT_CACHE_ENTRIES = env_int('REPORT_CACHE_ENTRIES', 256)
+    REPORT_CACHE_SECONDS = env_int('REPORT_CACHE_SECONDS', 300)
+
+    # Numbers given to new orders that arrive without one: ORDER_NUMBER_PREFIX
+    # plus a sequence that restarts every day (PO-20250516-0001) or, with
+    # ORDER_NUMBER_DAILY off, never does (PO-0001). Each process reserves
+    # ORDER_NUMBER_BLOCK_SIZE numbers at a time; a restart skips the rest.
+    ORDER_NUMBER_PREFIX = os.environ.get('ORDER_NUMBER_PREFIX', 'PO')
+    ORDER_NUMBER_DAILY = env_bool('ORDER_NUMBER_DAILY', True)
+    ORDER_NUMBER_BLOCK_SIZE = env_int('ORDER_NUMBER_BLOCK_SIZE', 20)
+
+    # Backups (BACKUP_DIR defaults to a backups folder next to the database): a
+    # snapshot every BACKUP_INTERVAL_HOURS, the newest BACKUP_KEEP are kept, and
+    # in WAL mode new WAL frames are archived every BACKUP_WAL_ARCHIVE_SECONDS
+    # for point-in-time restore (0 turns archiving off)
+    BACKUP_ENABLED = env_bool('BACKUP_ENABLED', True)
+    BACKUP_DIR = os.environ.get('BACKUP_DIR')
+    BACKUP_COMPRESS = env_bool('BACKUP_COMPRESS', True)
+    BACKUP_INTERVAL_HOURS = env_int('BACKUP_INTERVAL_HOURS', 24)
+    BACKUP_KEEP = env_int('BACKUP_KEEP', 7)
+    BACKUP_WAL_ARCHIVE_SECONDS = env_int('BACKUP_WAL_ARCHIVE_SECONDS', 60)
+
+    # Archiving (archive.py): orders in one of ARCHIVE_STATUSES that have not
+    # changed for ARCHIVE_AFTER_DAYS move to the archive database
+    # (ARCHIVE_DB_PATH defaults to stitchpay-archive.db next to the database),
+    # checked every ARCHIVE_INTERVAL_HOURS and moved ARCHIVE_BATCH_SIZE orders
+    # per transaction. 0 days turns archiving off.
+    ARCHIVE_DB_PATH = os.environ.get('ARCHIVE_DB_PATH')
+    ARCHIVE_AFTER_DAYS = env_int('ARCHIVE_AFTER_DAYS', 0)
+    ARCHIVE_STATUSES = os.environ.get('ARCHIVE_STATUSES', 'paid,cancelled')
+    ARCHIVE_INTERVAL_HOURS = env_int('ARCHIVE_INTERVAL_HOURS', 24)
+    ARCHIVE_BATCH_SIZE = env_int('ARCHIVE_BATCH_SIZE', 500)
+
+    # Scheduled jobs (scheduler.py), run one at a time by a background thread.
+    # The overdue check runs every OVERDUE_CHECK_MINUTES (0 turns it off) and,
+    # with OVERDUE_REMINDERS_ENABLED, emails one reminder per overdue order to
+    # its customer, skipping orders due more than OVERDUE_REMINDER_MAX_DAYS
+    # ago. Archiving (above) runs as a job too. Jobs write
+    # SCHEDULER_BATCH_SIZE rows per transaction and pause SCHEDULER_BATCH_PAUSE_MS
+    # between transactions so that requests get the database in between.
+    SCHEDULER_ENABLED = env_bool('SCHEDULER_ENABLED', True)
+    SCHEDULER_BATCH_SIZE = env_int('SCHEDULER_BATCH_SIZE', 200)
+    SCHEDULER_BATCH_PAUSE_MS = env_int('SCHEDULER_BATCH_PAUSE_MS', 50)
+    SCHEDULER_RUN_HISTORY = env_int('SCHEDULER_RUN_HISTORY', 500)
+    OVERDUE_CHECK_MINUTES = env_int('OVERDUE_CHECK_MINUTES', 60)
+    OVERDUE_REMINDERS_ENABLED = env_bool('OVERDUE_REMINDERS_ENABLED', False)
+    OVERDUE_REMINDER_MAX_DAYS = env_int('OVERDUE_REMINDER_MAX_DAYS', 30)
+
+    # PDF rendering: worker processes (started as they are needed), seconds to
+    # wait for one document, on-disk cache (PDF_CACHE_DIR defaults to a
+    # pdf_cache folder next to the database) and the most orders one batch
+    # download may contain
+    PDF_WORKERS = env_int('PDF_WORKERS', os.cpu_count() or 1)
+    PDF_RENDER_TIMEOUT = env_int('PDF_RENDER_TIMEOUT', 60)
+    PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR')
+    PDF_CACHE_MAX_FILES = env_int('PDF_CACHE_MAX_FILES', 500)
+    PDF_BATCH_MAX_ORDERS = env_int('PDF_BATCH_MAX_ORDERS', 500)
+
+    # Default Email Configuration
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    MAIL_PORT = env_int('MAIL_PORT', 587)
+    MAIL_USE_TLS = env_bool('MAIL_USE_TLS', True)
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'StitchPay <noreply@example.com>')
+
+    # Outbound email worker: jobs per batch, seconds between outbox polls,
+    # attempts before giving up, first retry delay (doubled per attempt) and
+    # seconds an idle SMTP connection is kept open
+    MAIL_WORKER_ENABLED = env_bool('MAIL_WORKER_ENABLED', True)
+    MAIL_BATCH_SIZE = env_int('MAIL_BATCH_SIZE', 20)
+    MAIL_POLL_INTERVAL = env_int('MAIL_POLL_INTERVAL', 5)
+    MAIL_MAX_ATTEMPTS = env_int('MAIL_MAX_ATTEMPTS', 5)
+    MAIL_RETRY_BASE_SECONDS = env_int('MAIL_RETRY_BASE_SECONDS', 30)
+    MAIL_CONNECTION_IDLE_TIMEOUT = env_int('MAIL_CONNECTION_IDLE_TIMEOUT', 60)
@@ -0,0 +1,222 @@
+"""Customer directory and the in-memory prefix index behind autocomplete.
+
+Orders point at rows of the customers table, which holds each customer
+once (see Customer.make_match_key). The directory lists the customers that
+have at least one order. Customers without orders, such as a misspelt name
+that was since corrected on the order, stay out of it.
+
+Suggestions are answered from CustomerIndex, a sorted list of
+(normalized key, customer id) pairs searched with bisect. Each customer is
+listed under its name, each later word of its name (so "smi" finds "John
+Smith") and its email. The index is loaded in the background shortly
+after startup, or by the first lookup if that comes sooner.
+
+Write handlers record the customers of the orders they change (see
+stats.record_order_changes); once the transaction commits, the index marks
+them stale and re-reads them from the database before the next lookup.
+Writes made by other processes are picked up on restart.
+"""
+import bisect
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, event, text
+
+from extensions import db, logger
+from models import CUSTOMER_FIELDS
+
+DEFAULT_SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+
+# SQLite caps bound parameters per statement; stay well under the old 999 limit
+_ID_CHUNK = 500
+
+_CUSTOMERS_WITH_ORDERS = text("""
+    SELECT c.id, c.name, c.email, c.phone, c.address, COUNT(*) AS order_count, MAX(po.created_at) AS last_order_at
+    FROM customers c JOIN purchase_orders po ON po.customer_id = c.id
+    WHERE c.id IN :ids
+    GROUP BY c.id
+""").bindparams(bindparam('ids', expanding=True))
+
+# The index leaves out the latest order date: counting is answered from
+# ix_purchase_orders_customer_id alone, MAX(created_at) would read every order
+_INDEX_ROWS = """
+    SELECT c.id, c.name, c.email, c.phone, c.address, o.order_count
+    FROM (SELECT customer_id, COUNT(*) AS order_count FROM purchase_orders {where} GROUP BY customer_id) o
+    JOIN customers c ON c.id = o.customer_id
+"""
+_INDEX_ALL = text(_INDEX_ROWS.format(where=''))
+_INDEX_IDS = text(_INDEX_ROWS.format(where='WHERE customer_id IN :ids')).bindparams(
+    bindparam('ids', expanding=True))
+
+
+def normalize(value):
+    """Lower-case value and collapse its whitespace, for prefix matching."""
+    return ' '.join((value or '').casefold().split())
+
+
+def index_keys(name, email):
+    """Keys a customer is found under: the name, every later word of it, and the email."""
+    keys = set()
+    words = normalize(name).split(' ')
+    for start in range(len(words)):
+        keys.add(' '.join(words[start:]))
+    keys.add(normalize(email))
+    keys.discard('')
+    return keys
+
+
+def customer_dict(row):
+    """API representation of a customers row with its order count (and latest order date, if selected)."""
+    customer = {'id': row.id}
+    # Fields that were never provided stay absent, as in Customer.to_dict()
+    customer.update((field, getattr(row, field)) for field in CUSTOMER_FIELDS if getattr(row, field) is not None)
+    customer['orderCount'] = row.order_count
+    if 'last_order_at' not in row._mapping:
+        return customer
+    last_order_at = row.last_order_at
+    if isinstance(last_order_at, str):
+        # Raw SQL hands back SQLite's text form of the DateTime column
+        last_order_at = last_order_at.replace(' ', 'T')
+    elif last_order_at is not None:
+        last_order_at = last_order_at.isoformat()
+    customer['lastOrderAt'] = last_order_at
+    return customer
+
+
+def _load(statement, customer_ids):
+    customer_ids = list(customer_ids)
+    found = {}
+    for start in range(0, len(customer_ids), _ID_CHUNK):
+        for row in db.session.execute(statement, {'ids': customer_ids[start:start + _ID_CHUNK]}):
+            found[row.id] = customer_dict(row)
+    return found
+
+
+def load_customers(customer_ids):
+    """Customers with orders among customer_ids, as {id: API dict}."""
+    return _load(_CUSTOMERS_WITH_ORDERS, customer_ids)
+
+
+class CustomerIndex:
+    """Prefix index over the customers that have orders."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Sorted (key, customer id) pairs
+        self._entries = []
+        # Customer id -> (API dict, keys)
+        self._customers = {}
+        # Customers changed by commits since the last lookup
+        self._stale = set()
+        self._loaded = False
+
+    def __len__(self):
+        return len(self._customers)
+
+    def mark_stale(self, customer_ids):
+        with self._lock:
+            self._stale.update(customer_ids)
+
+    def ensure_current(self):
+        """Load the index, or re-read the customers changed since the last lookup."""
+        with self._lock:
+            if not self._loaded:
+                self._load_all()
+            elif self._stale:
+                stale, self._stale = self._stale, set()
+                self._refresh(stale)
+
+    def _load_all(self):
+        started = time.perf_counter()
+        entries, customers = [], {}
+        for row in db.session.execute(_INDEX_ALL):
+            keys = index_keys(row.name, row.email)
+            customers[row.id] = (customer_dict(row), keys)
+            entries.extend((key, row.id) for key in keys)
+        entries.sort()
+        self._entries, self._customers = entries, customers
+        # The query saw every commit that marked a customer stale before it ran
+        self._stale.clear()
+        self._loaded = True
+        logger.info("Loaded %s customers into the suggestion index in %.0f ms",
+                    len(customers), (time.perf_counter() - started) * 1000)
+
+    def _refresh(self, customer_ids):
+        found = _load(_INDEX_IDS, customer_ids)
+        for customer_id in customer_ids:
+            self._remove(customer_id)
+            customer = found.get(customer_id)
+            # Customers left without orders drop out
+            if customer is not None:
+                keys = index_keys(customer.get('name'), customer.get('email'))
+                self._customers[customer_id] = (customer, keys)
+                for key in keys:
+                    bisect.insort(self._entries, (key, customer_id))
+
+    def _remove(self, customer_id):
+        _, keys = self._customers.pop(customer_id, (None, ()))
+        for key in keys:
+            position = bisect.bisect_left(self._entries, (key, customer_id))
+            if position < len(self._entries) and self._entries[position] == (key, customer_id):
+                del self._entries[position]
+
+    def suggest(self, query, limit=DEFAULT_SUGGEST_LIMIT):
+        """Customers with a key starting with query, in key order, each listed once."""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        self.ensure_current()
+        found, seen = [], set()
+        with self._lock:
+            entries = self._entries
+            position = bisect.bisect_left(entries, (prefix,))
+            while position < len(entries) and len(found) < limit:
+                key, customer_id = entries[position]
+                if not key.startswith(prefix):
+                    break
+                if customer_id not in seen:
+                    seen.add(customer_id)
+                    found.append(self._customers[customer_id][0])
+                position += 1
+        return found
+
+
+@event.listens_for(db.session, 'after_commit')
+def _mark_customers_stale(session):
+    customer_ids = session.info.pop('customer_ids', None)
+    if customer_ids and has_app_context():
+        index = current_app.extensions.get('customers')
+        if index is not None:
+            index.mark_stale(customer_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_customer_ids(session):
+    session.info.pop('customer_ids', None)
+
+
+def _preload(app, index):
+    try:
+        with app.app_context():
+            index.ensure_current()
+            db.session.remove()
+    except Exception as e:
+        # The first lookup tries again
+        logger.warning("Could not load the customer suggestion index: %s", e)
+
+
+def init_customers(app):
+    """Create the app's CustomerIndex and load it BACKGROUND_START_DELAY seconds from now."""
+    index = CustomerIndex()
+    app.extensions['customers'] = index
+    loader = threading.Timer(app.config['BACKGROUND_START_DELAY'], _preload, args=(app, index))
+    loader.name = 'customer-index'
+    loader.daemon = True
+    loader.start()
+    return index
+
+
+def get_customer_index():
+    return current_app.extensions['customers']
@@ -0,0 +1,188 @@
+import os
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from backup import wal_archiving_enabled
+from extensions import db, logger
+
+
+def engine_options(config):
+    """SQLAlchemy engine options for the SQLite database.
+
+    File databases default to NullPool, which opens a new connection (and
+    loses its page cache) on every checkout. A QueuePool sized to the
+    waitress thread count keeps one warm connection per worker thread.
+    """
+    return {
+        'poolclass': QueuePool,
+        'pool_size': config['WAITRESS_THREADS'],
+        'max_overflow': config['DB_POOL_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'connect_args': {
+            # Pooled connections are handed between waitress threads
+            'check_same_thread': False,
+            'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0,
+        },
+    }
+
+
+def sqlite_pragmas(config):
+    """The PRAGMA statements run on every new connection, in order."""
+    pragmas = [
+        ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT_MS']),
+        ('mmap_size', config['SQLITE_MMAP_SIZE']),
+        ('cache_size', config['SQLITE_CACHE_SIZE']),
+        ('temp_store', config['SQLITE_TEMP_STORE']),
+    ]
+    if config['SQLITE_FOREIGN_KEYS']:
+        pragmas.append(('foreign_keys', 'ON'))
+    if config['SQLITE_JOURNAL_MODE'].upper() == 'WAL':
+        pragmas.append(('journal_size_limit', wal_size_limit(config)))
+    if wal_archiving_enabled(config):
+        # The backup worker checkpoints once it has archived the frames
+        pragmas.append(('wal_autocheckpoint', 0))
+    return pragmas
+
+
+def wal_size_limit(config):
+    return config['SQLITE_WAL_SIZE_LIMIT_MB'] * 1024 * 1024
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def install_pragmas(engine, pragmas):
+    """Run the pragmas on every connection the engine opens."""
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+
+def archive_path(config):
+    return config['ARCHIVE_DB_PATH'] or os.path.join(os.path.dirname(config['DATABASE_PATH']), 'stitchpay-archive.db')
+
+
+def install_archive(engine, path, journal_size_limit=-1):
+    """Attach the archive database (see archive.py) as schema "archive" on every connection the engine opens."""
+    @event.listens_for(engine, 'connect')
+    def attach_archive(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ? AS archive", (path,))
+        dbapi_connection.execute(f"PRAGMA archive.journal_size_limit={journal_size_limit}")
+
+
+def begin_write():
+    """Take SQLite's write lock for the session's transaction now rather than at its first write.
+
+    Rows read afterwards cannot be changed by another connection before the
+    commit. Does nothing when the transaction has written already.
+    """
+    connection = db.session.connection().connection.dbapi_connection
+    # The sqlite3 module only opens a transaction on the first INSERT, UPDATE or DELETE
+    if not connection.in_transaction:
+        connection.execute('BEGIN IMMEDIATE')
+
+
+class WalCheckpointer(threading.Thread):
+    """Background thread that periodically checkpoints the WAL files.
+
+    SQLite only auto-checkpoints when a write commits and no reader holds an
+    old snapshot, so under steady read traffic the WAL can keep growing. A
+    PASSIVE checkpoint never blocks readers or writers.
+
+    With WAL archiving on, the backup worker checkpoints the main database
+    once it has archived the frames (backup.py). This thread then leaves the
+    main WAL alone until it grows past size_limit bytes. At that point it
+    archives the frames itself and checkpoints, or, if archiving fails,
+    checkpoints anyway and lets the next archiving pass start over from a new
+    snapshot. The attached archive database is always checkpointed here:
+    wal_autocheckpoint=0 applies to it as well, and the backup worker leaves
+    it alone.
+    """
+
+    def __init__(self, engine, interval, wal_path=None, size_limit=0, wal_archived=False):
+        super().__init__(name='wal-checkpoint', daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.wal_path = wal_path
+        self.size_limit = size_limit
+        self.wal_archived = wal_archived
+        # The backup worker's WalArchiver, set by init_backups
+        self.archiver = None
+        self._handled_size = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        if not self.wal_archived:
+            self.checkpoint()
+        elif self.size_limit > 0:
+            self.check_size()
+        self.checkpoint(schema='archive')
+
+    def check_size(self):
+        """Checkpoint the main WAL if it has grown past size_limit since the last time this was needed."""
+        try:
+            size = os.path.getsize(self.wal_path)
+        except OSError:
+            return
+        # A fully checkpointed WAL keeps its size until the next write restarts it
+        if size <= self.size_limit or size == self._handled_size:
+            return
+        self._handled_size = size
+        logger.warning("WAL is %.0f MB, over the %.0f MB limit; checkpointing it without the backup worker",
+                       size / 1048576, self.size_limit / 1048576)
+        if self.archiver is not None:
+            try:
+                # Archives the newest frames, then checkpoints up to them
+                self.archiver.run_pass()
+                return
+            except Exception as e:
+                logger.error("Could not archive the WAL before checkpointing it: %s", e)
+            try:
+                self.archiver.checkpoint_unarchived('TRUNCATE')
+            except Exception as e:
+                logger.warning("WAL checkpoint failed: %s", e)
+        else:
+            self.checkpoint('TRUNCATE')
+
+    def checkpoint(self, mode='PASSIVE', schema='main'):
+        try:
+            with self.engine.connect() as conn:
+                busy, log_frames, checkpointed = conn.exec_driver_sql(
+                    f"PRAGMA {schema}.wal_checkpoint({mode})").one()
+            logger.debug("WAL checkpoint of %s: %s/%s frames, busy=%s", schema, checkpointed, log_frames, busy)
+        except Exception as e:
+            logger.warning("WAL checkpoint of %s failed: %s", schema, e)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def init_database(app):
+    """Set up the app's engine: connection pragmas, the attached archive database and the WAL checkpoint thread."""
+    engine = db.get_engine(app)
+    install_pragmas(engine, sqlite_pragmas(app.config))
+    install_archive(engine, archive_path(app.config), wal_size_limit(app.config))
+
+    checkpointer = None
+    interval = app.config['SQLITE_WAL_CHECKPOINT_INTERVAL']
+    if interval > 0 and app.config['SQLITE_JOURNAL_MODE'].upper() == 'WAL':
+        checkpointer = WalCheckpointer(engine, interval, wal_path=app.config['DATABASE_PATH'] + '-wal',
+                                       size_limit=wal_size_limit(app.config),
+                                       wal_archived=wal_archiving_enabled(app.config))
+        checkpointer.start()
+    app.extensions['wal_checkpointer'] = checkpointer
+    return engine
@@ -0,0 +1,129 @@
+"""Batch documents: the PDFs of many purchase orders as one download.
+
+Orders are loaded a chunk at a time and handed to the PDF renderer, which
+keeps every worker of its process pool busy (see PdfRenderer.iter_pdfs)
+and serves unchanged orders from its cache. Two formats:
+
+* zip: one PDF per order, streamed entry by entry as the documents are
+  finished. Orders that fail to render are listed in errors.txt at the end
+  of the archive.
+* pdf: a single PDF with every order, merged with pypdf once all of them
+  are rendered, since a PDF cannot be written before all its pages exist.
+"""
+import io
+import tempfile
+import zipfile
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+from extensions import db, logger
+from models import PurchaseOrder
+from pdf_generator import PdfUnavailableError
+
+BATCH_FORMATS = ('zip', 'pdf')
+# Orders loaded per query while a batch is rendered
+LOAD_CHUNK_SIZE = 50
+# Bytes per chunk when streaming a merged PDF
+STREAM_CHUNK_SIZE = 64 * 1024
+# Merged PDFs larger than this are spooled to a temporary file
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+class DocumentError(RuntimeError):
+    """Raised when a merged PDF cannot be produced because one of its orders failed."""
+
+
+def _describe(error):
+    # A timeout's message is empty
+    return str(error) or type(error).__name__
+
+
+def document_filename(order):
+    return secure_filename(f"PurchaseOrder_{order.order_number}.pdf") or f"PurchaseOrder_{order.id}.pdf"
+
+
+def iter_orders(order_ids, chunk_size=LOAD_CHUNK_SIZE):
+    """Load PurchaseOrders a chunk at a time, in the order of order_ids."""
+    for start in range(0, len(order_ids), chunk_size):
+        ids = order_ids[start:start + chunk_size]
+        by_id = {order.id: order for order in PurchaseOrder.query.filter(PurchaseOrder.id.in_(ids))}
+        for order_id in ids:
+            # Deleted since the ids were read
+            if order_id in by_id:
+                yield by_id[order_id]
+        # Rendered orders are not needed again
+        db.session.expunge_all()
+
+
+class _StreamBuffer:
+    """Write-only file for zipfile that gives back what was written since the last take()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(renderer, order_ids):
+    """Yield a ZIP archive of the orders' PDFs, one entry at a time."""
+    buffer = _StreamBuffer()
+    errors = []
+    # PDFs are compressed already; the stream is not seekable, so zipfile
+    # writes sizes in data descriptors after each entry
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for order, pdf, error in renderer.iter_pdfs(iter_orders(order_ids)):
+            if error is not None:
+                logger.error("Left order %s out of a batch download: %s", order.id, error)
+                errors.append(f"{order.order_number}: {_describe(error)}")
+                continue
+            info = zipfile.ZipInfo(document_filename(order), date_time=datetime.now().timetuple()[:6])
+            archive.writestr(info, pdf)
+            yield buffer.take()
+        if errors:
+            archive.writestr('errors.txt', '\n'.join(errors) + '\n')
+    yield buffer.take()
+
+
+def merge_pdfs(pdfs):
+    """Merge PDF documents into one; returns a file object positioned at the start."""
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError as e:
+        raise PdfUnavailableError(f"Merged PDFs require pypdf: {e}")
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(PdfReader(io.BytesIO(pdf)))
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    writer.write(output)
+    output.seek(0)
+    return output
+
+
+def merged_pdf(renderer, order_ids):
+    """Render the orders and return their merged PDF as a file object."""
+    pdfs = []
+    for order, pdf, error in renderer.iter_pdfs(iter_orders(order_ids)):
+        if error is not None:
+            raise DocumentError(f"Could not render order {order.order_number}: {_describe(error)}")
+        pdfs.append(pdf)
+    return merge_pdfs(pdfs)
+
+
+def stream_file(output, chunk_size=STREAM_CHUNK_SIZE):
+    with output:
+        while True:
+            chunk = output.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -1,25 +1,32 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from flask_mail import Mail
 import logging
 import os
 
-# Set up logging
+# Plain console logging for scripts that run without the app; create_app
+# replaces it with the queued pipeline from logs.py
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler() # Log to console
-    ]
 )
 logger = logging.getLogger('stitchpay')
 
 # Initialize extensions instances.
 # They will be initialized with the Flask app object in app.py (or create_app).
 db = SQLAlchemy()
-mail = Mail()
 
-def init_mail(app):
-    """Initialize the mail extension with the Flask app."""
-    mail.init_app(app)
+def get_mail():
+    """Return the app's Flask-Mail state, importing and initializing Flask-Mail on first use.
 
-__all__ = ['db', 'logger', 'mail']
+    Only the mail worker sends email, so Flask-Mail (and the email package
+    it pulls in) is not loaded while the app starts.
+    """
+    app = current_app._get_current_object()
+    # Mail.init_app stores the state, which connects and sends, in app.extensions
+    mail = app.extensions.get('mail')
+    if mail is None:
+        from flask_mail import Mail
+        mail = Mail().init_app(app)
+    return mail
+
+__all__ = ['db', 'logger', 'get_mail']
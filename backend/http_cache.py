@@ -0,0 +1,56 @@
+"""Validators for conditional requests: ETags, Last-Modified and If-Match.
+
+An order's ETag comes from its version and updated_at, so a detail request
+can be answered with 304 after reading those two columns, without loading
+or serializing the order. List ETags are a hash of whatever identifies the
+page's contents.
+"""
+import hashlib
+from datetime import timezone
+
+from flask import Response, request
+
+# Clients must revalidate every time, which costs a 304 when nothing changed
+CACHE_CONTROL = 'private, no-cache'
+
+
+def order_etag(version, updated_at):
+    """Strong ETag of one order's representation."""
+    return f"{version}-{updated_at.strftime('%Y%m%d%H%M%S%f')}"
+
+
+def list_etag(*parts):
+    """Strong ETag of a list response, from values that change whenever its contents do."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def is_not_modified(etag, last_modified=None):
+    """True if the request's If-None-Match (or, without one, If-Modified-Since) matches.
+
+    Pass last_modified only where it changes with every change of the
+    response; list responses are validated by ETag alone, since a deleted
+    order does not move their Last-Modified.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    return False
+
+
+def with_validators(response, etag, last_modified=None):
+    """Add ETag, Last-Modified and Cache-Control headers to a response."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def if_match_fails(etag):
+    """True if the request has an If-Match header that does not match etag."""
+    return bool(request.if_match) and not request.if_match.contains(etag)
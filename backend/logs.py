@@ -0,0 +1,187 @@
+"""Logging pipeline: records are queued by the caller and written by a background thread.
+
+init_logging() gives the root logger a single QueueHandler. On the calling
+thread it only merges the message with its arguments and tags the record
+with the current request id; formatting (JSON lines by default) and
+writing happen on a QueueListener thread, so a slow console or disk never
+holds up a request. Messages use %-style arguments, which are not even
+merged when the level is disabled.
+
+Every request gets an id, taken from an incoming X-Request-ID header or
+generated, and returned in the same header. One access line per request
+records the method, path, status and duration; requests to
+LOG_SAMPLED_PATHS (health checks, metrics scrapes) are logged once every
+LOG_SAMPLE_EVERY requests unless they fail or are slow.
+"""
+import atexit
+import itertools
+import json
+import logging
+import queue
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Incoming request ids that are reused as they are; anything else is replaced
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s -%(request_tag)s %(message)s'
+
+# LogRecord attributes that are not extra fields passed by the caller
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id', 'request_tag'}
+
+access_logger = logging.getLogger('stitchpay.access')
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['requestId'] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The console format, plus the request id when there is one."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record):
+        request_id = getattr(record, 'request_id', None)
+        record.request_tag = f' [{request_id}]' if request_id else ''
+        return super().formatMessage(record)
+
+
+class RequestQueueHandler(QueueHandler):
+    """Puts records on the listener's queue after doing the minimum on the calling thread.
+
+    The message is merged with its arguments here, because the arguments may
+    change or stop being valid once the caller moves on, and tracebacks are
+    rendered while their frames still exist. Everything else is left to the
+    listener.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _parse_levels(spec):
+    """Parse "logger=LEVEL,other.logger=LEVEL" into a dict."""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level, fmt='json', levels=None, stream=None):
+    """Route all logging through a queue to a listener thread writing to stream (default stderr)."""
+    global _listener
+    _stop_listener()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    log_queue = queue.SimpleQueue()
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(RequestQueueHandler(log_queue))
+    root.setLevel(level.upper())
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def _stop_listener():
+    # Writes out whatever is still queued; stop() fails on a listener that was already stopped
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+atexit.register(_stop_listener)
+
+
+def init_logging(app):
+    """Configure logging from the app config and add request ids and the access log."""
+    config = app.config
+    listener = configure_logging(config['LOG_LEVEL'], config['LOG_FORMAT'], _parse_levels(config['LOG_LEVELS']))
+    app.extensions['log_listener'] = listener
+
+    sampled_paths = {path.strip() for path in config['LOG_SAMPLED_PATHS'].split(',') if path.strip()}
+    sample_every = max(1, config['LOG_SAMPLE_EVERY'])
+    slow_seconds = config['SLOW_REQUEST_MS'] / 1000
+    # One counter per path; next() on itertools.count is atomic under the GIL
+    counters = {path: itertools.count() for path in sampled_paths}
+
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        g.log_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        started = g.pop('log_started', None)
+        if started is None or not access_logger.isEnabledFor(logging.INFO):
+            return response
+        # Streamed bodies are timed up to the first byte
+        elapsed = time.perf_counter() - started
+        counter = counters.get(request.path)
+        if (counter is not None and response.status_code < 500 and elapsed < slow_seconds
+                and next(counter) % sample_every):
+            return response
+        access_logger.info("%s %s -> %s in %.1f ms", request.method, request.path, response.status_code,
+                           elapsed * 1000, extra={
+                               'method': request.method,
+                               'path': request.path,
+                               'status': response.status_code,
+                               'durationMs': round(elapsed * 1000, 1),
+                               'sampled': counter is not None,
+                           })
+        return response
+
+    return listener
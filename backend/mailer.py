@@ -0,0 +1,256 @@
+"""Durable outbound email: an outbox table drained by a background worker.
+
+The /email endpoint only inserts an EmailJob row and returns its id. The
+MailWorker thread claims due jobs in batches, sends them over one SMTP
+connection that is kept open between batches, and retries failures with
+exponential backoff. Delivery status is read back from the outbox table.
+
+To try it locally against a stub SMTP server:
+
+    python -m aiosmtpd -n -l localhost:8025
+    MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_USE_TLS=false python app.py
+"""
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from extensions import db, get_mail, logger
+from metrics import EMAIL_SECONDS
+from models import EmailJob, PurchaseOrder
+from pdf_generator import EMAIL_TEMPLATE, PdfUnavailableError, get_renderer
+
+# Errors that will not go away by retrying the same message, besides
+# Flask-Mail's BadHeaderError (see permanent_errors)
+PERMANENT_SMTP_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+# A job left in 'sending' this long belongs to a worker that died mid-batch
+STALE_SENDING_AFTER = timedelta(minutes=10)
+MAX_RETRY_DELAY = 3600
+# Seconds of idleness after which a kept-open connection is checked with NOOP
+NOOP_AFTER_IDLE = 10
+SMTP_TIMEOUT = 60
+
+
+class PermanentMailError(Exception):
+    """A job that can never be sent, such as one whose order was deleted."""
+
+
+def permanent_errors():
+    # Flask-Mail is imported by the first send, not when the app starts
+    from flask_mail import BadHeaderError
+    return (PermanentMailError, BadHeaderError, *PERMANENT_SMTP_ERRORS)
+
+
+def enqueue_order_email(order_id, recipient, subject, message=''):
+    """Add an email job to the session; it is queued once the caller commits."""
+    job = EmailJob(
+        id=str(uuid.uuid4()),
+        purchase_order_id=order_id,
+        recipient=recipient,
+        subject=subject,
+        message=message,
+        status='queued',
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    return job
+
+
+def build_order_message(job):
+    """Render the purchase order email for a job, with the PDF attached when available."""
+    from flask_mail import Message
+
+    # Message takes its default sender from the app's Flask-Mail state
+    get_mail()
+    order = db.session.get(PurchaseOrder, job.purchase_order_id)
+    if order is None:
+        raise PermanentMailError(f"Purchase order {job.purchase_order_id} no longer exists")
+
+    customer = order.customer or {}
+    msg = Message(
+        subject=job.subject,
+        recipients=[job.recipient],
+        body=job.message or None,
+        html=get_renderer().render(
+            EMAIL_TEMPLATE,
+            order_number=order.order_number,
+            customer_name=customer.get('name', ''),
+            order_date=order.created_at.strftime('%B %d, %Y'),
+            total=f"{order.total:.2f}",
+            message=job.message,
+            current_year=datetime.now().year
+        )
+    )
+    try:
+        pdf, _ = get_renderer().get_pdf(order)
+        msg.attach(filename=f"PurchaseOrder_{order.order_number}.pdf", content_type='application/pdf', data=pdf)
+    except PdfUnavailableError as e:
+        logger.warning("Sending email job %s without PDF attachment: %s", job.id, e)
+    return msg
+
+
+class MailWorker(threading.Thread):
+    """Background thread that drains the email outbox."""
+
+    def __init__(self, app, batch_size=20, poll_interval=5, max_attempts=5,
+                 retry_base_seconds=30, idle_timeout=60, start_delay=0):
+        super().__init__(name='mail-worker', daemon=True)
+        self.app = app
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.idle_timeout = idle_timeout
+        self.start_delay = start_delay
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._connection = None
+        self._last_used = 0.0
+
+    def notify(self):
+        """Wake the worker after queueing a job."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        # Jobs queued meanwhile wait; a stop does not
+        if self._stopping.wait(self.start_delay):
+            return
+        try:
+            with self.app.app_context():
+                self.recover_stale_jobs()
+        except Exception as e:
+            # The worker still sends new jobs; stale ones are requeued on the next start
+            logger.error("Could not requeue stale email jobs: %s", e, exc_info=True)
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    sent = self.process_batch()
+            except Exception as e:
+                logger.error("Mail worker batch failed: %s", e, exc_info=True)
+                self._close_connection()
+                sent = 0
+            if sent == 0:
+                if self._connection is not None and time.monotonic() - self._last_used > self.idle_timeout:
+                    self._close_connection()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        self._close_connection()
+
+    def recover_stale_jobs(self):
+        """Requeue jobs claimed by a worker that stopped before finishing them."""
+        cutoff = datetime.utcnow() - STALE_SENDING_AFTER
+        count = (EmailJob.query
+                 .filter(EmailJob.status == 'sending', EmailJob.next_attempt_at < cutoff)
+                 .update({'status': 'queued'}, synchronize_session=False))
+        db.session.commit()
+        if count:
+            logger.info("Requeued %s email jobs left in 'sending'", count)
+
+    def claim_batch(self):
+        """Mark up to batch_size due jobs as 'sending' and return their ids."""
+        now = datetime.utcnow()
+        candidates = [job_id for (job_id,) in
+                      db.session.query(EmailJob.id)
+                      .filter(EmailJob.status == 'queued', EmailJob.next_attempt_at <= now)
+                      .order_by(EmailJob.next_attempt_at)
+                      .limit(self.batch_size)]
+        claimed = []
+        for job_id in candidates:
+            # Conditional update, so two workers can never claim the same job
+            updated = (EmailJob.query
+                       .filter(EmailJob.id == job_id, EmailJob.status == 'queued')
+                       .update({'status': 'sending', 'attempts': EmailJob.attempts + 1, 'next_attempt_at': now},
+                               synchronize_session=False))
+            if updated:
+                claimed.append(job_id)
+        db.session.commit()
+        return claimed
+
+    def process_batch(self):
+        job_ids = self.claim_batch()
+        for job_id in job_ids:
+            job = db.session.get(EmailJob, job_id)
+            started = time.perf_counter()
+            try:
+                msg = build_order_message(job)
+                self._get_connection().send(msg)
+                self._last_used = time.monotonic()
+            except permanent_errors() as e:
+                self._mark_failed(job, e)
+            except (smtplib.SMTPException, OSError) as e:
+                # The connection may be broken; reconnect for the next job
+                self._close_connection()
+                self._schedule_retry(job, e)
+            except Exception as e:
+                self._schedule_retry(job, e)
+            else:
+                job.status = 'sent'
+                job.sent_at = datetime.utcnow()
+                job.last_error = None
+                logger.info("Sent email job %s to %s", job.id, job.recipient)
+            EMAIL_SECONDS.observe(time.perf_counter() - started, 'retry' if job.status == 'queued' else job.status)
+            db.session.commit()
+        return len(job_ids)
+
+    def _mark_failed(self, job, error):
+        job.status = 'failed'
+        job.last_error = str(error)
+        logger.error("Email job %s failed permanently: %s", job.id, error)
+
+    def _schedule_retry(self, job, error):
+        if job.attempts >= self.max_attempts:
+            self._mark_failed(job, error)
+            return
+        delay = min(self.retry_base_seconds * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+        job.status = 'queued'
+        job.last_error = str(error)
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        logger.warning("Email job %s attempt %s failed, retrying in %ss: %s", job.id, job.attempts, delay, error)
+
+    def _get_connection(self):
+        """Return an open SMTP connection, reusing the previous one while it is alive."""
+        idle = time.monotonic() - self._last_used
+        if self._connection is not None and self._connection.host is not None and idle > NOOP_AFTER_IDLE:
+            # The server may have dropped a connection that sat idle between batches
+            try:
+                self._connection.host.noop()
+            except (smtplib.SMTPException, OSError):
+                self._close_connection()
+        if self._connection is None:
+            self._connection = get_mail().connect()
+            self._connection.__enter__()
+            if self._connection.host is not None and self._connection.host.sock is not None:
+                # Flask-Mail opens the socket without a timeout; never let a stalled relay hang the worker
+                self._connection.host.sock.settimeout(SMTP_TIMEOUT)
+        return self._connection
+
+    def _close_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+def init_mail_worker(app):
+    """Start the outbox worker unless MAIL_WORKER_ENABLED is off."""
+    worker = None
+    if app.config['MAIL_WORKER_ENABLED']:
+        worker = MailWorker(
+            app,
+            batch_size=app.config['MAIL_BATCH_SIZE'],
+            poll_interval=app.config['MAIL_POLL_INTERVAL'],
+            max_attempts=app.config['MAIL_MAX_ATTEMPTS'],
+            retry_base_seconds=app.config['MAIL_RETRY_BASE_SECONDS'],
+            idle_timeout=app.config['MAIL_CONNECTION_IDLE_TIMEOUT'],
+            start_delay=app.config['BACKGROUND_START_DELAY'],
+        )
+        worker.start()
+    app.extensions['mail_worker'] = worker
+    return worker
@@ -0,0 +1,245 @@
+"""Request, SQL, PDF and email instrumentation exposed in Prometheus text format.
+
+Metrics live in a process-wide registry and are updated with a lock held
+for a few list operations, so they are cheap enough to leave on. SQL
+statements are timed through SQLAlchemy cursor events; each request also
+accumulates its own query count and time, which feed per-endpoint
+histograms and the slow request log. Scrape them from GET /metrics.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event, func
+
+from extensions import db, logger
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers a cached GET through a cold PDF render
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+SQL_KINDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+# Characters of a slow statement written to the log
+SLOW_QUERY_LOG_CHARS = 500
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Ordered collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> [per-bucket counts (last is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labelvalues, list(counts), total)
+                            for labelvalues, (counts, total) in self._series.items())
+        bounds = self.buckets + (float('inf'),)
+        for labelvalues, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackGauge:
+    """Gauge whose samples are read at scrape time from a function returning (labelvalues, value) pairs."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, callback, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        registry.register(self)
+
+    def samples(self):
+        try:
+            values = list(self.callback())
+        except Exception as e:
+            logger.warning("Could not collect %s: %s", self.name, e)
+            return
+        for labelvalues, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+REQUEST_SECONDS = Histogram(
+    'stitchpay_http_request_duration_seconds', 'Time spent handling HTTP requests.',
+    ('method', 'endpoint', 'status'))
+REQUEST_SQL_QUERIES = Histogram(
+    'stitchpay_http_request_sql_queries', 'SQL statements executed per HTTP request.',
+    ('method', 'endpoint'), buckets=QUERY_COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    'stitchpay_http_request_sql_duration_seconds', 'Time spent in SQL per HTTP request.',
+    ('method', 'endpoint'))
+SQL_QUERY_SECONDS = Histogram(
+    'stitchpay_sql_query_duration_seconds', 'SQL statement execution time.', ('statement',))
+SLOW_QUERIES = Counter(
+    'stitchpay_sql_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS.', ('statement',))
+PDF_SECONDS = Histogram(
+    'stitchpay_pdf_duration_seconds', 'Time to produce a purchase order PDF.', ('outcome',))
+EMAIL_SECONDS = Histogram(
+    'stitchpay_email_send_duration_seconds', 'Time to build and send one outbox email.', ('outcome',))
+BACKUP_SECONDS = Histogram(
+    'stitchpay_backup_duration_seconds', 'Time to take a backup snapshot or archive WAL frames.',
+    ('operation', 'outcome'))
+
+
+def _outbox_jobs():
+    from models import EmailJob
+    return [((status,), count) for status, count in
+            db.session.query(EmailJob.status, func.count()).group_by(EmailJob.status)]
+
+
+def _pool_in_use():
+    return [((), db.engine.pool.checkedout())]
+
+
+CallbackGauge('stitchpay_email_outbox_jobs', 'Email outbox jobs by status.', ('status',), _outbox_jobs)
+CallbackGauge('stitchpay_db_pool_connections_in_use', 'Database connections checked out of the pool.', (),
+              _pool_in_use)
+
+
+def statement_kind(statement):
+    keyword = statement.lstrip()[:6].upper()
+    return keyword if keyword in SQL_KINDS else 'OTHER'
+
+
+def install_sql_metrics(engine, slow_query_seconds):
+    """Time every statement run on the engine and log the slow ones."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop('query_started', time.perf_counter())
+        kind = statement_kind(statement)
+        SQL_QUERY_SECONDS.observe(elapsed, kind)
+        if has_app_context():
+            request_sql = g.get('request_sql')
+            if request_sql is not None:
+                request_sql[0] += 1
+                request_sql[1] += elapsed
+        if elapsed >= slow_query_seconds:
+            SLOW_QUERIES.inc(kind)
+            logger.warning("Slow query (%.0f ms): %s", elapsed * 1000, statement[:SLOW_QUERY_LOG_CHARS])
+
+
+def init_metrics(app):
+    """Instrument the app's requests and engine and add GET /metrics, unless METRICS_ENABLED is off."""
+    if not app.config['METRICS_ENABLED']:
+        return
+    install_sql_metrics(db.get_engine(app), app.config['SLOW_QUERY_MS'] / 1000)
+    slow_request_seconds = app.config['SLOW_REQUEST_MS'] / 1000
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        # [statement count, seconds], filled in by record_query
+        g.request_sql = [0, 0.0]
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        # Streamed bodies are timed up to the first byte
+        elapsed = time.perf_counter() - started
+        queries, sql_seconds = g.pop('request_sql', (0, 0.0))
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, request.method, endpoint, str(response.status_code))
+        REQUEST_SQL_QUERIES.observe(queries, request.method, endpoint)
+        REQUEST_SQL_SECONDS.observe(sql_seconds, request.method, endpoint)
+        if elapsed >= slow_request_seconds:
+            logger.warning("Slow request %s %s -> %s: %.0f ms, %s queries in %.0f ms", request.method, request.path,
+                           response.status_code, elapsed * 1000, queries, sql_seconds * 1000)
+        return response
+
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
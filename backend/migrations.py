@@ -0,0 +1,803 @@
+"""Versioned schema migrations for the SQLite database.
+
+Each migration has a number and runs at most once per database. Its
+``apply`` step runs in a single transaction together with the row that
+records it in schema_version, so a failed migration leaves no trace and is
+retried on the next start. Data changes over whole tables go in the
+``batch`` step instead, which is called repeatedly, one transaction per
+batch, until it reports fewer rows than the batch size. Other connections
+can read and write between batches, and an interrupted migration resumes
+where it stopped. An optional ``finish`` step runs in the transaction of
+the last batch, for work that has to wait until every batch is done, such
+as swapping a rebuilt table in.
+
+Migrations work on the schema as the previous migration left it, so they
+use their own SQL and never the current models. Add new ones to the end of
+MIGRATIONS with the next version number; never edit one that has shipped.
+
+create_app runs migrate_database() on startup. When the database is
+already at the latest version that costs one query. From the command line:
+
+    python migrations.py            # apply pending migrations
+    python migrations.py status     # list applied and pending migrations
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from extensions import logger
+
+# Rows changed per transaction by batched data migrations
+DEFAULT_BATCH_SIZE = 5000
+
+_SCHEMA_VERSION_TABLE = """CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER NOT NULL PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at DATETIME NOT NULL,
+    completed_at DATETIME
+)"""
+
+
+class MigrationError(RuntimeError):
+    """Raised when the database cannot be brought to the current schema version."""
+
+
+class Migration:
+    def __init__(self, version, description, apply=None, batch=None, finish=None):
+        self.version = version
+        self.description = description
+        self.apply = apply
+        self.batch = batch
+        self.finish = finish
+
+
+@contextmanager
+def transaction(conn):
+    """Run the block in an IMMEDIATE transaction on an autocommit sqlite3 connection."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def add_missing_columns(conn, table, columns):
+    """ALTER TABLE ADD COLUMN each (name, DDL) pair the table does not have yet."""
+    existing = set(table_columns(conn, table))
+    added = []
+    for name, ddl in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+            added.append(name)
+    return added
+
+
+# --- 1: baseline ------------------------------------------------------------
+# The schema of databases created before versioned migrations, which may
+# still be in any earlier state: JSON customer/line_items columns, missing
+# due_date, version or updated_at columns, missing tables or indexes.
+
+_BASELINE_TABLES = [
+    """CREATE TABLE IF NOT EXISTS customers (
+        id INTEGER NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        email VARCHAR(255),
+        phone VARCHAR(50),
+        address TEXT,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS purchase_orders (
+        id VARCHAR(36) NOT NULL,
+        order_number VARCHAR(100) NOT NULL,
+        customer_id INTEGER NOT NULL,
+        subtotal FLOAT NOT NULL,
+        tax_rate FLOAT NOT NULL,
+        tax_amount FLOAT NOT NULL,
+        total FLOAT NOT NULL,
+        notes TEXT,
+        status VARCHAR(20) NOT NULL,
+        created_at DATETIME NOT NULL,
+        due_date DATETIME,
+        updated_at DATETIME NOT NULL,
+        version INTEGER DEFAULT '1' NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (order_number),
+        FOREIGN KEY(customer_id) REFERENCES customers (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS line_items (
+        row_id INTEGER NOT NULL,
+        purchase_order_id VARCHAR(36) NOT NULL,
+        position INTEGER NOT NULL,
+        item_id VARCHAR(100),
+        description TEXT NOT NULL,
+        quantity FLOAT NOT NULL,
+        unit_price FLOAT NOT NULL,
+        PRIMARY KEY (row_id),
+        FOREIGN KEY(purchase_order_id) REFERENCES purchase_orders (id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS order_summary (
+        dimension VARCHAR(10) NOT NULL,
+        bucket VARCHAR(20) NOT NULL,
+        order_count INTEGER NOT NULL,
+        total FLOAT NOT NULL,
+        PRIMARY KEY (dimension, bucket)
+    )""",
+    """CREATE TABLE IF NOT EXISTS order_changes (
+        seq INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        order_id VARCHAR(36) NOT NULL,
+        deleted BOOLEAN NOT NULL,
+        changed_at DATETIME NOT NULL,
+        UNIQUE (order_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS email_outbox (
+        id VARCHAR(36) NOT NULL,
+        purchase_order_id VARCHAR(36) NOT NULL,
+        recipient VARCHAR(255) NOT NULL,
+        subject VARCHAR(255) NOT NULL,
+        message TEXT,
+        status VARCHAR(20) NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_error TEXT,
+        created_at DATETIME NOT NULL,
+        next_attempt_at DATETIME NOT NULL,
+        sent_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS purchase_order_fts_map (
+        doc_id INTEGER PRIMARY KEY,
+        order_id VARCHAR(36) NOT NULL UNIQUE
+    )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS purchase_order_fts USING fts5(
+        order_number, customer_name, customer_email, items, notes,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+]
+
+_BASELINE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_customers_email ON customers (email)",
+    "CREATE INDEX IF NOT EXISTS ix_customers_name_email ON customers (name, email)",
+    "CREATE INDEX IF NOT EXISTS ix_purchase_orders_customer_id ON purchase_orders (customer_id)",
+    "CREATE INDEX IF NOT EXISTS ix_purchase_orders_created_at_id ON purchase_orders (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_line_items_description ON line_items (description)",
+    "CREATE INDEX IF NOT EXISTS ix_line_items_order_position ON line_items (purchase_order_id, position)",
+    "CREATE INDEX IF NOT EXISTS ix_email_outbox_purchase_order_id ON email_outbox (purchase_order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_email_outbox_status_next_attempt ON email_outbox (status, next_attempt_at)",
+]
+
+
+def _load_json(value, default):
+    try:
+        loaded = json.loads(value) if value else default
+    except ValueError:
+        return default
+    return loaded if isinstance(loaded, type(default)) else default
+
+
+# The legacy customer and line item objects as the API accepted them when
+# this migration was written; frozen here, so later changes to the models
+# cannot change what this migration does
+_LEGACY_CUSTOMER_FIELDS = ('name', 'email', 'phone', 'address')
+
+
+def _legacy_customer(data):
+    values = tuple(None if data.get(field) is None else str(data.get(field)) for field in _LEGACY_CUSTOMER_FIELDS)
+    return ('' if values[0] is None else values[0],) + values[1:]
+
+
+def _legacy_number(value, what, order_id):
+    """value as a float; anything that is not a finite number becomes 0 with a warning."""
+    if value is None or value == '':
+        return 0.0
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = None
+    if number is None or not math.isfinite(number):
+        logger.warning("Legacy order %s: %s %r is not a number, stored as 0", order_id, what, value)
+        return 0.0
+    return number
+
+
+def _legacy_customer_id(conn, key, customer_ids):
+    if key not in customer_ids:
+        row = conn.execute("SELECT id FROM customers WHERE name = ? AND email IS ? AND phone IS ? AND address IS ?",
+                           key).fetchone()
+        if row is None:
+            row = (conn.execute("INSERT INTO customers (name, email, phone, address) VALUES (?, ?, ?, ?)",
+                                key).lastrowid,)
+        customer_ids[key] = row[0]
+    return customer_ids[key]
+
+
+def _convert_legacy_orders(conn, batch_size):
+    """Move the next batch_size orders with JSON customer/line_items columns out of purchase_orders_legacy.
+
+    Converted rows are deleted from the legacy table in the same
+    transaction, so an interrupted run resumes at the lowest remaining
+    rowid. The table is dropped by the batch that empties it.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'purchase_orders_legacy'"
+                    ).fetchone() is None:
+        return 0
+    legacy_columns = table_columns(conn, 'purchase_orders_legacy')
+    due_date_expr = 'due_date' if 'due_date' in legacy_columns else 'NULL'
+    rows = conn.execute(
+        "SELECT rowid, id, order_number, customer, line_items, subtotal, tax_rate, tax_amount, total, "
+        f"notes, status, created_at, {due_date_expr} FROM purchase_orders_legacy ORDER BY rowid LIMIT ?",
+        (batch_size,)).fetchall()
+
+    customer_ids, orders, items = {}, [], []
+    for (_, order_id, order_number, customer_json, items_json, subtotal, tax_rate,
+         tax_amount, total, notes, status, created_at, due_date) in rows:
+        customer_id = _legacy_customer_id(conn, _legacy_customer(_load_json(customer_json, {})), customer_ids)
+        orders.append((order_id, order_number, customer_id, _legacy_number(subtotal, 'subtotal', order_id),
+                       _legacy_number(tax_rate, 'tax rate', order_id),
+                       _legacy_number(tax_amount, 'tax amount', order_id), _legacy_number(total, 'total', order_id),
+                       notes, status, created_at, due_date, created_at))
+        for position, item in enumerate(_load_json(items_json, [])):
+            if not isinstance(item, dict):
+                logger.warning("Legacy order %s: skipped line item %s, which is not an object", order_id, position)
+                continue
+            item_id = item.get('id')
+            items.append((order_id, position, None if item_id is None else str(item_id),
+                          str(item.get('description') or ''),
+                          _legacy_number(item.get('quantity'), 'quantity', order_id),
+                          _legacy_number(item.get('unitPrice'), 'unit price', order_id)))
+
+    conn.executemany(
+        "INSERT INTO purchase_orders (id, order_number, customer_id, subtotal, tax_rate, tax_amount, "
+        "total, notes, status, created_at, due_date, updated_at, version) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)",
+        orders)
+    conn.executemany(
+        "INSERT INTO line_items (purchase_order_id, position, item_id, description, quantity, unit_price) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        items)
+    if rows:
+        conn.execute("DELETE FROM purchase_orders_legacy WHERE rowid <= ?", (rows[-1][0],))
+    if len(rows) < batch_size:
+        conn.execute("DROP TABLE purchase_orders_legacy")
+        logger.info("Moved the customers and line items of legacy orders into their own tables")
+    return len(rows)
+
+
+def _baseline(conn, batch_size):
+    columns = table_columns(conn, 'purchase_orders')
+    legacy = 'customer' in columns and 'line_items' in columns
+    if legacy:
+        # Free the table name and its index names for the normalized table
+        indexes = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'purchase_orders' "
+            "AND sql IS NOT NULL").fetchall()
+        for (index_name,) in indexes:
+            conn.execute(f'DROP INDEX "{index_name}"')
+        conn.execute("ALTER TABLE purchase_orders RENAME TO purchase_orders_legacy")
+
+    for statement in _BASELINE_TABLES:
+        conn.execute(statement)
+    if columns and not legacy:
+        add_missing_columns(conn, 'purchase_orders', [
+            ('due_date', "DATETIME"),
+            ('updated_at', "DATETIME"),
+            ('version', "INTEGER NOT NULL DEFAULT 1"),
+        ])
+    for statement in _BASELINE_INDEXES:
+        conn.execute(statement)
+    conn.execute("DROP TABLE IF EXISTS email_settings")
+    # Legacy orders are converted by the batch step
+
+
+def _backfill_updated_at(conn, batch_size):
+    return conn.execute(
+        "UPDATE purchase_orders SET updated_at = created_at WHERE rowid IN "
+        "(SELECT rowid FROM purchase_orders WHERE updated_at IS NULL LIMIT ?)", (batch_size,)).rowcount
+
+
+def _baseline_batch(conn, batch_size):
+    # Fewer rows than batch_size only once both steps have run out of work
+    done = _convert_legacy_orders(conn, batch_size)
+    if done < batch_size:
+        done += _backfill_updated_at(conn, batch_size - done)
+    return done
+
+
+# --- 2: order summary -------------------------------------------------------
+
+_FILL_ORDER_SUMMARY = [
+    """INSERT INTO order_summary (dimension, bucket, order_count, total)
+       SELECT 'status', status, COUNT(*), COALESCE(SUM(total), 0)
+       FROM purchase_orders GROUP BY status""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total)
+       SELECT 'day', strftime('%Y-%m-%d', created_at), COUNT(*), COALESCE(SUM(total), 0)
+       FROM purchase_orders WHERE status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m-%d', created_at)""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total)
+       SELECT 'month', strftime('%Y-%m', created_at), COUNT(*), COALESCE(SUM(total), 0)
+       FROM purchase_orders WHERE status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m', created_at)""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total)
+       SELECT 'due', strftime('%Y-%m-%d', due_date), COUNT(*), COALESCE(SUM(total), 0)
+       FROM purchase_orders
+       WHERE status NOT IN ('paid', 'cancelled') AND due_date IS NOT NULL
+       GROUP BY strftime('%Y-%m-%d', due_date)""",
+]
+
+
+def _fill_order_summary(conn, batch_size):
+    if conn.execute("SELECT 1 FROM order_summary LIMIT 1").fetchone() is None:
+        for statement in _FILL_ORDER_SUMMARY:
+            conn.execute(statement)
+
+
+# --- 3: search index --------------------------------------------------------
+
+def _map_search_documents(conn, batch_size):
+    conn.execute(
+        "INSERT INTO purchase_order_fts_map (order_id) SELECT id FROM purchase_orders po "
+        "WHERE NOT EXISTS (SELECT 1 FROM purchase_order_fts_map m WHERE m.order_id = po.id) "
+        "ORDER BY created_at, id")
+
+
+def _index_search_documents(conn, batch_size):
+    # Documents are added in doc_id order, so the highest indexed rowid marks the progress
+    return conn.execute(
+        "INSERT INTO purchase_order_fts (rowid, order_number, customer_name, customer_email, items, notes) "
+        "SELECT m.doc_id, po.order_number, c.name, c.email, "
+        "       (SELECT group_concat(li.description, ' ') FROM line_items li WHERE li.purchase_order_id = po.id), "
+        "       po.notes "
+        "FROM purchase_order_fts_map m "
+        "JOIN purchase_orders po ON po.id = m.order_id "
+        "LEFT JOIN customers c ON c.id = po.customer_id "
+        "WHERE m.doc_id > (SELECT COALESCE(MAX(rowid), 0) FROM purchase_order_fts) "
+        "ORDER BY m.doc_id LIMIT ?", (batch_size,)).rowcount
+
+
+# --- 4: change log ----------------------------------------------------------
+
+def _fill_change_log(conn, batch_size):
+    return conn.execute(
+        "INSERT INTO order_changes (order_id, deleted, changed_at) "
+        "SELECT id, 0, updated_at FROM purchase_orders po "
+        "WHERE NOT EXISTS (SELECT 1 FROM order_changes oc WHERE oc.order_id = po.id) "
+        "ORDER BY updated_at, id LIMIT ?", (batch_size,)).rowcount
+
+
+# --- 5: money as integer cents ---------------------------------------------
+# SQLite cannot change a column's type, so the three tables holding money
+# are rebuilt. apply creates the new tables, the batch step copies orders
+# and then line items into them in rowid order, and finish drops the old
+# tables and renames the new ones. create_app does not serve requests before
+# migrations are done, so nothing writes to the old tables meanwhile.
+# Stored totals are converted as they are, drift included; totals.py
+# reports and fixes orders whose totals disagree with their line items.
+
+_CENTS_TABLES = [
+    ('purchase_orders', """CREATE TABLE purchase_orders_cents (
+        id VARCHAR(36) NOT NULL,
+        order_number VARCHAR(100) NOT NULL,
+        customer_id INTEGER NOT NULL,
+        subtotal_cents INTEGER NOT NULL,
+        tax_rate FLOAT NOT NULL,
+        tax_amount_cents INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        notes TEXT,
+        status VARCHAR(20) NOT NULL,
+        created_at DATETIME NOT NULL,
+        due_date DATETIME,
+        updated_at DATETIME NOT NULL,
+        version INTEGER DEFAULT '1' NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (order_number),
+        FOREIGN KEY(customer_id) REFERENCES customers (id)
+    )""", """INSERT INTO purchase_orders_cents (rowid, id, order_number, customer_id, subtotal_cents, tax_rate,
+        tax_amount_cents, total_cents, notes, status, created_at, due_date, updated_at, version)
+        SELECT rowid, id, order_number, customer_id, CAST(ROUND(subtotal * 100) AS INTEGER), tax_rate,
+               CAST(ROUND(tax_amount * 100) AS INTEGER), CAST(ROUND(total * 100) AS INTEGER), notes, status,
+               created_at, due_date, updated_at, version
+        FROM purchase_orders WHERE rowid > (SELECT COALESCE(MAX(rowid), 0) FROM purchase_orders_cents)
+        ORDER BY rowid LIMIT ?"""),
+    ('line_items', """CREATE TABLE line_items_cents (
+        row_id INTEGER NOT NULL,
+        purchase_order_id VARCHAR(36) NOT NULL,
+        position INTEGER NOT NULL,
+        item_id VARCHAR(100),
+        description TEXT NOT NULL,
+        quantity FLOAT NOT NULL,
+        unit_price_cents INTEGER NOT NULL,
+        PRIMARY KEY (row_id),
+        FOREIGN KEY(purchase_order_id) REFERENCES purchase_orders (id) ON DELETE CASCADE
+    )""", """INSERT INTO line_items_cents (row_id, purchase_order_id, position, item_id, description, quantity,
+        unit_price_cents)
+        SELECT row_id, purchase_order_id, position, item_id, description, quantity,
+               CAST(ROUND(unit_price * 100) AS INTEGER)
+        FROM line_items WHERE row_id > (SELECT COALESCE(MAX(row_id), 0) FROM line_items_cents)
+        ORDER BY row_id LIMIT ?"""),
+    # Refilled from the converted orders rather than converted itself, so the
+    # buckets are exact sums of the order totals
+    ('order_summary', """CREATE TABLE order_summary_cents (
+        dimension VARCHAR(10) NOT NULL,
+        bucket VARCHAR(20) NOT NULL,
+        order_count INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        PRIMARY KEY (dimension, bucket)
+    )""", None),
+]
+
+_CENTS_INDEXES = [
+    "CREATE INDEX ix_purchase_orders_customer_id ON purchase_orders (customer_id)",
+    "CREATE INDEX ix_purchase_orders_created_at_id ON purchase_orders (created_at, id)",
+    "CREATE INDEX ix_line_items_description ON line_items (description)",
+    "CREATE INDEX ix_line_items_order_position ON line_items (purchase_order_id, position)",
+]
+
+_REFILL_ORDER_SUMMARY = [
+    """INSERT INTO order_summary (dimension, bucket, order_count, total_cents)
+       SELECT 'status', status, COUNT(*), COALESCE(SUM(total_cents), 0)
+       FROM purchase_orders GROUP BY status""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total_cents)
+       SELECT 'day', strftime('%Y-%m-%d', created_at), COUNT(*), COALESCE(SUM(total_cents), 0)
+       FROM purchase_orders WHERE status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m-%d', created_at)""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total_cents)
+       SELECT 'month', strftime('%Y-%m', created_at), COUNT(*), COALESCE(SUM(total_cents), 0)
+       FROM purchase_orders WHERE status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m', created_at)""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total_cents)
+       SELECT 'due', strftime('%Y-%m-%d', due_date), COUNT(*), COALESCE(SUM(total_cents), 0)
+       FROM purchase_orders
+       WHERE status NOT IN ('paid', 'cancelled') AND due_date IS NOT NULL
+       GROUP BY strftime('%Y-%m-%d', due_date)""",
+]
+
+
+def _create_cents_tables(conn, batch_size):
+    for _, create, _ in _CENTS_TABLES:
+        conn.execute(create)
+
+
+def _copy_cents_batch(conn, batch_size):
+    done = 0
+    for _, _, copy in _CENTS_TABLES:
+        if copy and done < batch_size:
+            done += conn.execute(copy, (batch_size - done,)).rowcount
+    return done
+
+
+def _swap_cents_tables(conn):
+    # Dropping purchase_orders would cascade into line_items if foreign keys
+    # were enforced; they are off on this connection (the sqlite3 default)
+    for table, _, _ in _CENTS_TABLES:
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_cents RENAME TO {table}")
+    for statement in _CENTS_INDEXES + _REFILL_ORDER_SUMMARY:
+        conn.execute(statement)
+
+
+# --- 6: order number counters ----------------------------------------------
+
+def _add_order_number_counters(conn, batch_size):
+    conn.execute("""CREATE TABLE IF NOT EXISTS order_number_counters (
+        sequence_key VARCHAR(50) NOT NULL,
+        last_value INTEGER NOT NULL,
+        updated_at DATETIME NOT NULL,
+        PRIMARY KEY (sequence_key)
+    )""")
+
+
+# --- 7: report rollups ------------------------------------------------------
+
+_FILL_REPORT_ROLLUPS = [
+    """INSERT INTO report_rollups (dimension, period, key, order_count, quantity, total_cents)
+       SELECT 'status', strftime('%Y-%m', created_at), status, COUNT(*), 0, COALESCE(SUM(total_cents), 0)
+       FROM purchase_orders GROUP BY strftime('%Y-%m', created_at), status""",
+    """INSERT INTO report_rollups (dimension, period, key, order_count, quantity, total_cents)
+       SELECT 'customer', strftime('%Y-%m', po.created_at), COALESCE(c.name, ''), COUNT(*), 0,
+              COALESCE(SUM(po.total_cents), 0)
+       FROM purchase_orders po LEFT JOIN customers c ON c.id = po.customer_id
+       WHERE po.status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m', po.created_at), COALESCE(c.name, '')""",
+    """INSERT INTO report_rollups (dimension, period, key, order_count, quantity, total_cents)
+       SELECT 'item', strftime('%Y-%m', po.created_at), li.description, COUNT(*), SUM(li.quantity),
+              CAST(SUM(ROUND(li.quantity * li.unit_price_cents)) AS INTEGER)
+       FROM line_items li JOIN purchase_orders po ON po.id = li.purchase_order_id
+       WHERE po.status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m', po.created_at), li.description""",
+]
+
+
+def _add_report_rollups(conn, batch_size):
+    conn.execute("""CREATE TABLE IF NOT EXISTS report_rollups (
+        dimension VARCHAR(10) NOT NULL,
+        period VARCHAR(7) NOT NULL,
+        key TEXT NOT NULL,
+        order_count INTEGER NOT NULL,
+        quantity FLOAT NOT NULL,
+        total_cents INTEGER NOT NULL,
+        PRIMARY KEY (dimension, period, key)
+    )""")
+    if conn.execute("SELECT 1 FROM report_rollups LIMIT 1").fetchone() is None:
+        for statement in _FILL_REPORT_ROLLUPS:
+            conn.execute(statement)
+
+
+# --- 8: due date index and scheduled jobs -----------------------------------
+
+_SCHEDULER_TABLES = [
+    "CREATE INDEX IF NOT EXISTS ix_purchase_orders_status_due_date ON purchase_orders (status, due_date)",
+    """CREATE TABLE IF NOT EXISTS overdue_orders (
+        purchase_order_id VARCHAR(36) NOT NULL,
+        due_date DATETIME NOT NULL,
+        flagged_at DATETIME NOT NULL,
+        reminded_at DATETIME,
+        PRIMARY KEY (purchase_order_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS job_runs (
+        id INTEGER NOT NULL,
+        job VARCHAR(50) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        started_at DATETIME NOT NULL,
+        finished_at DATETIME,
+        result TEXT,
+        error TEXT,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_job_runs_job_started_at ON job_runs (job, started_at)",
+    """CREATE TABLE IF NOT EXISTS job_locks (
+        job VARCHAR(50) NOT NULL,
+        owner VARCHAR(64),
+        expires_at DATETIME,
+        PRIMARY KEY (job)
+    )""",
+]
+
+
+def _add_scheduler_tables(conn, batch_size):
+    for statement in _SCHEDULER_TABLES:
+        conn.execute(statement)
+
+
+# --- 9: customer match keys -------------------------------------------------
+# Customers are deduplicated on their name and email, case-folded with
+# whitespace collapsed. apply adds the key column and its unique index, and
+# the batch step keys the customers in id order. A customer whose key is
+# already taken by an earlier one is merged into it: its orders move over,
+# in the archive database too (migrate_database attaches it), and its phone
+# and address win since they were saved later. The survivor keeps its name,
+# so the customer report rollups of the moved orders move to that name.
+
+def _customer_match_key(name, email):
+    # Frozen copy of Customer.make_match_key
+    return '\n'.join(' '.join((value or '').casefold().split()) for value in (name, email))
+
+
+def _has_archive(conn):
+    return conn.execute(
+        "SELECT 1 FROM pragma_database_list WHERE name = 'archive'").fetchone() is not None and conn.execute(
+        "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'purchase_orders'").fetchone() is not None
+
+
+def _add_customer_match_keys(conn, batch_size):
+    add_missing_columns(conn, 'customers', [('match_key', "TEXT")])
+    # Keys are only set once duplicates are merged, and NULLs never collide
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_customers_match_key ON customers (match_key)")
+
+
+def _merge_customer(conn, duplicate, survivor, tables):
+    duplicate_id, duplicate_name = duplicate
+    survivor_id, survivor_name = survivor
+    if duplicate_name != survivor_name:
+        orders = ' UNION ALL '.join(
+            f"SELECT created_at, total_cents FROM {table} WHERE customer_id = :id AND status NOT IN ('cancelled')"
+            for table in tables)
+        periods = conn.execute(
+            f"SELECT strftime('%Y-%m', created_at), COUNT(*), COALESCE(SUM(total_cents), 0) FROM ({orders}) "
+            "GROUP BY strftime('%Y-%m', created_at)", {'id': duplicate_id}).fetchall()
+        rows = [('customer', period, name, sign * count, sign * total)
+                for period, count, total in periods
+                for name, sign in ((duplicate_name, -1), (survivor_name, 1))]
+        conn.executemany(
+            "INSERT INTO report_rollups (dimension, period, key, order_count, quantity, total_cents) "
+            "VALUES (?, ?, ?, ?, 0, ?) ON CONFLICT (dimension, period, key) DO UPDATE SET "
+            "order_count = order_count + excluded.order_count, total_cents = total_cents + excluded.total_cents",
+            rows)
+    # Clients syncing the change feed pick up the orders' new customer details
+    now = datetime.utcnow().isoformat(' ')
+    conn.execute("DELETE FROM order_changes WHERE order_id IN (SELECT id FROM purchase_orders WHERE customer_id = ?)",
+                 (duplicate_id,))
+    conn.execute("INSERT INTO order_changes (order_id, deleted, changed_at) "
+                 "SELECT id, 0, ? FROM purchase_orders WHERE customer_id = ?", (now, duplicate_id))
+    for table in tables:
+        conn.execute(f"UPDATE {table} SET customer_id = ? WHERE customer_id = ?", (survivor_id, duplicate_id))
+    conn.execute(
+        "UPDATE customers SET phone = COALESCE((SELECT phone FROM customers WHERE id = :duplicate), phone), "
+        "address = COALESCE((SELECT address FROM customers WHERE id = :duplicate), address) WHERE id = :survivor",
+        {'duplicate': duplicate_id, 'survivor': survivor_id})
+    conn.execute("DELETE FROM customers WHERE id = ?", (duplicate_id,))
+
+
+def _key_customers(conn, batch_size):
+    tables = ['purchase_orders'] + (['archive.purchase_orders'] if _has_archive(conn) else [])
+    rows = conn.execute("SELECT id, name, email FROM customers WHERE match_key IS NULL ORDER BY id LIMIT ?",
+                        (batch_size,)).fetchall()
+    merged = 0
+    for customer_id, name, email in rows:
+        key = _customer_match_key(name, email)
+        survivor = conn.execute("SELECT id, name FROM customers WHERE match_key = ?", (key,)).fetchone()
+        if survivor is None:
+            conn.execute("UPDATE customers SET match_key = ? WHERE id = ?", (key, customer_id))
+        else:
+            _merge_customer(conn, (customer_id, name), survivor, tables)
+            merged += 1
+    if merged:
+        logger.info("Merged %s duplicate customers", merged)
+    return len(rows)
+
+
+MIGRATIONS = [
+    Migration(1, "Baseline schema", apply=_baseline, batch=_baseline_batch),
+    Migration(2, "Fill the order summary table", apply=_fill_order_summary),
+    Migration(3, "Build the search index", apply=_map_search_documents, batch=_index_search_documents),
+    Migration(4, "Add existing orders to the change log", batch=_fill_change_log),
+    Migration(5, "Store money as integer cents", apply=_create_cents_tables, batch=_copy_cents_batch,
+              finish=_swap_cents_tables),
+    Migration(6, "Add order number counters", apply=_add_order_number_counters),
+    Migration(7, "Add report rollups", apply=_add_report_rollups),
+    Migration(8, "Add the due date index and job tables", apply=_add_scheduler_tables),
+    Migration(9, "Deduplicate customers", apply=_add_customer_match_keys, batch=_key_customers),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+class Migrator:
+    """Applies MIGRATIONS to one sqlite3 connection opened in autocommit mode."""
+
+    def __init__(self, conn, batch_size=DEFAULT_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+
+    def current_version(self):
+        """Return (highest applied version, True if a batched migration is unfinished)."""
+        try:
+            version, unfinished = self.conn.execute(
+                "SELECT COALESCE(MAX(version), 0), COUNT(*) - COUNT(completed_at) FROM schema_version").fetchone()
+        except sqlite3.OperationalError:
+            # No schema_version table: a new database, or one from before versioned migrations
+            return 0, False
+        return version, unfinished > 0
+
+    def applied(self):
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'schema_version'").fetchone() is None:
+            return {}
+        return {row[0]: row for row in self.conn.execute(
+            "SELECT version, description, applied_at, completed_at FROM schema_version ORDER BY version")}
+
+    def upgrade(self):
+        """Apply every pending migration and return the versions that were worked on."""
+        version, unfinished = self.current_version()
+        if version == LATEST_VERSION and not unfinished:
+            return []
+        if version > LATEST_VERSION:
+            raise MigrationError(f"Database schema version {version} is newer than this application "
+                                 f"supports ({LATEST_VERSION})")
+
+        self.conn.execute(_SCHEMA_VERSION_TABLE)
+        applied = self.applied()
+        done = []
+        for migration in MIGRATIONS:
+            row = applied.get(migration.version)
+            if row is not None and row[3] is not None:
+                continue
+            started = time.perf_counter()
+            try:
+                if row is None:
+                    self._apply(migration)
+                if migration.batch is not None:
+                    self._run_batches(migration)
+            except Exception as e:
+                raise MigrationError(f"Migration {migration.version} ({migration.description}) failed: {e}") from e
+            logger.info("Applied migration %s (%s) in %.2fs",
+                        migration.version, migration.description, time.perf_counter() - started)
+            done.append(migration.version)
+        return done
+
+    def _apply(self, migration):
+        now = datetime.utcnow().isoformat(' ')
+        with transaction(self.conn):
+            if migration.apply is not None:
+                migration.apply(self.conn, self.batch_size)
+            self.conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at, completed_at) VALUES (?, ?, ?, ?)",
+                (migration.version, migration.description, now, None if migration.batch else now))
+
+    def _run_batches(self, migration):
+        total = 0
+        while True:
+            with transaction(self.conn):
+                count = migration.batch(self.conn, self.batch_size)
+                total += count
+                if count < self.batch_size:
+                    if migration.finish is not None:
+                        migration.finish(self.conn)
+                    self.conn.execute("UPDATE schema_version SET completed_at = ? WHERE version = ?",
+                                      (datetime.utcnow().isoformat(' '), migration.version))
+                    break
+            logger.debug("Migration %s: %s rows so far", migration.version, total)
+
+
+def connect(db_path, timeout=30.0):
+    return sqlite3.connect(db_path, isolation_level=None, timeout=timeout)
+
+
+def migrate_database(db_path, batch_size=DEFAULT_BATCH_SIZE, timeout=30.0, archive_path=None):
+    """Bring the database at db_path to LATEST_VERSION, creating it if needed.
+
+    The archive database (archive.py) at archive_path is attached as
+    "archive" if it exists, for migrations that change archived orders too.
+    """
+    conn = connect(db_path, timeout)
+    try:
+        if archive_path and os.path.exists(archive_path):
+            conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        return Migrator(conn, batch_size).upgrade()
+    finally:
+        conn.close()
+
+
+def print_status(conn):
+    applied = Migrator(conn).applied()
+    for migration in MIGRATIONS:
+        row = applied.get(migration.version)
+        if row is None:
+            state = 'pending'
+        elif row[3] is None:
+            state = f'unfinished (started {row[2]})'
+        else:
+            state = f'applied {row[3]}'
+        print(f"{migration.version:>4}  {migration.description:<45} {state}")
+
+
+def main(argv=None):
+    from config import Config
+    from database import archive_path
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('command', nargs='?', choices=('upgrade', 'status'), default='upgrade')
+    parser.add_argument('--db', default=Config.DATABASE_PATH, help='database file (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        conn = connect(args.db)
+        try:
+            print_status(conn)
+        finally:
+            conn.close()
+        return 0
+
+    try:
+        done = migrate_database(args.db, args.batch_size, archive_path=archive_path(
+            {'ARCHIVE_DB_PATH': Config.ARCHIVE_DB_PATH, 'DATABASE_PATH': args.db}))
+    except MigrationError as e:
+        print(f"Error migrating database: {e}", file=sys.stderr)
+        return 1
+    print(f"Applied migrations: {', '.join(map(str, done))}" if done
+          else f"Database is already at version {LATEST_VERSION}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,14 @@
 from extensions import db
 from datetime import datetime
+from money import from_cents, order_totals, parse_number, to_cents
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.types import TypeDecorator, VARCHAR
 import json
 
 class JSONType(TypeDecorator):
     impl = VARCHAR
+    cache_ok = True
 
     def process_bind_param(self, value, dialect):
         if value is not None:
@@ -25,21 +29,201 @@ class JSONType(TypeDecorator):
                 return {}  # Return empty dict on error instead of failing
         return None
 
+# Tables are created and altered by migrations.py: a schema change here
+# needs a new migration there as well
+
+# Keys of the customer object in the API, mapped to Customer columns
+CUSTOMER_FIELDS = ('name', 'email', 'phone', 'address')
+
+class Customer(db.Model):
+    """Customer details referenced by purchase orders.
+
+    There is one row per match_key (see make_match_key()), so "Jane Doe" and
+    " jane  doe" with the same email are one customer. The name and email
+    keep the spelling they were first saved with; saving an order with new
+    contact details updates the phone and address on the existing row.
+    """
+    __tablename__ = 'customers'
+    __table_args__ = (
+        db.Index('ix_customers_name_email', 'name', 'email'),
+        db.Index('ux_customers_match_key', 'match_key', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False, default='')
+    email = db.Column(db.String(255), index=True)
+    phone = db.Column(db.String(50))
+    address = db.Column(db.Text)
+    match_key = db.Column(db.Text)
+
+    @staticmethod
+    def normalize(data):
+        """Map a customer object from the API onto column values."""
+        if not isinstance(data, dict):
+            raise ValueError("customer must be an object")
+        values = {}
+        for field in CUSTOMER_FIELDS:
+            value = data.get(field)
+            values[field] = None if value is None else str(value)
+        if values['name'] is None:
+            values['name'] = ''
+        return values
+
+    @staticmethod
+    def make_match_key(name, email):
+        """Name and email, case-folded with whitespace collapsed: what makes two customers the same."""
+        return '\n'.join(' '.join((value or '').casefold().split()) for value in (name, email))
+
+    @classmethod
+    def upsert(cls, values):
+        """Insert the customer given as column values, or update the one with its match_key; return (id, name).
+
+        Phone and address that are given replace the stored ones. As that
+        changes every order of the customer, those orders go into the change
+        feed.
+        """
+        table = cls.__table__
+        key = cls.make_match_key(values['name'], values['email'])
+        stmt = insert(table).values(match_key=key, **values)
+        phone = func.coalesce(stmt.excluded.phone, table.c.phone)
+        address = func.coalesce(stmt.excluded.address, table.c.address)
+        # The UNIQUE index settles concurrent inserts; unchanged rows are not written
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.match_key],
+            set_={'phone': phone, 'address': address},
+            where=or_(phone.is_not(table.c.phone), address.is_not(table.c.address)),
+        )
+        written = db.session.execute(stmt).rowcount
+        customer_id, name = db.session.execute(
+            db.select(table.c.id, table.c.name).where(table.c.match_key == key)).one()
+        if written:
+            from changes import record_changes
+            record_changes(order_id for (order_id,) in db.session.execute(
+                db.select(PurchaseOrder.id).where(PurchaseOrder.customer_id == customer_id)))
+        return customer_id, name
+
+    @classmethod
+    def get_or_create(cls, data):
+        """Return the customer row for these details, creating it or updating its contact details."""
+        customer_id, _ = cls.upsert(cls.normalize(data))
+        return db.session.get(cls, customer_id, populate_existing=True)
+
+    def to_dict(self):
+        # Fields that were never provided stay absent, as in the original JSON
+        return {field: getattr(self, field) for field in CUSTOMER_FIELDS
+                if getattr(self, field) is not None}
+
+class LineItem(db.Model):
+    __tablename__ = 'line_items'
+    __table_args__ = (
+        db.Index('ix_line_items_order_position', 'purchase_order_id', 'position'),
+    )
+
+    row_id = db.Column(db.Integer, primary_key=True)
+    purchase_order_id = db.Column(db.String(36), db.ForeignKey('purchase_orders.id', ondelete='CASCADE'),
+                                  nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    # Client-side line item id (a UUID or a temporary id from the form)
+    item_id = db.Column(db.String(100))
+    description = db.Column(db.Text, nullable=False, default='', index=True)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    unit_price_cents = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def from_dict(cls, data, position=0):
+        if not isinstance(data, dict):
+            raise ValueError("Each line item must be an object")
+        item_id = data.get('id')
+        return cls(
+            position=position,
+            item_id=None if item_id is None else str(item_id),
+            description=data.get('description') or '',
+            quantity=parse_number(data.get('quantity') or 0, 'quantity'),
+            unit_price_cents=to_cents(data.get('unitPrice') or 0, 'unitPrice'),
+        )
+
+    @property
+    def unit_price(self):
+        return from_cents(self.unit_price_cents)
+
+    def to_dict(self):
+        return {
+            'id': self.item_id,
+            'description': self.description,
+            'quantity': self.quantity,
+            'unitPrice': self.unit_price,
+        }
+
 class PurchaseOrder(db.Model):
     __tablename__ = 'purchase_orders'
+    __table_args__ = (
+        # Keyset pagination index for the default (created_at, id) listing order
+        db.Index('ix_purchase_orders_created_at_id', 'created_at', 'id'),
+        # Range scans over the due dates of open orders (scheduler.py)
+        db.Index('ix_purchase_orders_status_due_date', 'status', 'due_date'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     order_number = db.Column(db.String(100), unique=True, nullable=False)
-    customer = db.Column(JSONType, nullable=False)
-    line_items = db.Column(JSONType, nullable=False)
-    subtotal = db.Column(db.Float, nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False, index=True)
+    # Money in whole cents, derived from the line items by recalculate_totals()
+    subtotal_cents = db.Column(db.Integer, nullable=False)
+    # Percent, e.g. 7.5
     tax_rate = db.Column(db.Float, nullable=False)
-    tax_amount = db.Column(db.Float, nullable=False)
-    total = db.Column(db.Float, nullable=False)
+    tax_amount_cents = db.Column(db.Integer, nullable=False)
+    total_cents = db.Column(db.Integer, nullable=False)
     notes = db.Column(db.Text)
     status = db.Column(db.String(20), nullable=False, default='unpaid')
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     due_date = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Incremented by every UPDATE of the row. As the mapper's version_id_col,
+    # an update that lost a race with another one raises StaleDataError
+    # instead of overwriting it.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
+    customer_record = db.relationship(Customer, lazy='selectin')
+    items = db.relationship(LineItem, order_by=LineItem.position, lazy='selectin',
+                            cascade='all, delete-orphan')
+
+    @property
+    def customer(self):
+        return self.customer_record.to_dict() if self.customer_record else None
+
+    @customer.setter
+    def customer(self, value):
+        self.customer_record = Customer.get_or_create(value)
+
+    @property
+    def line_items(self):
+        return [item.to_dict() for item in self.items]
+
+    @line_items.setter
+    def line_items(self, value):
+        if not isinstance(value, list):
+            raise ValueError("lineItems must be a list")
+        self.items = [LineItem.from_dict(item, position=i) for i, item in enumerate(value)]
+
+    @property
+    def subtotal(self):
+        return from_cents(self.subtotal_cents)
+
+    @property
+    def tax_amount(self):
+        return from_cents(self.tax_amount_cents)
+
+    @property
+    def total(self):
+        return from_cents(self.total_cents)
+
+    def recalculate_totals(self):
+        """Set the money columns from the line items and tax rate; return the OrderTotals."""
+        totals = order_totals([(item.quantity, item.unit_price_cents) for item in self.items],
+                              self.tax_rate or 0)
+        self.subtotal_cents, self.tax_amount_cents, self.total_cents = totals
+        return totals
 
     def to_dict(self):
         return {
@@ -54,5 +238,177 @@ class PurchaseOrder(db.Model):
             'notes': self.notes,
             'status': self.status,
             'createdAt': self.created_at.isoformat(),
-            'dueDate': self.due_date.isoformat() if self.due_date else None
+            'dueDate': self.due_date.isoformat() if self.due_date else None,
+            'updatedAt': self.updated_at.isoformat(),
+            'version': self.version,
+        }
+
+class ArchivedPurchaseOrder(db.Model):
+    """A settled purchase order moved to the archive database; see archive.py.
+
+    Mapped for reading only: archive.py copies orders in and out with SQL.
+    The columns match PurchaseOrder's, so the listing filters apply to both.
+    """
+    __tablename__ = 'purchase_orders'
+    __table_args__ = {'schema': 'archive'}
+
+    id = db.Column(db.String(36), primary_key=True)
+    # Rowid of the order's document in archive.purchase_order_fts
+    doc_id = db.Column(db.Integer, nullable=False)
+    order_number = db.Column(db.String(100), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False)
+    subtotal_cents = db.Column(db.Integer, nullable=False)
+    tax_rate = db.Column(db.Float, nullable=False)
+    tax_amount_cents = db.Column(db.Integer, nullable=False)
+    total_cents = db.Column(db.Integer, nullable=False)
+    notes = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    due_date = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    customer_record = db.relationship(Customer)
+
+class OrderSummary(db.Model):
+    """Running order counts and totals, maintained by the write handlers.
+
+    Each row is one bucket of one dimension: 'status' (keyed by status),
+    'day' and 'month' (revenue keyed by created_at period) and 'due'
+    (open orders keyed by due date).
+    """
+    __tablename__ = 'order_summary'
+
+    dimension = db.Column(db.String(10), primary_key=True)
+    bucket = db.Column(db.String(20), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    total_cents = db.Column(db.Integer, nullable=False, default=0)
+
+class ReportRollup(db.Model):
+    """Running totals per month of order creation, for the reports API.
+
+    Maintained alongside OrderSummary. Dimensions: 'customer' (orders and
+    totals keyed by customer name), 'item' (line count, quantity and line
+    amounts keyed by item description), both without cancelled orders, and
+    'status' (all orders keyed by status).
+    """
+    __tablename__ = 'report_rollups'
+
+    dimension = db.Column(db.String(10), primary_key=True)
+    # created_at month, e.g. 2025-05
+    period = db.Column(db.String(7), primary_key=True)
+    key = db.Column(db.Text, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    total_cents = db.Column(db.Integer, nullable=False, default=0)
+
+class OrderChange(db.Model):
+    """Latest change of each order, in commit order, for clients syncing deltas.
+
+    An order has at most one row: every change replaces it with a new
+    sequence number. AUTOINCREMENT keeps sequence numbers from ever being
+    reused, so a client's cursor stays valid. Deleted orders keep their row
+    as a tombstone.
+    """
+    __tablename__ = 'order_changes'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.String(36), nullable=False, unique=True)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class OverdueOrder(db.Model):
+    """An open order found past its due date by the overdue job; see scheduler.py.
+
+    The row goes away once the order is paid, cancelled, deleted or given
+    another due date, so an order that falls overdue again is flagged anew.
+    """
+    __tablename__ = 'overdue_orders'
+
+    purchase_order_id = db.Column(db.String(36), primary_key=True)
+    # The due date the order was flagged for
+    due_date = db.Column(db.DateTime, nullable=False)
+    flagged_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    reminded_at = db.Column(db.DateTime)
+
+class JobRun(db.Model):
+    """One run of a scheduled job, kept for the run history."""
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        db.Index('ix_job_runs_job_started_at', 'job', 'started_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    job = db.Column(db.String(50), nullable=False)
+    # running -> succeeded or failed
+    status = db.Column(db.String(20), nullable=False, default='running')
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job': self.job,
+            'status': self.status,
+            'startedAt': self.started_at.isoformat(),
+            'finishedAt': self.finished_at.isoformat() if self.finished_at else None,
+            'result': self.result,
+            'error': self.error,
+        }
+
+class JobLock(db.Model):
+    """Lease that lets one process at a time run a scheduled job."""
+    __tablename__ = 'job_locks'
+
+    job = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(64))
+    # A lease past this time belongs to a process that died mid-run
+    expires_at = db.Column(db.DateTime)
+
+class OrderNumberCounter(db.Model):
+    """Last order number handed out per sequence; see order_numbers.py."""
+    __tablename__ = 'order_number_counters'
+
+    # Prefix plus day, e.g. PO-20250516, or the bare prefix
+    sequence_key = db.Column(db.String(50), primary_key=True)
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class EmailJob(db.Model):
+    """An outgoing purchase order email, sent by the background mail worker."""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        # The worker polls for due jobs by (status, next_attempt_at)
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True)
+    purchase_order_id = db.Column(db.String(36), nullable=False, index=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    message = db.Column(db.Text)
+    # queued -> sending -> sent, or back to queued for a retry, or failed
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'orderId': self.purchase_order_id,
+            'recipient': self.recipient,
+            'subject': self.subject,
+            'status': self.status,
+            'attempts': self.attempts,
+            'lastError': self.last_error,
+            'createdAt': self.created_at.isoformat(),
+            'nextAttemptAt': self.next_attempt_at.isoformat() if self.status == 'queued' else None,
+            'sentAt': self.sent_at.isoformat() if self.sent_at else None
         }
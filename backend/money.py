@@ -0,0 +1,76 @@
+"""Money amounts as integer cents.
+
+Amounts are stored as whole cents and only turned into decimal numbers at
+the edges: when parsed from a request and when written to a response.
+Order totals are always derived from the line items on the server:
+
+    line amount = round(quantity * unit price in cents)
+    subtotal    = sum of the line amounts
+    tax amount  = round(subtotal * tax rate / 100)
+    total       = subtotal + tax amount
+
+Quantities and the tax rate (a percentage) are floats. Rounding is half
+away from zero and is done exactly the way SQLite's ROUND() does it, so
+totals.py can recompute the same figures in SQL.
+"""
+import math
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+_CENT = Decimal('0.01')
+
+OrderTotals = namedtuple('OrderTotals', ['subtotal_cents', 'tax_amount_cents', 'total_cents'])
+
+
+def to_cents(value, field='amount'):
+    """Parse a decimal amount from the API (number or numeric string) into whole cents."""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid {field}: must be a number")
+    try:
+        # str() first: Decimal(0.1) would carry the float's binary error into the rounding
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"Invalid {field}: must be a number")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid {field}: must be a number")
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Decimal amount for the API, e.g. 1234 -> 12.34."""
+    return cents / 100 if cents is not None else None
+
+
+def parse_number(value, field):
+    """Parse a finite float (quantity or tax rate) from the API."""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid {field}: must be a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field}: must be a number")
+    if not math.isfinite(number):
+        raise ValueError(f"Invalid {field}: must be a number")
+    return number
+
+
+def round_half_away(value):
+    """Round a float to an integer the way SQLite's ROUND(x) does."""
+    if value >= 0:
+        return int(value + 0.5)
+    return -int(-value + 0.5)
+
+
+def line_amount_cents(quantity, unit_price_cents):
+    return round_half_away(quantity * unit_price_cents)
+
+
+def tax_cents(subtotal_cents, tax_rate):
+    return round_half_away(subtotal_cents * tax_rate / 100.0)
+
+
+def order_totals(lines, tax_rate):
+    """OrderTotals for (quantity, unit price in cents) pairs and a tax rate in percent."""
+    subtotal = sum(line_amount_cents(quantity, unit_price) for quantity, unit_price in lines)
+    tax = tax_cents(subtotal, tax_rate)
+    return OrderTotals(subtotal, tax, subtotal + tax)
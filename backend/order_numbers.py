@@ -0,0 +1,90 @@
+"""Server-side order numbers: a prefix plus a sequence, e.g. PO-20250516-0001.
+
+Sequences live in the order_number_counters table, one row per sequence
+(per day, or per prefix when ORDER_NUMBER_DAILY is off). A process never
+takes numbers one at a time: it reserves a block of ORDER_NUMBER_BLOCK_SIZE
+by bumping the counter in a short transaction of its own, and hands the
+block out from memory under a lock. SQLite lets one writer bump the row at
+a time, so blocks never overlap, whether they are taken by threads of one
+server or by several processes.
+
+Numbers are increasing but not gapless: the rest of a block is skipped when
+the process restarts, and an order that fails to save gives up its number.
+"""
+import threading
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import text
+
+from extensions import db, logger
+
+# Sequences are zero-padded to at least this many digits
+SEQUENCE_DIGITS = 4
+
+_CREATE_COUNTER = text(
+    "INSERT OR IGNORE INTO order_number_counters (sequence_key, last_value, updated_at) VALUES (:key, 0, :now)")
+_BUMP_COUNTER = text(
+    "UPDATE order_number_counters SET last_value = last_value + :count, updated_at = :now WHERE sequence_key = :key")
+_READ_COUNTER = text("SELECT last_value FROM order_number_counters WHERE sequence_key = :key")
+
+
+class OrderNumberAllocator:
+    """Hands out order numbers from blocks reserved in the counter table."""
+
+    def __init__(self, prefix='PO', daily=True, block_size=20):
+        self.prefix = prefix
+        self.daily = daily
+        self.block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        # Sequence key -> [next value, last value of the reserved block]
+        self._blocks = {}
+
+    def sequence_key(self, today=None):
+        if not self.daily:
+            return self.prefix
+        return f"{self.prefix}-{(today or date.today()).strftime('%Y%m%d')}"
+
+    def allocate(self, today=None):
+        """Return the next order number.
+
+        Reserving a block writes to the database on its own connection, so
+        do not call this while the session holds a write transaction.
+        """
+        key = self.sequence_key(today)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] > block[1]:
+                last = self._reserve(key, self.block_size)
+                # Only the current day's block is worth keeping
+                self._blocks = {key: [last - self.block_size + 1, last]}
+                block = self._blocks[key]
+            value = block[0]
+            block[0] += 1
+        return f"{key}-{value:0{SEQUENCE_DIGITS}d}"
+
+    def _reserve(self, key, count):
+        """Move the counter of ``key`` on by count and return its new value."""
+        now = datetime.utcnow()
+        # The first statement takes SQLite's write lock, which is held until
+        # the commit, so no other connection can bump the row in between
+        with db.engine.begin() as conn:
+            conn.execute(_CREATE_COUNTER, {'key': key, 'now': now})
+            conn.execute(_BUMP_COUNTER, {'key': key, 'count': count, 'now': now})
+            last = conn.execute(_READ_COUNTER, {'key': key}).scalar()
+        logger.debug("Reserved order numbers %s-%s of %s", last - count + 1, last, key)
+        return last
+
+
+def init_order_numbers(app):
+    allocator = OrderNumberAllocator(
+        prefix=app.config['ORDER_NUMBER_PREFIX'],
+        daily=app.config['ORDER_NUMBER_DAILY'],
+        block_size=app.config['ORDER_NUMBER_BLOCK_SIZE'],
+    )
+    app.extensions['order_numbers'] = allocator
+    return allocator
+
+
+def next_order_number():
+    return current_app.extensions['order_numbers'].allocate()
@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+# Page size limits for list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class PaginationError(ValueError):
+    """Raised when a list request has an invalid limit, cursor or filter."""
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Parse the ?limit= parameter and clamp it to the allowed range."""
+    if value is None or value == '':
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be at least 1")
+    return min(limit, maximum)
+
+
+def parse_bool_param(value, name):
+    """Parse a true/false query parameter; a missing one is false."""
+    if value is None or value == '':
+        return False
+    if value.lower() in ('true', 'yes', '1'):
+        return True
+    if value.lower() in ('false', 'no', '0'):
+        return False
+    raise PaginationError(f"{name} must be true or false")
+
+
+def parse_date_param(value, name):
+    """Parse a date query parameter in ISO or YYYY-MM-DD format."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        try:
+            return datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            raise PaginationError(f"Invalid {name} format. Use ISO format or YYYY-MM-DD.")
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(sort, direction, value, row_id):
+    """Build an opaque cursor pointing just after (value, row_id)."""
+    payload = json.dumps([sort, direction, _encode_value(value), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort, direction):
+    """Decode a cursor and check it was issued for the same sort order."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_direction, value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        value = _decode_value(value)
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+    if cursor_sort != sort or cursor_direction != direction:
+        raise PaginationError("Cursor does not match the requested sort order")
+    return value, row_id
+
+
+def keyset_filter(column, id_column, direction, value, row_id):
+    """Return the WHERE clause selecting rows after (value, row_id).
+
+    SQLite sorts NULLs first in ascending order and last in descending
+    order, so nullable sort columns are handled explicitly.
+    """
+    if direction == 'asc':
+        if value is None:
+            return or_(column.isnot(None), and_(column.is_(None), id_column > row_id))
+        return or_(column > value, and_(column == value, id_column > row_id))
+    if value is None:
+        return and_(column.is_(None), id_column < row_id)
+    return or_(column < value, and_(column == value, id_column < row_id), column.is_(None))
+
+
+def keyset_order(column, id_column, direction):
+    """Return the ORDER BY clauses matching keyset_filter."""
+    if direction == 'asc':
+        return [column.asc(), id_column.asc()]
+    return [column.desc(), id_column.desc()]
@@ -0,0 +1,306 @@
+"""Purchase order PDF rendering with a worker process pool and an on-disk cache.
+
+HTML is rendered from templates/pdf/purchase_order.html in the request
+thread (cheap), and the expensive weasyprint HTML-to-PDF conversion runs in
+a ProcessPoolExecutor so it neither blocks the GIL nor a waitress thread for
+longer than necessary. Finished PDFs are cached on disk under a key derived
+from the order's to_dict() content and the template version, which doubles
+as the HTTP ETag.
+
+The document templates are compiled once, on first use, and rendered
+directly rather than looked up through render_template on every
+call; edits to them take effect on restart, like the template version.
+iter_pdfs() renders many orders at once for batch downloads (documents.py).
+
+The pool's workers are spawned, not forked: the pool starts on the first
+PDF request, when the server socket, the database files and the background
+threads' locks are all open, and forked workers would inherit them. They
+are stopped at exit and on SIGTERM.
+"""
+import atexit
+import glob
+import hashlib
+import json
+import os
+import signal
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from extensions import logger
+from metrics import PDF_SECONDS
+
+PDF_TEMPLATE = 'pdf/purchase_order.html'
+EMAIL_TEMPLATE = 'email/po_email.html'
+# Compiled by the first render
+DOCUMENT_TEMPLATES = (PDF_TEMPLATE, EMAIL_TEMPLATE)
+
+
+class PdfUnavailableError(RuntimeError):
+    """Raised when weasyprint is not installed."""
+
+
+def html_to_pdf(html, base_url=None):
+    """Convert HTML to PDF bytes. Runs inside a worker process."""
+    try:
+        import weasyprint
+    except (ImportError, OSError) as e:
+        # OSError: weasyprint is installed but its Pango/Cairo libraries are not
+        raise PdfUnavailableError(f"PDF generation requires weasyprint: {e}")
+    return weasyprint.HTML(string=html, base_url=base_url).write_pdf()
+
+
+def template_version(jinja_env, template_name=PDF_TEMPLATE):
+    """Hash of the template source, so editing the template invalidates cached PDFs."""
+    source, _, _ = jinja_env.loader.get_source(jinja_env, template_name)
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+
+
+class PdfRenderer:
+    """Renders purchase order PDFs through a process pool, caching the output."""
+
+    def __init__(self, cache_dir, workers=2, timeout=60, max_cached=500):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.timeout = timeout
+        self.max_cached = max_cached
+        self.template_version = None
+        self.templates = {}
+        self.jinja_env = None
+        self.base_url = None
+        self._executor = None
+        self._lock = threading.Lock()
+        # Cache key -> Future for renders that are still running
+        self._in_flight = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def init_app(self, app):
+        self.jinja_env = app.jinja_env
+        self.base_url = app.root_path
+        app.extensions['pdf_renderer'] = self
+        atexit.register(self.shutdown)
+        # atexit handlers do not run when the process is killed by a signal
+        if threading.current_thread() is threading.main_thread():
+            self._handle_sigterm()
+
+    def _handle_sigterm(self):
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def shutdown_on_sigterm(signum, frame):
+            self.shutdown()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, shutdown_on_sigterm)
+
+    def _load_templates(self):
+        # Not done in init_app, to keep template compilation out of startup
+        with self._lock:
+            if self.template_version is None:
+                self.templates = {name: self.jinja_env.get_template(name) for name in DOCUMENT_TEMPLATES}
+                self.template_version = template_version(self.jinja_env)
+
+    def _get_executor(self):
+        # Caller holds self._lock; the pool is started on first use
+        if self._executor is None:
+            # Imported here: they load multiprocessing, which nothing else needs at startup
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def cache_key(self, order_dict):
+        """Content hash of an order's API representation plus the template version."""
+        payload = json.dumps(order_dict, sort_keys=True, separators=(',', ':'), default=str)
+        digest = hashlib.sha256(payload.encode('utf-8'))
+        if self.template_version is None:
+            self._load_templates()
+        digest.update(self.template_version.encode('ascii'))
+        return digest.hexdigest()
+
+    def _cache_path(self, order_id, key):
+        return os.path.join(self.cache_dir, f"{order_id}-{key}.pdf")
+
+    def get_cached(self, order_id, key):
+        path = self._cache_path(order_id, key)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def invalidate(self, order_id):
+        """Remove every cached PDF of an order. Call when the order changes or is deleted."""
+        for path in glob.glob(os.path.join(self.cache_dir, f"{glob.escape(order_id)}-*.pdf")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def invalidate_orders(self, order_ids):
+        """invalidate() for many orders, with one listing of the cache directory."""
+        order_ids = set(order_ids)
+        for name in os.listdir(self.cache_dir):
+            # Cache keys are hex digests, so the order id is everything before the last '-'
+            if name.endswith('.pdf') and name.rpartition('-')[0] in order_ids:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def _store(self, order_id, key, pdf):
+        path = self._cache_path(order_id, key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(pdf)
+        os.replace(tmp_path, path)
+        self._prune()
+
+    def _prune(self):
+        files = glob.glob(os.path.join(self.cache_dir, '*.pdf'))
+        if len(files) <= self.max_cached:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path))
+        for path in files[:len(files) - self.max_cached]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def render(self, template_name, **context):
+        """Render one of DOCUMENT_TEMPLATES to a string."""
+        if self.template_version is None:
+            self._load_templates()
+        return self.templates[template_name].render(**context)
+
+    def render_html(self, order):
+        return self.render(PDF_TEMPLATE, order=order)
+
+    def submit(self, order, order_dict=None):
+        """Start producing the PDF of a PurchaseOrder; returns a PendingPdf.
+
+        Cached PDFs are read at once; otherwise the HTML is rendered here and
+        converted in the process pool.
+        """
+        started = time.perf_counter()
+        order_dict = order_dict if order_dict is not None else order.to_dict()
+        key = self.cache_key(order_dict)
+        pdf = self.get_cached(order.id, key)
+        if pdf is not None:
+            PDF_SECONDS.observe(time.perf_counter() - started, 'cache_hit')
+            return PendingPdf(self, order.id, key, started, pdf=pdf)
+
+        html = self.render_html(order)
+        with self._lock:
+            # Concurrent requests for the same document share one render
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                self.invalidate(order.id)
+                future = self._get_executor().submit(html_to_pdf, html, self.base_url)
+                self._in_flight[key] = future
+        return PendingPdf(self, order.id, key, started, future=future, owner=owner)
+
+    def get_pdf(self, order, order_dict=None):
+        """Return (pdf bytes, cache key) for a PurchaseOrder, rendering it if needed."""
+        pending = self.submit(order, order_dict)
+        return pending.result(), pending.key
+
+    def iter_pdfs(self, orders, window=None):
+        """Yield (order, pdf bytes, exception) for each order, in order.
+
+        Up to ``window`` documents (default twice the worker count) are
+        rendering at any time, so every worker stays busy while the caller
+        consumes the results. A document that failed has pdf None and the
+        exception that stopped it.
+        """
+        window = window or self.workers * 2
+        pending = deque()
+        try:
+            for order in orders:
+                pending.append((order, self.submit(order)))
+                if len(pending) >= window:
+                    yield self._wait(*pending.popleft())
+            while pending:
+                yield self._wait(*pending.popleft())
+        finally:
+            # Left over when the consumer stopped early, e.g. the client went away
+            for _, left in pending:
+                left.discard()
+
+    @staticmethod
+    def _wait(order, pending):
+        try:
+            return order, pending.result(), None
+        except PdfUnavailableError:
+            raise
+        except Exception as e:
+            return order, None, e
+
+
+class PendingPdf:
+    """A PDF that is cached already or rendering in the pool."""
+
+    def __init__(self, renderer, order_id, key, started, pdf=None, future=None, owner=False):
+        self.renderer = renderer
+        self.order_id = order_id
+        self.key = key
+        self.started = started
+        self._pdf = pdf
+        self._future = future
+        self._owner = owner
+
+    def result(self):
+        """Wait for the PDF bytes; the owner of a render stores them in the cache."""
+        if self._pdf is not None:
+            return self._pdf
+        renderer = self.renderer
+        outcome = 'error'
+        try:
+            self._pdf = self._future.result(timeout=renderer.timeout)
+            if self._owner:
+                renderer._store(self.order_id, self.key, self._pdf)
+            # 'shared': waited on a render another request started
+            outcome = 'rendered' if self._owner else 'shared'
+        finally:
+            if self._owner:
+                with renderer._lock:
+                    renderer._in_flight.pop(self.key, None)
+            PDF_SECONDS.observe(time.perf_counter() - self.started, outcome)
+        return self._pdf
+
+    def discard(self):
+        """Give up on the PDF; a render that has not started yet is cancelled."""
+        if self._owner:
+            self._future.cancel()
+            with self.renderer._lock:
+                self.renderer._in_flight.pop(self.key, None)
+
+
+def init_pdf(app):
+    """Create the app's PdfRenderer from config."""
+    cache_dir = app.config['PDF_CACHE_DIR'] or os.path.join(os.path.dirname(app.config['DATABASE_PATH']), 'pdf_cache')
+    renderer = PdfRenderer(
+        cache_dir=cache_dir,
+        workers=app.config['PDF_WORKERS'],
+        timeout=app.config['PDF_RENDER_TIMEOUT'],
+        max_cached=app.config['PDF_CACHE_MAX_FILES'],
+    )
+    renderer.init_app(app)
+    logger.debug("PDF renderer ready with %s workers, cache at %s", renderer.workers, renderer.cache_dir)
+    return renderer
+
+
+def get_renderer():
+    return current_app.extensions['pdf_renderer']
@@ -0,0 +1,285 @@
+"""Reports served from the summary and rollup tables, with an in-process cache.
+
+The write handlers keep order_summary and report_rollups up to date (see
+stats.py), so no report reads purchase_orders or line_items: revenue by
+month and the aging of open orders come from order_summary, top customers,
+top items and status trends from report_rollups, which hold one row per
+customer, item or status per month.
+
+Results are cached per report and parameters. A commit that touches
+rollups drops the cached reports covering the months it changed (and the
+aging report when open orders changed); REPORT_CACHE_SECONDS bounds how
+long writes made by other processes can go unnoticed.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+
+from extensions import db
+from models import OrderSummary
+from money import from_cents
+from stats import ALL_PERIODS, CLOSED_STATUSES, DUE_DATES
+
+DEFAULT_MONTHS = 12
+# Longest range a report covers, in months
+MAX_MONTHS = 240
+DEFAULT_TOP_LIMIT = 10
+MAX_TOP_LIMIT = 100
+# Aging buckets as (label, least days overdue, most days overdue)
+AGING_BUCKETS = [
+    ('current', None, 0),
+    ('1-30', 1, 30),
+    ('31-60', 31, 60),
+    ('61-90', 61, 90),
+    ('90+', 91, None),
+]
+
+_TOP_KEYS = """
+    SELECT key, SUM(order_count) AS order_count, SUM(quantity) AS quantity, SUM(total_cents) AS total_cents
+    FROM report_rollups
+    WHERE dimension = :dimension AND period BETWEEN :start AND :end
+    GROUP BY key
+    HAVING SUM(order_count) > 0
+    ORDER BY {order} DESC, key
+    LIMIT :limit
+"""
+# Top keys by each sort column
+_TOP_BY = {column: text(_TOP_KEYS.format(order=column)) for column in ('total_cents', 'quantity')}
+
+_STATUS_ROWS = text("""
+    SELECT period, key, order_count, total_cents FROM report_rollups
+    WHERE dimension = 'status' AND period BETWEEN :start AND :end AND order_count > 0
+    ORDER BY period, key
+""")
+
+
+class ReportError(ValueError):
+    """Raised for report parameters that are out of range or malformed."""
+
+
+def _month_index(period):
+    year, month = period.split('-')
+    return int(year) * 12 + int(month) - 1
+
+
+def _month_key(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _months(start, end):
+    return [_month_key(index) for index in range(_month_index(start), _month_index(end) + 1)]
+
+
+def parse_period_range(start, end, today=None):
+    """Validate a from/to pair of YYYY-MM months, defaulting to the last DEFAULT_MONTHS months."""
+    today = today or datetime.utcnow().date()
+    if not end:
+        end = today.strftime('%Y-%m')
+    for value in filter(None, (start, end)):
+        try:
+            datetime.strptime(value, '%Y-%m')
+        except ValueError:
+            raise ReportError(f"Invalid month {value!r}: expected YYYY-MM")
+        if len(value) != 7:
+            raise ReportError(f"Invalid month {value!r}: expected YYYY-MM")
+    if not start:
+        start = _month_key(_month_index(end) - (DEFAULT_MONTHS - 1))
+    if start > end:
+        raise ReportError("from must not be after to")
+    if _month_index(end) - _month_index(start) >= MAX_MONTHS:
+        raise ReportError(f"A report covers at most {MAX_MONTHS} months")
+    return start, end
+
+
+def parse_top_limit(value):
+    if value is None:
+        return DEFAULT_TOP_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ReportError("limit must be an integer")
+    if not 1 <= limit <= MAX_TOP_LIMIT:
+        raise ReportError(f"limit must be 1-{MAX_TOP_LIMIT}")
+    return limit
+
+
+class ReportCache:
+    """Report results keyed by report and parameters, dropped when their months change."""
+
+    def __init__(self, max_entries=256, max_age=300):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # Key -> (months (start, end) or None, depends on open orders, expiry, result)
+        self._entries = OrderedDict()
+        # Bumped by every invalidation, so a result computed across one is not stored
+        self._generation = 0
+
+    def get(self, key, months, due_dates, compute):
+        """Return the cached result for key, computing and storing it on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                return entry[3]
+            generation = self._generation
+        result = compute()
+        with self._lock:
+            if generation == self._generation and self.max_entries > 0:
+                self._entries[key] = (months, due_dates, now + self.max_age, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self, periods):
+        """Drop the results covering any of the given months (or markers from stats.py)."""
+        if not periods:
+            return
+        months = sorted(period for period in periods if period not in (ALL_PERIODS, DUE_DATES))
+        with self._lock:
+            self._generation += 1
+            if ALL_PERIODS in periods:
+                self._entries.clear()
+                return
+            for key, (span, due_dates, _, _) in list(self._entries.items()):
+                if (due_dates and DUE_DATES in periods) or (
+                        span is not None and any(span[0] <= month <= span[1] for month in months)):
+                    del self._entries[key]
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_reports(session):
+    periods = session.info.pop('report_periods', None)
+    if periods and has_app_context():
+        cache = current_app.extensions.get('reports')
+        if cache is not None:
+            cache.invalidate(periods)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_report_periods(session):
+    session.info.pop('report_periods', None)
+
+
+def init_reports(app):
+    cache = ReportCache(max_entries=app.config['REPORT_CACHE_ENTRIES'],
+                        max_age=app.config['REPORT_CACHE_SECONDS'])
+    app.extensions['reports'] = cache
+    return cache
+
+
+def get_report_cache():
+    return current_app.extensions['reports']
+
+
+def _period_totals(rows, start, end):
+    # Every month of the range, with zeros for the ones without orders
+    by_period = {row[0]: row for row in rows}
+    series = []
+    for month in _months(start, end):
+        row = by_period.get(month)
+        series.append({'period': month, 'count': row[1] if row else 0,
+                       'total': from_cents(row[2]) if row else 0.0})
+    return series
+
+
+def revenue_by_month(start, end):
+    """Order count and total per month of creation, cancelled orders excluded."""
+    def compute():
+        rows = (db.session.query(OrderSummary.bucket, OrderSummary.order_count, OrderSummary.total_cents)
+                .filter(OrderSummary.dimension == 'month', OrderSummary.bucket.between(start, end))
+                .all())
+        months = _period_totals(rows, start, end)
+        return {
+            'from': start,
+            'to': end,
+            'count': sum(month['count'] for month in months),
+            'total': from_cents(sum(row[2] for row in rows)),
+            'months': months,
+        }
+    return get_report_cache().get(('revenue', start, end), (start, end), False, compute)
+
+
+def top_customers(start, end, limit=DEFAULT_TOP_LIMIT):
+    """Customers with the highest order totals, by customer name."""
+    def compute():
+        rows = db.session.execute(_TOP_BY['total_cents'],
+                                  {'dimension': 'customer', 'start': start, 'end': end, 'limit': limit})
+        return {
+            'from': start,
+            'to': end,
+            'customers': [{'name': row.key, 'orders': row.order_count, 'total': from_cents(row.total_cents)}
+                          for row in rows],
+        }
+    return get_report_cache().get(('customers', start, end, limit), (start, end), False, compute)
+
+
+def top_items(start, end, limit=DEFAULT_TOP_LIMIT, sort='quantity'):
+    """Line item descriptions with the highest quantity (or line amount total)."""
+    order = 'total_cents' if sort == 'total' else 'quantity'
+
+    def compute():
+        rows = db.session.execute(_TOP_BY[order],
+                                  {'dimension': 'item', 'start': start, 'end': end, 'limit': limit})
+        return {
+            'from': start,
+            'to': end,
+            'sort': 'total' if order == 'total_cents' else 'quantity',
+            'items': [{'description': row.key, 'lines': row.order_count, 'quantity': round(row.quantity, 6),
+                       'total': from_cents(row.total_cents)} for row in rows],
+        }
+    return get_report_cache().get(('items', start, end, limit, order), (start, end), False, compute)
+
+
+def status_trends(start, end):
+    """Order count and total per status for each month of creation."""
+    def compute():
+        by_period = {month: {} for month in _months(start, end)}
+        for row in db.session.execute(_STATUS_ROWS, {'start': start, 'end': end}):
+            by_period[row.period][row.key] = {'count': row.order_count, 'total': from_cents(row.total_cents)}
+        return {
+            'from': start,
+            'to': end,
+            'months': [{'period': month, 'statuses': statuses} for month, statuses in by_period.items()],
+        }
+    return get_report_cache().get(('status', start, end), (start, end), False, compute)
+
+
+def aging(today=None):
+    """Open orders by how many days past their due date they are."""
+    today = today or datetime.utcnow().date()
+
+    def compute():
+        buckets = {label: [0, 0] for label, _, _ in AGING_BUCKETS}
+        due_rows = (db.session.query(OrderSummary.bucket, OrderSummary.order_count, OrderSummary.total_cents)
+                    .filter(OrderSummary.dimension == 'due', OrderSummary.order_count > 0))
+        due_count = due_cents = 0
+        for bucket, count, cents in due_rows:
+            overdue = today.toordinal() - date.fromisoformat(bucket).toordinal()
+            for label, least, most in AGING_BUCKETS:
+                if (least is None or overdue >= least) and (most is None or overdue <= most):
+                    buckets[label][0] += count
+                    buckets[label][1] += cents
+                    break
+            due_count += count
+            due_cents += cents
+
+        open_count, open_cents = (db.session.query(db.func.coalesce(db.func.sum(OrderSummary.order_count), 0),
+                                                   db.func.coalesce(db.func.sum(OrderSummary.total_cents), 0))
+                                  .filter(OrderSummary.dimension == 'status',
+                                          OrderSummary.bucket.notin_(CLOSED_STATUSES))
+                                  .one())
+        return {
+            'asOf': today.isoformat(),
+            'openOrders': {'count': int(open_count), 'total': from_cents(int(open_cents))},
+            'buckets': [{'label': label, 'count': buckets[label][0], 'total': from_cents(buckets[label][1])}
+                        for label, _, _ in AGING_BUCKETS],
+            'noDueDate': {'count': int(open_count) - due_count, 'total': from_cents(int(open_cents) - due_cents)},
+        }
+    return get_report_cache().get(('aging', today), None, True, compute)
@@ -1,109 +1,559 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, abort, stream_with_context
 from werkzeug.utils import secure_filename
 import os
+import csv
+import itertools
 import uuid
+from concurrent.futures import TimeoutError as RenderTimeoutError
 from datetime import datetime
 
 # Import db and logger from extensions, delay importing mail to avoid circular imports
 from extensions import db, logger
-from models import PurchaseOrder # Import models
+from models import PurchaseOrder, ArchivedPurchaseOrder, Customer, EmailJob, JobRun # Import models
+from pagination import (PaginationError, parse_limit, parse_bool_param, parse_date_param, encode_cursor,
+                        decode_cursor, keyset_filter, keyset_order)
+from stats import CLOSED_STATUSES, order_snapshot, record_order_change, get_order_stats
+import reports
+from validation import ValidationError, validate_order_data, parse_date, check_client_totals
+from money import parse_number
+from pdf_generator import PdfUnavailableError, get_renderer
+from mailer import enqueue_order_email
+from search import reindex_orders, search_order_ids, search_with_archive
+from customers import DEFAULT_SUGGEST_LIMIT, MAX_SUGGEST_LIMIT, get_customer_index, load_customers
+from archive import ArchiveError, restore_orders
+from scheduler import get_scheduler
+from batch import BatchError, delete_orders, parse_changes, parse_targets, update_orders
+from changes import DEFAULT_CHANGE_LIMIT, MAX_CHANGE_LIMIT, get_change_streams, read_changes, record_changes
+from serialization import ARCHIVED_ORDER_COLUMNS, ORDER_COLUMNS, OrderEncoder, dumps, stream_json_array
+from http_cache import (order_etag, list_etag, is_not_modified, not_modified, with_validators,
+                        if_match_fails)
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+# bulk, documents and email_validator are imported by the handlers that use
+# them: they are slow to load and not needed until someone imports, exports,
+# downloads in batch or emails (see StartupTimer in app.py)
 
 bp = Blueprint('api', __name__)
 
 @bp.route('/purchase-orders', methods=['POST'])
 def create_purchase_order():
     try:
-        # Debug log the request
         data = request.get_json()
         if not data:
             logger.error("No JSON data received in request")
             return jsonify({"error": "No data provided"}), 400
-        
-        logger.debug(f"Received purchase order data: {data}")
 
-        required_fields = ['customer', 'lineItems', 'subtotal', 'taxRate', 'taxAmount', 'total']
-        for field in required_fields:
-            if field not in data:
-                logger.error(f"Missing required field: {field}")
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+        try:
+            values = validate_order_data(data)
+        except ValidationError as e:
+            logger.error("Invalid purchase order data: %s", e)
+            return jsonify({"error": str(e)}), 400
 
         order_id = str(uuid.uuid4())
-        # Use the provided orderNumber if available, otherwise generate one
-        order_number = data.get('orderNumber', f"PO-{datetime.now().strftime('%Y%m%d%H%M%S')}")
+        new_order = PurchaseOrder(id=order_id, **values)
         
-        due_date_str = data.get('dueDate')
-        due_date_obj = None
-        logger.debug(f"Due date string: {due_date_str}")
-        if due_date_str:
-            try:
-                # First try ISO format with Z
-                due_date_obj = datetime.fromisoformat(due_date_str.replace('Z', '+00:00'))
-                logger.debug(f"Parsed due date: {due_date_obj}")
-            except ValueError as e:
-                try:
-                    # Try YYYY-MM-DD format
-                    due_date_obj = datetime.strptime(due_date_str, '%Y-%m-%d')
-                    logger.debug(f"Parsed due date with YYYY-MM-DD format: {due_date_obj}")
-                except ValueError as e2:
-                    logger.error(f"Error parsing due date: {e2}")
-                    return jsonify({"error": "Invalid dueDate format. Use ISO format or YYYY-MM-DD."}), 400
-
-        logger.debug("Creating new order object")
-        try:
-            new_order = PurchaseOrder(
-                id=order_id,
-                order_number=order_number,
-                customer=data['customer'],
-                line_items=data['lineItems'],
-                subtotal=float(data['subtotal']),
-                tax_rate=float(data['taxRate']),
-                tax_amount=float(data['taxAmount']),
-                total=float(data['total']),
-                notes=data.get('notes', ''),
-                status=data.get('status', 'unpaid')
-            )
-            logger.debug("Order object created successfully")
-        except Exception as e:
-            logger.error(f"Error creating PurchaseOrder object: {str(e)}", exc_info=True)
-            return jsonify({"error": f"Error creating purchase order object: {str(e)}"}), 400
-        
-        # Set the due_date separately if provided
-        if due_date_obj:
-            logger.debug(f"Setting due_date to {due_date_obj}")
-            new_order.due_date = due_date_obj
-        
-        logger.debug("Adding order to database session")
         db.session.add(new_order)
-        
-        logger.debug("Committing to database")
+        db.session.flush()
+        record_order_change(new=order_snapshot(new_order))
+        reindex_orders([order_id])
+        record_changes([order_id])
         db.session.commit()
-        logger.info(f"Purchase order created successfully: {order_id}")
+        logger.info("Purchase order created successfully: %s", order_id)
 
-        return jsonify(new_order.to_dict()), 201
+        return with_validators(jsonify(new_order.to_dict()), order_etag(new_order.version, new_order.updated_at),
+                               new_order.updated_at), 201
 
     except ValueError as ve:
-        logger.error(f"ValueError creating purchase order: {ve}")
+        logger.error("ValueError creating purchase order: %s", ve)
         return jsonify({"error": str(ve)}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        if 'purchase_orders.order_number' in str(e.orig):
+            logger.info("Rejected purchase order with duplicate order number %s", values['order_number'])
+            return jsonify({"error": f"Order number {values['order_number']} is already in use"}), 409
+        logger.error("Error creating purchase order: %s", e, exc_info=True)
+        return jsonify({"error": f"An unknown error occurred: {str(e)}"}), 500
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error creating purchase order: {e}", exc_info=True)
+        logger.error("Error creating purchase order: %s", e, exc_info=True)
         return jsonify({"error": f"An unknown error occurred: {str(e)}"}), 500
 
+# Sortable columns for the paginated listing, keyed by API field name
+SORT_COLUMNS = {
+    'createdAt': PurchaseOrder.created_at,
+    'dueDate': PurchaseOrder.due_date,
+    'total': PurchaseOrder.total_cents,
+    'orderNumber': PurchaseOrder.order_number,
+}
+
+LIST_PARAMS = ('limit', 'cursor', 'sort', 'direction', 'status', 'dueFrom', 'dueTo',
+               'createdFrom', 'createdTo', 'customer', 'orderNumber', 'includeArchived', 'overdue')
+# Listing filters a batch update or delete can select orders by
+BATCH_FILTERS = ('status', 'dueFrom', 'dueTo', 'createdFrom', 'createdTo', 'customer', 'orderNumber')
+
+def precondition_failed(order):
+    """412 response for an update based on an outdated version of the order"""
+    response = jsonify({
+        "error": "Purchase order was changed by someone else; reload it and try again",
+        "version": order.version,
+    })
+    response.status_code = 412
+    return with_validators(response, order_etag(order.version, order.updated_at), order.updated_at)
+
+def json_response(documents, fields):
+    """A JSON object response of fields plus "items", an array of already encoded orders"""
+    head = dumps(fields)
+    body = b''.join((head[:-1], b',"items":[', b','.join(documents), b']}'))
+    return Response(body, mimetype='application/json')
+
+def filter_purchase_orders(query, args, model=PurchaseOrder):
+    """Apply the listing filters from the query string to a PurchaseOrder (or ArchivedPurchaseOrder) query."""
+    status = args.get('status')
+    if status:
+        statuses = [s.strip() for s in status.split(',') if s.strip()]
+        query = query.filter(model.status.in_(statuses))
+
+    due_from = parse_date_param(args.get('dueFrom'), 'dueFrom')
+    if due_from:
+        query = query.filter(model.due_date >= due_from)
+    due_to = parse_date_param(args.get('dueTo'), 'dueTo')
+    if due_to:
+        query = query.filter(model.due_date <= due_to)
+
+    created_from = parse_date_param(args.get('createdFrom'), 'createdFrom')
+    if created_from:
+        query = query.filter(model.created_at >= created_from)
+    created_to = parse_date_param(args.get('createdTo'), 'createdTo')
+    if created_to:
+        query = query.filter(model.created_at <= created_to)
+
+    customer = args.get('customer')
+    if customer:
+        query = query.join(model.customer_record).filter(Customer.name.ilike(f"%{customer}%"))
+
+    order_number = args.get('orderNumber')
+    if order_number:
+        query = query.filter(model.order_number.startswith(order_number))
+
+    if parse_bool_param(args.get('overdue'), 'overdue'):
+        today = datetime.utcnow().date()
+        query = query.filter(model.status.notin_(CLOSED_STATUSES),
+                             model.due_date < datetime(today.year, today.month, today.day))
+
+    return query
+
+def merge_archived(rows, archived_rows, key, direction):
+    """Merge listing pages of orders and archived orders; returns the rows in listing order and the archived ids"""
+    ids = {row.id for row in rows}
+    # An order in both databases (see archive.py) is listed once, as the main copy
+    archived_rows = [row for row in archived_rows if row.id not in ids]
+
+    def sort_key(row):
+        # As keyset_order() sorts: NULLs first ascending and last descending
+        value = getattr(row, key)
+        return value is not None, value, row.id
+
+    merged = sorted(rows + archived_rows, key=sort_key, reverse=direction == 'desc')
+    return merged, {row.id for row in archived_rows}
+
+def encode_orders(rows, archived=()):
+    """Encode rows of orders and of archived orders (the ids in archived), in the same order"""
+    if not archived:
+        return OrderEncoder().encode(rows)
+    current = iter(OrderEncoder().encode([row for row in rows if row.id not in archived]))
+    old = iter(OrderEncoder(archived=True).encode([row for row in rows if row.id in archived]))
+    return [next(old if row.id in archived else current) for row in rows]
+
 @bp.route('/purchase-orders', methods=['GET'])
 def get_purchase_orders():
-    orders = PurchaseOrder.query.all()
-    return jsonify([order.to_dict() for order in orders])
+    # Clients that pass no listing parameters get the full list as before
+    if not any(param in request.args for param in LIST_PARAMS):
+        # Any create, update or delete changes the count, the latest updated_at or the version sum
+        count, last_modified, versions = db.session.query(
+            func.count(), func.max(PurchaseOrder.updated_at), func.sum(PurchaseOrder.version)).one()
+        etag = list_etag(count, last_modified, versions)
+        if is_not_modified(etag):
+            return not_modified(etag, last_modified)
+        response = Response(stream_with_context(stream_json_array(PurchaseOrder.query)), mimetype='application/json')
+        return with_validators(response, etag, last_modified)
+
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        sort = request.args.get('sort', 'createdAt')
+        if sort not in SORT_COLUMNS:
+            return jsonify({"error": f"Invalid sort field. Use one of: {', '.join(SORT_COLUMNS)}"}), 400
+        direction = request.args.get('direction', 'desc').lower()
+        if direction not in ('asc', 'desc'):
+            return jsonify({"error": "direction must be 'asc' or 'desc'"}), 400
+
+        include_archived = parse_bool_param(request.args.get('includeArchived'), 'includeArchived')
+
+        column = SORT_COLUMNS[sort]
+        query = filter_purchase_orders(PurchaseOrder.query, request.args)
+        archived_column = getattr(ArchivedPurchaseOrder, column.key)
+        archived_query = filter_purchase_orders(ArchivedPurchaseOrder.query, request.args, ArchivedPurchaseOrder)
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            value, row_id = decode_cursor(cursor, sort, direction)
+            query = query.filter(keyset_filter(column, PurchaseOrder.id, direction, value, row_id))
+            archived_query = archived_query.filter(
+                keyset_filter(archived_column, ArchivedPurchaseOrder.id, direction, value, row_id))
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Fetch one extra row to find out whether another page exists
+    rows = (query.with_entities(*ORDER_COLUMNS)
+            .order_by(*keyset_order(column, PurchaseOrder.id, direction)).limit(limit + 1).all())
+    archived = set()
+    if include_archived:
+        archived_rows = (archived_query.with_entities(*ARCHIVED_ORDER_COLUMNS)
+                         .order_by(*keyset_order(archived_column, ArchivedPurchaseOrder.id, direction))
+                         .limit(limit + 1).all())
+        rows, archived = merge_archived(rows, archived_rows, column.key, direction)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, direction, getattr(last, column.key), last.id)
+
+    etag = list_etag(has_more, [(row.id, row.version) for row in rows], [row.id for row in rows if row.id in archived])
+    last_modified = max((row.updated_at for row in rows), default=None)
+    if is_not_modified(etag):
+        return not_modified(etag, last_modified)
+    response = json_response(encode_orders(rows, archived), {
+        "nextCursor": next_cursor,
+        "hasMore": has_more,
+        "limit": limit,
+    })
+    return with_validators(response, etag, last_modified)
+
+@bp.route('/purchase-orders/bulk', methods=['POST'])
+def bulk_import_purchase_orders():
+    """Import many purchase orders from an NDJSON or CSV request body"""
+    import bulk
+
+    fmt = request.args.get('format')
+    if not fmt:
+        fmt = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+    try:
+        batch_size = parse_limit(request.args.get('batchSize'), default=bulk.IMPORT_BATCH_SIZE, maximum=5000)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = bulk.iter_csv(request.stream) if fmt == 'csv' else bulk.iter_ndjson(request.stream)
+    try:
+        result = bulk.import_orders(rows, batch_size=batch_size)
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({"error": f"Could not read {fmt} body: {e}"}), 400
+
+    logger.info("Bulk import finished: %s created, %s failed", result['created'], result['failed'])
+    return jsonify(result), 200 if result['failed'] == 0 else 207
+
+def batch_targets(data):
+    """(order id, expected version) pairs for a batch request's "ids", or the orders matching its "filter"."""
+    maximum = current_app.config['BATCH_MAX_ORDERS']
+    if ('ids' in data) == ('filter' in data):
+        raise BatchError("Give either ids or filter")
+    if 'ids' in data:
+        targets = parse_targets(data['ids'])
+    else:
+        filters = data['filter']
+        if not isinstance(filters, dict) or not filters:
+            raise BatchError(f"filter must be an object with any of: {', '.join(BATCH_FILTERS)}")
+        unknown = sorted(set(filters) - set(BATCH_FILTERS))
+        if unknown:
+            raise BatchError(f"Unknown filter {', '.join(unknown)}; use any of: {', '.join(BATCH_FILTERS)}")
+        if not all(isinstance(value, str) for value in filters.values()):
+            raise BatchError("filter values must be strings, as in the listing query string")
+        query = filter_purchase_orders(db.session.query(PurchaseOrder.id), filters)
+        targets = [(order_id, None) for (order_id,) in query.order_by(PurchaseOrder.id).limit(maximum + 1)]
+    if len(targets) > maximum:
+        raise BatchError(f"A batch may change at most {maximum} orders")
+    return targets
+
+def batch_response(results, outcome):
+    """Outcome counts and per-order results; 207 when some orders were missing or had changed"""
+    counts = {outcome: 0, 'notFound': 0, 'conflicts': 0}
+    keys = {outcome: outcome, 'not_found': 'notFound', 'conflict': 'conflicts'}
+    for result in results:
+        counts[keys[result['outcome']]] += 1
+    status = 200 if counts['notFound'] == counts['conflicts'] == 0 else 207
+    return jsonify(dict(counts, results=results)), status
+
+@bp.route('/purchase-orders/batch-update', methods=['POST'])
+def batch_update_purchase_orders():
+    """Set status, notes, dueDate or taxRate on many orders in one transaction"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    try:
+        values = parse_changes(data.get('set'))
+        targets = batch_targets(data)
+        results = update_orders(targets, values)
+    except (BatchError, PaginationError) as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Batch update failed: %s", e, exc_info=True)
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    return batch_response(results, 'updated')
+
+@bp.route('/purchase-orders/batch-delete', methods=['POST'])
+def batch_delete_purchase_orders():
+    """Delete many orders in one transaction"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    try:
+        targets = batch_targets(data)
+        results = delete_orders(targets)
+    except (BatchError, PaginationError) as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Batch delete failed: %s", e, exc_info=True)
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    return batch_response(results, 'deleted')
+
+@bp.route('/purchase-orders/export', methods=['GET'])
+def export_purchase_orders():
+    """Stream purchase orders matching the listing filters as NDJSON or CSV"""
+    import bulk
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+    try:
+        query = filter_purchase_orders(PurchaseOrder.query, request.args)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if fmt == 'csv':
+        body, mimetype = bulk.export_csv(bulk.iter_orders(query)), 'text/csv'
+    else:
+        body, mimetype = bulk.export_ndjson(query), 'application/x-ndjson'
+    filename = f"purchase-orders-{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@bp.route('/purchase-orders/documents', methods=['GET'])
+def get_purchase_order_documents():
+    """PDFs of the orders matching the listing filters, as a ZIP archive or one merged PDF"""
+    import documents
+
+    fmt = request.args.get('format', 'zip')
+    if fmt not in documents.BATCH_FORMATS:
+        return jsonify({"error": "format must be 'zip' or 'pdf'"}), 400
+    try:
+        query = filter_purchase_orders(PurchaseOrder.query, request.args)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    max_orders = current_app.config['PDF_BATCH_MAX_ORDERS']
+    order_ids = [row.id for row in query.with_entities(PurchaseOrder.id)
+                 .order_by(PurchaseOrder.created_at, PurchaseOrder.id).limit(max_orders + 1)]
+    if not order_ids:
+        return jsonify({"error": "No purchase orders match the filters"}), 404
+    if len(order_ids) > max_orders:
+        return jsonify({"error": f"More than {max_orders} purchase orders match; narrow the filters"}), 400
+
+    renderer = get_renderer()
+    try:
+        if fmt == 'pdf':
+            body, mimetype = documents.stream_file(documents.merged_pdf(renderer, order_ids)), 'application/pdf'
+        else:
+            chunks = documents.stream_zip(renderer, order_ids)
+            # Wait for the first entry before answering, so a missing PDF backend is still a 503
+            body, mimetype = itertools.chain([next(chunks)], chunks), 'application/zip'
+    except PdfUnavailableError as e:
+        logger.error("Error generating PDFs: %s", e)
+        return jsonify({"error": str(e)}), 503
+    except documents.DocumentError as e:
+        logger.error("Error generating merged PDF: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+    filename = f"purchase-orders-{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@bp.route('/purchase-orders/search', methods=['GET'])
+def search_purchase_orders():
+    """Full-text search by order number, customer, line items and notes"""
+    query_text = request.args.get('q', '').strip()
+    if not query_text:
+        return jsonify({"error": "Query parameter 'q' is required"}), 400
+    try:
+        limit = parse_limit(request.args.get('limit'), default=20)
+        offset = int(request.args.get('offset', 0))
+        include_archived = parse_bool_param(request.args.get('includeArchived'), 'includeArchived')
+    except (PaginationError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if offset < 0:
+        return jsonify({"error": "offset must not be negative"}), 400
+
+    if include_archived:
+        found = search_with_archive(query_text, limit, offset)
+        order_ids = [order_id for order_id, _ in found]
+        archived = {order_id for order_id, is_archived in found if is_archived}
+    else:
+        order_ids, archived = search_order_ids(query_text, limit, offset), set()
+    rows = (PurchaseOrder.query.filter(PurchaseOrder.id.in_([i for i in order_ids if i not in archived]))
+            .with_entities(*ORDER_COLUMNS).all())
+    if archived:
+        rows += (ArchivedPurchaseOrder.query.filter(ArchivedPurchaseOrder.id.in_(archived))
+                 .with_entities(*ARCHIVED_ORDER_COLUMNS).all())
+    documents = dict(zip((row.id for row in rows), encode_orders(rows, archived)))
+    return json_response([documents[order_id] for order_id in order_ids if order_id in documents], {
+        "query": query_text,
+        "limit": limit,
+        "offset": offset,
+    })
+
+def parse_change_cursor(value):
+    """Parse a change feed cursor; a missing one starts from the beginning."""
+    if value in (None, ''):
+        return 0
+    try:
+        cursor = int(value)
+    except ValueError:
+        raise PaginationError("since must be a cursor returned by the change feed")
+    if cursor < 0:
+        raise PaginationError("since must not be negative")
+    return cursor
+
+@bp.route('/purchase-orders/changes', methods=['GET'])
+def get_purchase_order_changes():
+    """Orders created, updated or deleted after the ?since= cursor"""
+    try:
+        since = parse_change_cursor(request.args.get('since'))
+        limit = parse_limit(request.args.get('limit'), default=DEFAULT_CHANGE_LIMIT, maximum=MAX_CHANGE_LIMIT)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+    body, _, _, _ = read_changes(since, limit)
+    return Response(body, mimetype='application/json')
+
+@bp.route('/purchase-orders/changes/stream', methods=['GET'])
+def stream_purchase_order_changes():
+    """The change feed as Server-Sent Events, resuming from Last-Event-ID or ?since="""
+    try:
+        since = parse_change_cursor(request.headers.get('Last-Event-ID') or request.args.get('since'))
+        limit = parse_limit(request.args.get('limit'), default=DEFAULT_CHANGE_LIMIT, maximum=MAX_CHANGE_LIMIT)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    streams = get_change_streams()
+    if not streams.acquire():
+        # Every stream holds a server thread; the client can poll /changes instead
+        return jsonify({"error": "Too many open change streams; poll /purchase-orders/changes instead"}), 503
+
+    response = Response(stream_with_context(streams.events(since, limit)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(streams.release)
+    return response
+
+@bp.route('/purchase-orders/stats', methods=['GET'])
+def get_purchase_order_stats():
+    """Dashboard aggregates served from the order summary table"""
+    try:
+        days = int(request.args.get('days', 30))
+        months = int(request.args.get('months', 12))
+    except ValueError:
+        return jsonify({"error": "days and months must be integers"}), 400
+    if not (1 <= days <= 366 and 1 <= months <= 120):
+        return jsonify({"error": "days must be 1-366 and months 1-120"}), 400
+    return jsonify(get_order_stats(days=days, months=months))
+
+@bp.route('/reports/revenue', methods=['GET'])
+def get_revenue_report():
+    """Revenue per month; from/to are YYYY-MM months, the last 12 by default"""
+    try:
+        start, end = reports.parse_period_range(request.args.get('from'), request.args.get('to'))
+    except reports.ReportError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(reports.revenue_by_month(start, end))
+
+@bp.route('/reports/top-customers', methods=['GET'])
+def get_top_customers_report():
+    try:
+        start, end = reports.parse_period_range(request.args.get('from'), request.args.get('to'))
+        limit = reports.parse_top_limit(request.args.get('limit'))
+    except reports.ReportError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(reports.top_customers(start, end, limit))
+
+@bp.route('/reports/top-items', methods=['GET'])
+def get_top_items_report():
+    """Top line items by quantity, or by line amount with sort=total"""
+    sort = request.args.get('sort', 'quantity')
+    if sort not in ('quantity', 'total'):
+        return jsonify({"error": "sort must be quantity or total"}), 400
+    try:
+        start, end = reports.parse_period_range(request.args.get('from'), request.args.get('to'))
+        limit = reports.parse_top_limit(request.args.get('limit'))
+    except reports.ReportError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(reports.top_items(start, end, limit, sort))
+
+@bp.route('/reports/aging', methods=['GET'])
+def get_aging_report():
+    """Open orders grouped by days past their due date"""
+    return jsonify(reports.aging())
+
+@bp.route('/reports/status-trends', methods=['GET'])
+def get_status_trends_report():
+    try:
+        start, end = reports.parse_period_range(request.args.get('from'), request.args.get('to'))
+    except reports.ReportError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(reports.status_trends(start, end))
+
+def get_archived_purchase_order(order_id):
+    """An archived order, for GET /purchase-orders/<id>?includeArchived=true"""
+    row = (ArchivedPurchaseOrder.query.filter(ArchivedPurchaseOrder.id == order_id)
+           .with_entities(*ARCHIVED_ORDER_COLUMNS, ArchivedPurchaseOrder.archived_at).first_or_404())
+    # Archiving changes the representation but not the version
+    etag = f"{order_etag(row.version, row.updated_at)}-archived"
+    if is_not_modified(etag, row.archived_at):
+        return not_modified(etag, row.archived_at)
+    document = OrderEncoder(archived=True).encode([row[:len(ARCHIVED_ORDER_COLUMNS)]])[0]
+    return with_validators(Response(document, mimetype='application/json'), etag, row.archived_at)
 
 @bp.route('/purchase-orders/<string:order_id>', methods=['GET'])
 def get_purchase_order(order_id):
+    try:
+        include_archived = parse_bool_param(request.args.get('includeArchived'), 'includeArchived')
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+    # Check the validators before loading (and serializing) the whole order
+    validators = (db.session.query(PurchaseOrder.version, PurchaseOrder.updated_at)
+                  .filter(PurchaseOrder.id == order_id).first())
+    if validators is None:
+        if include_archived:
+            return get_archived_purchase_order(order_id)
+        abort(404)
+    etag = order_etag(validators.version, validators.updated_at)
+    if is_not_modified(etag, validators.updated_at):
+        return not_modified(etag, validators.updated_at)
+
     order = PurchaseOrder.query.get_or_404(order_id)
-    return jsonify(order.to_dict())
+    return with_validators(jsonify(order.to_dict()), order_etag(order.version, order.updated_at), order.updated_at)
 
 @bp.route('/purchase-orders/<string:order_id>', methods=['PUT'])
 def update_purchase_order(order_id):
     try:
         data = request.get_json()
-        logger.debug(f"Received update data for order {order_id}: {data}")
         
         if not data:
             logger.error("No JSON data received in request")
@@ -111,48 +561,63 @@ def update_purchase_order(order_id):
 
         order = PurchaseOrder.query.get_or_404(order_id)
         if not order:
-            logger.error(f"Purchase order not found with ID {order_id}")
+            logger.error("Purchase order not found with ID %s", order_id)
             return jsonify({"error": f"Purchase order with ID {order_id} not found"}), 404
         
+        # Optimistic concurrency: the client may only update the version it last read
+        current_etag = order_etag(order.version, order.updated_at)
+        if if_match_fails(current_etag):
+            logger.info("Rejected update of purchase order %s: If-Match does not match %s", order_id, current_etag)
+            return precondition_failed(order)
+
+        old_snapshot = order_snapshot(order)
+
         # Update fields
         if 'customer' in data:
             order.customer = data['customer']
         if 'lineItems' in data:
             order.line_items = data['lineItems']
-        if 'subtotal' in data:
-            order.subtotal = data['subtotal']
         if 'taxRate' in data:
-            order.tax_rate = data['taxRate']
-        if 'taxAmount' in data:
-            order.tax_amount = data['taxAmount']
-        if 'total' in data:
-            order.total = data['total']
+            order.tax_rate = parse_number(data['taxRate'], 'taxRate')
+        # Totals always follow the line items; ones sent by the client are only checked
+        check_client_totals(data, order.recalculate_totals())
         if 'status' in data:
-            logger.debug(f"Updating status from {order.status} to {data['status']}")
+            logger.debug("Updating status from %s to %s", order.status, data['status'])
             order.status = data['status']
         if 'notes' in data:
             order.notes = data['notes']
         if 'dueDate' in data and data['dueDate']:
             try:
-                # First try ISO format
-                due_date_obj = datetime.fromisoformat(data['dueDate'].replace('Z', '+00:00'))
-                order.due_date = due_date_obj
-                logger.debug(f"Updated due_date to {due_date_obj} from ISO format")
-            except ValueError:
-                try:
-                    # Then try YYYY-MM-DD format
-                    order.due_date = datetime.strptime(data['dueDate'], '%Y-%m-%d')
-                    logger.debug(f"Updated due_date using YYYY-MM-DD format")
-                except ValueError as e:
-                    logger.error(f"Error parsing due date: {e}")
-                    return jsonify({"error": "Invalid dueDate format"}), 400
+                order.due_date = parse_date(data['dueDate'])
+                logger.debug("Updated due_date to %s", order.due_date)
+            except ValidationError as e:
+                logger.error("Error parsing due date: %s", e)
+                return jsonify({"error": "Invalid dueDate format"}), 400
         
+        # Always touch the row, so changes to line items alone still bump the version
+        order.updated_at = datetime.utcnow()
+        # Flushed first, so a customer created by this update has its id in the snapshot
+        db.session.flush()
+        record_order_change(old=old_snapshot, new=order_snapshot(order))
+        reindex_orders([order_id])
+        record_changes([order_id])
         db.session.commit()
-        logger.info(f"Successfully updated purchase order {order_id}")
-        return jsonify(order.to_dict())
+        get_renderer().invalidate(order_id)
+        logger.info("Successfully updated purchase order %s", order_id)
+        return with_validators(jsonify(order.to_dict()), order_etag(order.version, order.updated_at),
+                               order.updated_at)
 
+    except StaleDataError:
+        # Another request updated the order between our read and our write
+        db.session.rollback()
+        logger.info("Rejected update of purchase order %s: changed concurrently", order_id)
+        return precondition_failed(PurchaseOrder.query.get_or_404(order_id))
+    except ValueError as ve:
+        logger.error("ValueError updating purchase order %s: %s", order_id, ve)
+        db.session.rollback()
+        return jsonify({"error": str(ve)}), 400
     except Exception as e:
-        logger.error(f"Error updating purchase order {order_id}: {str(e)}")
+        logger.error("Error updating purchase order %s: %s", order_id, e)
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
@@ -163,26 +628,216 @@ def delete_purchase_order(order_id):
         if not order:
             return jsonify({"error": f"Purchase order with ID {order_id} not found"}), 404
         
-        logger.info(f"Attempting to delete purchase order {order_id}")
+        logger.info("Attempting to delete purchase order %s", order_id)
+        record_order_change(old=order_snapshot(order))
         db.session.delete(order)
+        db.session.flush()
+        reindex_orders([order_id])
+        record_changes([order_id], deleted=True)
         db.session.commit()
-        logger.info(f"Successfully deleted purchase order {order_id}")
+        get_renderer().invalidate(order_id)
+        logger.info("Successfully deleted purchase order %s", order_id)
         return '', 204
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Error deleting purchase order {order_id}: {error_msg}")
+        logger.error("Error deleting purchase order %s: %s", order_id, error_msg)
         db.session.rollback()
         return jsonify({"error": error_msg}), 500
 
+@bp.route('/purchase-orders/<string:order_id>/restore', methods=['POST'])
+def restore_purchase_order(order_id):
+    """Move an archived order back to the main database, so it can be changed again"""
+    try:
+        restored = restore_orders([order_id])
+    except ArchiveError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.error("Error restoring purchase order %s: %s", order_id, e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+    order = db.session.get(PurchaseOrder, order_id)
+    if order is None:
+        return jsonify({"error": f"Archived purchase order with ID {order_id} not found"}), 404
+    if restored:
+        logger.info("Restored purchase order %s from the archive", order_id)
+    return jsonify(order.to_dict())
+
+@bp.route('/purchase-orders/<string:order_id>/pdf', methods=['GET'])
+def get_purchase_order_pdf(order_id):
+    """Return the purchase order as a PDF, served from cache when unchanged"""
+    order = PurchaseOrder.query.get_or_404(order_id)
+    renderer = get_renderer()
+    order_dict = order.to_dict()
+
+    # The cache key is a content hash, so a matching ETag needs no rendering at all
+    etag = renderer.cache_key(order_dict)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        pdf, etag = renderer.get_pdf(order, order_dict)
+    except PdfUnavailableError as e:
+        logger.error("Error generating PDF: %s", e)
+        return jsonify({"error": str(e)}), 503
+    except RenderTimeoutError:
+        logger.error("Timed out generating PDF for order %s", order_id)
+        return jsonify({"error": "Timed out generating PDF"}), 504
+    except Exception as e:
+        logger.error("Error generating PDF for order %s: %s", order_id, e, exc_info=True)
+        return jsonify({"error": f"Error generating PDF: {str(e)}"}), 500
+
+    response = Response(pdf, mimetype='application/pdf')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Content-Disposition'] = f'inline; filename="PurchaseOrder_{order.order_number}.pdf"'
+    return response
+
+@bp.route('/purchase-orders/<string:order_id>/email', methods=['POST'])
+def email_purchase_order(order_id):
+    """Queue the purchase order PDF for emailing and return the job id"""
+    from email_validator import validate_email, EmailNotValidError
+
+    data = request.get_json(silent=True) or {}
+    recipient_email = data.get('email')
+    if not recipient_email:
+        return jsonify({"success": False, "message": "Recipient email is required"}), 400
+    try:
+        recipient_email = validate_email(recipient_email, check_deliverability=False).normalized
+    except EmailNotValidError as e:
+        return jsonify({"success": False, "message": f"Invalid recipient email: {e}"}), 400
+
+    order = PurchaseOrder.query.get_or_404(order_id)
+    job = enqueue_order_email(
+        order.id,
+        recipient_email,
+        data.get('subject') or 'Your Purchase Order from StitchPay',
+        data.get('message', '')
+    )
+    db.session.commit()
+    logger.info("Queued email job %s for order %s", job.id, order_id)
+
+    worker = current_app.extensions.get('mail_worker')
+    if worker:
+        worker.notify()
+    return jsonify({
+        "success": True,
+        "message": f"Purchase order queued for emailing to {recipient_email}",
+        "jobId": job.id,
+        "status": job.status
+    }), 202
+
+@bp.route('/email-jobs', methods=['GET'])
+def get_email_jobs():
+    """Recent email jobs, optionally filtered by order and status"""
+    try:
+        limit = parse_limit(request.args.get('limit'))
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+    query = EmailJob.query
+    if request.args.get('orderId'):
+        query = query.filter(EmailJob.purchase_order_id == request.args['orderId'])
+    if request.args.get('status'):
+        query = query.filter(EmailJob.status == request.args['status'])
+    jobs = query.order_by(EmailJob.created_at.desc()).limit(limit).all()
+    return jsonify([job.to_dict() for job in jobs])
+
+@bp.route('/email-jobs/<string:job_id>', methods=['GET'])
+def get_email_job(job_id):
+    job = EmailJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+@bp.route('/scheduled-jobs', methods=['GET'])
+def get_scheduled_jobs():
+    """The scheduler's jobs with their next and latest runs"""
+    scheduler = get_scheduler()
+    jobs = scheduler.status() if scheduler else []
+    for job in jobs:
+        run = JobRun.query.filter(JobRun.job == job['job']).order_by(JobRun.id.desc()).first()
+        job['lastRun'] = run.to_dict() if run else None
+    return jsonify(jobs)
+
+@bp.route('/scheduled-jobs/runs', methods=['GET'])
+def get_job_runs():
+    """Recent job runs, optionally filtered by job and status"""
+    try:
+        limit = parse_limit(request.args.get('limit'))
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+    query = JobRun.query
+    if request.args.get('job'):
+        query = query.filter(JobRun.job == request.args['job'])
+    if request.args.get('status'):
+        query = query.filter(JobRun.status == request.args['status'])
+    runs = query.order_by(JobRun.id.desc()).limit(limit).all()
+    return jsonify([run.to_dict() for run in runs])
+
+@bp.route('/scheduled-jobs/<string:name>/run', methods=['POST'])
+def run_scheduled_job(name):
+    """Ask the scheduler to run a job now; it is recorded in the run history"""
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return jsonify({"error": "The scheduler is not running"}), 503
+    try:
+        scheduler.trigger(name)
+    except KeyError:
+        return jsonify({"error": f"No scheduled job named {name}"}), 404
+    logger.info("Job %s triggered by request", name)
+    return jsonify({"job": name, "status": "triggered"}), 202
+
+@bp.route('/customers', methods=['GET'])
+def get_customers():
+    """Customers that have orders, by name, with their order counts"""
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        query = Customer.query.filter(
+            db.session.query(PurchaseOrder.id).filter(PurchaseOrder.customer_id == Customer.id).exists())
+        cursor = request.args.get('cursor')
+        if cursor:
+            value, row_id = decode_cursor(cursor, 'name', 'asc')
+            query = query.filter(keyset_filter(Customer.name, Customer.id, 'asc', value, row_id))
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = (query.with_entities(Customer.id, Customer.name)
+            .order_by(*keyset_order(Customer.name, Customer.id, 'asc')).limit(limit + 1).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    found = load_customers(row.id for row in rows)
+    return jsonify({
+        "items": [found[row.id] for row in rows if row.id in found],
+        "nextCursor": encode_cursor('name', 'asc', rows[-1].name, rows[-1].id) if has_more else None,
+        "hasMore": has_more,
+        "limit": limit,
+    })
+
+@bp.route('/customers/suggest', methods=['GET'])
+def suggest_customers():
+    """Customers whose name, a word of the name or email starts with ?q=, for autocomplete"""
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({"error": "q is required"}), 400
+    try:
+        limit = parse_limit(request.args.get('limit'), default=DEFAULT_SUGGEST_LIMIT, maximum=MAX_SUGGEST_LIMIT)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"query": query, "items": get_customer_index().suggest(query, limit)})
+
+@bp.route('/customers/<int:customer_id>', methods=['GET'])
+def get_customer(customer_id):
+    customer = load_customers([customer_id]).get(customer_id)
+    if customer is None:
+        return jsonify({"error": f"Customer {customer_id} not found"}), 404
+    return jsonify(customer)
+
 @bp.route('/test', methods=['GET'])
 def test_endpoint():
-    logger.info("Test endpoint accessed")
     return jsonify({"message": "Backend is working correctly", "status": "ok"}), 200
 
 @bp.route('/health', methods=['GET'])
 def api_health_check():
     """A simple endpoint to verify that the API is working"""
-    logger.info("API Health check endpoint called")
     return jsonify({
         "status": "ok",
         "message": "API is operational"
@@ -0,0 +1,361 @@
+"""Scheduled background jobs: overdue order checks and archiving.
+
+create_app starts one Scheduler thread that runs each registered job every
+interval seconds, one job at a time, and records every run in job_runs.
+After a restart a job waits out what is left of its interval since its last
+recorded run rather than running again straight away.
+
+Before running, a job takes its lease in job_locks, so two processes on the
+same database (the app and `python scheduler.py run`, say) never run it at
+the same time. A lease left behind by a process that died expires after
+LEASE_DURATION, and the run it was recording is marked failed.
+
+Jobs stay out of the way of requests, which share SQLite's single writer:
+they find their work with plain reads outside any transaction, then write
+SCHEDULER_BATCH_SIZE rows per short write transaction and pause between
+transactions, so a request never waits for the write lock for longer than
+one batch.
+
+The overdue job flags open orders past their due date in overdue_orders.
+The search is a range scan of ix_purchase_orders_status_due_date for each
+open status in use. With OVERDUE_REMINDERS_ENABLED it also queues a payment
+reminder for every flagged order whose customer has an email address,
+through the outbox and the purchase order email template (mailer.py).
+
+    python scheduler.py                  # jobs with their last runs
+    python scheduler.py run overdue      # run a job now
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, func, or_, text
+from sqlalchemy.dialects.sqlite import insert
+
+from database import begin_write
+from extensions import db, logger
+from mailer import enqueue_order_email
+from models import Customer, JobLock, JobRun, OverdueOrder, PurchaseOrder
+from stats import CLOSED_STATUSES
+
+# Longer than any job runs; a lease this old belongs to a process that died
+LEASE_DURATION = timedelta(hours=1)
+
+# The statuses in use, one index seek each rather than a scan of the whole
+# index: there are a handful of statuses and many orders
+_STATUSES = """WITH RECURSIVE statuses(status) AS (
+    SELECT MIN(status) FROM purchase_orders
+    UNION ALL
+    SELECT (SELECT MIN(status) FROM purchase_orders WHERE status > statuses.status)
+    FROM statuses WHERE statuses.status IS NOT NULL
+)
+"""
+
+_NEWLY_OVERDUE = text(_STATUSES + """
+    SELECT po.id, po.due_date FROM purchase_orders po
+    WHERE po.status IN (SELECT status FROM statuses WHERE status NOT IN :closed) AND po.due_date < :today
+      AND NOT EXISTS (SELECT 1 FROM overdue_orders o WHERE o.purchase_order_id = po.id)
+""").bindparams(bindparam('closed', expanding=True))
+
+# Flags of orders that were since paid, cancelled, deleted, archived or given another due date
+_RESOLVED = text("""
+    SELECT o.purchase_order_id FROM overdue_orders o
+    LEFT JOIN purchase_orders po ON po.id = o.purchase_order_id
+    WHERE po.id IS NULL OR po.status IN :closed OR po.due_date IS NOT o.due_date
+""").bindparams(bindparam('closed', expanding=True))
+
+# The due date is copied as stored, so _RESOLVED can compare it as it is
+_FLAG = text("INSERT OR IGNORE INTO overdue_orders (purchase_order_id, due_date, flagged_at) "
+             "VALUES (:id, :due_date, :now)")
+
+_UNFLAG = text("DELETE FROM overdue_orders WHERE purchase_order_id IN :ids").bindparams(
+    bindparam('ids', expanding=True))
+
+
+class Job:
+    """A function of the app config, run every interval seconds; it returns a summary of what it did."""
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        # time.monotonic() of the next run
+        self.next_run = 0.0
+
+
+def write_in_batches(write, items, batch_size, pause):
+    """Call write() with batch_size items at a time, each batch in its own write transaction."""
+    for start in range(0, len(items), batch_size):
+        if start:
+            # Let requests waiting for the write lock go first
+            time.sleep(pause)
+        try:
+            begin_write()
+            write(items[start:start + batch_size])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def _reminders_due(oldest, order_ids=None):
+    query = (db.session.query(OverdueOrder.purchase_order_id, OverdueOrder.due_date, PurchaseOrder.order_number,
+                              Customer.email)
+             .join(PurchaseOrder, PurchaseOrder.id == OverdueOrder.purchase_order_id)
+             .join(Customer, Customer.id == PurchaseOrder.customer_id)
+             .filter(OverdueOrder.reminded_at.is_(None), OverdueOrder.due_date >= oldest,
+                     PurchaseOrder.status.notin_(CLOSED_STATUSES), Customer.email.isnot(None), Customer.email != ''))
+    if order_ids is not None:
+        query = query.filter(OverdueOrder.purchase_order_id.in_(order_ids))
+    return query.all()
+
+
+def queue_reminders(oldest, batch_size, pause):
+    """Queue a payment reminder for each flagged order due since oldest that has none yet; returns how many."""
+    queued = 0
+
+    def remind(order_ids):
+        nonlocal queued
+        now = datetime.utcnow()
+        # The order may have been paid since it was listed
+        for row in _reminders_due(oldest, order_ids):
+            enqueue_order_email(
+                row.purchase_order_id,
+                row.email,
+                f"Payment reminder: Purchase Order #{row.order_number}",
+                f"Purchase order #{row.order_number} was due on {row.due_date:%B %d, %Y} and is now overdue. "
+                "If you have already paid, please disregard this reminder."
+            )
+            queued += 1
+        (OverdueOrder.query.filter(OverdueOrder.purchase_order_id.in_(order_ids))
+         .update({'reminded_at': now}, synchronize_session=False))
+
+    write_in_batches(remind, [row.purchase_order_id for row in _reminders_due(oldest)], batch_size, pause)
+    if queued:
+        worker = current_app.extensions.get('mail_worker')
+        if worker:
+            worker.notify()
+    return queued
+
+
+def check_overdue(config, today=None):
+    """Flag the open orders due before today, drop flags that no longer apply and queue reminders."""
+    today = today or datetime.utcnow().date()
+    midnight = datetime(today.year, today.month, today.day)
+    batch_size, pause = config['SCHEDULER_BATCH_SIZE'], config['SCHEDULER_BATCH_PAUSE_MS'] / 1000
+
+    resolved = [row.purchase_order_id for row in db.session.execute(_RESOLVED, {'closed': CLOSED_STATUSES})]
+    write_in_batches(lambda ids: db.session.execute(_UNFLAG, {'ids': ids}), resolved, batch_size, pause)
+
+    found = db.session.execute(_NEWLY_OVERDUE, {'closed': CLOSED_STATUSES, 'today': midnight}).all()
+    write_in_batches(
+        lambda rows: db.session.execute(
+            _FLAG, [{'id': row.id, 'due_date': row.due_date, 'now': datetime.utcnow()} for row in rows]),
+        found, batch_size, pause)
+
+    summary = f"Flagged {len(found)} overdue orders, cleared {len(resolved)}"
+    if config['OVERDUE_REMINDERS_ENABLED']:
+        oldest = midnight - timedelta(days=config['OVERDUE_REMINDER_MAX_DAYS'])
+        summary += f", queued {queue_reminders(oldest, batch_size, pause)} reminders"
+    return summary
+
+
+def archive_job(config):
+    from archive import run_archive
+    return f"Archived {run_archive(config)} orders"
+
+
+def acquire_lease(job_name, owner):
+    """Take job_name's lease for owner unless another live process holds it; returns whether it did."""
+    now = datetime.utcnow()
+    try:
+        begin_write()
+        db.session.execute(insert(JobLock).values(job=job_name).on_conflict_do_nothing())
+        taken = (JobLock.query
+                 .filter(JobLock.job == job_name, or_(JobLock.owner.is_(None), JobLock.expires_at < now))
+                 .update({'owner': owner, 'expires_at': now + LEASE_DURATION}, synchronize_session=False))
+        if taken:
+            # Any run still marked running died with the process that held the lease
+            (JobRun.query.filter(JobRun.job == job_name, JobRun.status == 'running')
+             .update({'status': 'failed', 'error': 'Interrupted', 'finished_at': now}, synchronize_session=False))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return bool(taken)
+
+
+def release_lease(job_name, owner):
+    try:
+        (JobLock.query.filter(JobLock.job == job_name, JobLock.owner == owner)
+         .update({'owner': None, 'expires_at': None}, synchronize_session=False))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _prune_runs(job_name, keep):
+    newest = (db.session.query(JobRun.id).filter(JobRun.job == job_name)
+              .order_by(JobRun.id.desc()).offset(keep).limit(1).scalar())
+    if newest is not None:
+        JobRun.query.filter(JobRun.job == job_name, JobRun.id <= newest).delete(synchronize_session=False)
+
+
+def run_job(app, job, owner):
+    """Run job once in an app context and record the run; returns the run as a dict, or None if it was skipped."""
+    with app.app_context():
+        try:
+            if not acquire_lease(job.name, owner):
+                logger.info("Skipping job %s: another process is running it", job.name)
+                return None
+            try:
+                run = JobRun(job=job.name, status='running', started_at=datetime.utcnow())
+                db.session.add(run)
+                db.session.commit()
+
+                started = time.perf_counter()
+                try:
+                    run.result = job.func(app.config)
+                except Exception as e:
+                    db.session.rollback()
+                    run.status, run.error = 'failed', str(e)
+                    logger.error("Job %s failed: %s", job.name, e, exc_info=True)
+                else:
+                    run.status = 'succeeded'
+                    logger.info("Job %s finished in %.1fs: %s", job.name, time.perf_counter() - started, run.result)
+                run.finished_at = datetime.utcnow()
+                _prune_runs(job.name, app.config['SCHEDULER_RUN_HISTORY'])
+                db.session.commit()
+                return run.to_dict()
+            finally:
+                release_lease(job.name, owner)
+        finally:
+            db.session.remove()
+
+
+class Scheduler(threading.Thread):
+    """Background thread that runs each registered job when it is due, one job at a time."""
+
+    def __init__(self, app, start_delay=0):
+        super().__init__(name='scheduler', daemon=True)
+        self.app = app
+        self.start_delay = start_delay
+        self.jobs = {}
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+
+    def add_job(self, name, func, interval):
+        self.jobs[name] = Job(name, func, interval)
+
+    def trigger(self, name):
+        """Run a job as soon as the scheduler is free; raises KeyError for an unknown job."""
+        self.jobs[name].next_run = 0.0
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def run(self):
+        if self._stop_event.wait(self.start_delay):
+            return
+        try:
+            self._resume_schedule()
+        except Exception as e:
+            logger.warning("Could not read the job run history, running every job now: %s", e)
+        while not self._stop_event.is_set():
+            job = min(self.jobs.values(), key=lambda job: job.next_run)
+            delay = job.next_run - time.monotonic()
+            if delay > 0:
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+            job.next_run = time.monotonic() + job.interval
+            try:
+                run_job(self.app, job, self.owner)
+            except Exception as e:
+                logger.error("Could not run job %s: %s", job.name, e, exc_info=True)
+
+    def _resume_schedule(self):
+        with self.app.app_context():
+            last_runs = dict(db.session.query(JobRun.job, func.max(JobRun.started_at)).group_by(JobRun.job).all())
+            db.session.remove()
+        for job in self.jobs.values():
+            if job.name in last_runs:
+                elapsed = (datetime.utcnow() - last_runs[job.name]).total_seconds()
+                job.next_run = time.monotonic() + max(0.0, job.interval - elapsed)
+
+    def status(self):
+        """Each job with its interval and seconds until its next run."""
+        now = time.monotonic()
+        return [{'job': job.name, 'intervalSeconds': job.interval, 'nextRunIn': round(max(0.0, job.next_run - now))}
+                for job in self.jobs.values()]
+
+
+def register_jobs(scheduler, config):
+    if config['OVERDUE_CHECK_MINUTES'] > 0:
+        scheduler.add_job('overdue', check_overdue, config['OVERDUE_CHECK_MINUTES'] * 60)
+    if config['ARCHIVE_AFTER_DAYS'] > 0:
+        scheduler.add_job('archive', archive_job, config['ARCHIVE_INTERVAL_HOURS'] * 3600)
+
+
+def init_scheduler(app):
+    """Start the scheduler, unless SCHEDULER_ENABLED is off or no job is turned on."""
+    scheduler = None
+    if app.config['SCHEDULER_ENABLED']:
+        scheduler = Scheduler(app, start_delay=app.config['BACKGROUND_START_DELAY'])
+        register_jobs(scheduler, app.config)
+        if scheduler.jobs:
+            scheduler.start()
+        else:
+            scheduler = None
+    app.extensions['scheduler'] = scheduler
+    return scheduler
+
+
+def get_scheduler():
+    return current_app.extensions.get('scheduler')
+
+
+def main(argv=None):
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Run or list the scheduled jobs")
+    parser.add_argument('command', nargs='?', choices=('status', 'run'), default='status')
+    parser.add_argument('job', nargs='?', help='job to run')
+    args = parser.parse_args(argv)
+
+    app = create_app({'MAIL_WORKER_ENABLED': False, 'SQLITE_WAL_CHECKPOINT_INTERVAL': 0, 'BACKUP_ENABLED': False,
+                      'SCHEDULER_ENABLED': False})
+    jobs = Scheduler(app)
+    register_jobs(jobs, app.config)
+
+    if args.command == 'status':
+        with app.app_context():
+            for name in jobs.jobs:
+                run = JobRun.query.filter(JobRun.job == name).order_by(JobRun.id.desc()).first()
+                last = f"last run {run.started_at:%Y-%m-%d %H:%M} {run.status}: {run.result or run.error}" if run \
+                    else "never run"
+                print(f"{name:<10} every {jobs.jobs[name].interval // 60} min, {last}")
+        return 0
+
+    if args.job not in jobs.jobs:
+        print(f"Unknown or disabled job {args.job!r}; jobs: {', '.join(jobs.jobs) or 'none'}", file=sys.stderr)
+        return 1
+    run = run_job(app, jobs.jobs[args.job], jobs.owner)
+    if run is None:
+        print(f"Job {args.job} is already running in another process.", file=sys.stderr)
+        return 1
+    print(f"{args.job} {run['status']}: {run['result'] or run['error']}")
+    return 0 if run['status'] == 'succeeded' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
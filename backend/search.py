@@ -0,0 +1,150 @@
+"""Full-text search over purchase orders with an SQLite FTS5 index.
+
+purchase_order_fts holds one document per order (order number, customer
+name and email, line item descriptions and notes). Its rowids come from
+purchase_order_fts_map, whose INTEGER PRIMARY KEY stays stable across
+VACUUM, so a single order's document can be replaced without scanning the
+index. The write paths call reindex_orders() with the ids they touched.
+
+Rebuild the index of an existing database with:
+
+    python search.py
+"""
+import heapq
+import re
+
+from sqlalchemy import bindparam, text
+
+from extensions import db, logger
+
+# bm25 column weights: order_number, customer_name, customer_email, items, notes
+RANK_WEIGHTS = (10.0, 5.0, 3.0, 1.0, 0.5)
+
+_DELETE_DOCUMENTS = text(
+    "DELETE FROM purchase_order_fts WHERE rowid IN "
+    "(SELECT doc_id FROM purchase_order_fts_map WHERE order_id IN :ids)"
+).bindparams(bindparam('ids', expanding=True))
+
+_MAP_ORDERS = text(
+    "INSERT INTO purchase_order_fts_map (order_id) "
+    "SELECT id FROM purchase_orders WHERE id IN :ids "
+    "ON CONFLICT (order_id) DO NOTHING"
+).bindparams(bindparam('ids', expanding=True))
+
+_INSERT_DOCUMENTS = text(
+    "INSERT INTO purchase_order_fts (rowid, order_number, customer_name, customer_email, items, notes) "
+    "SELECT m.doc_id, po.order_number, c.name, c.email, "
+    "       (SELECT group_concat(li.description, ' ') FROM line_items li WHERE li.purchase_order_id = po.id), "
+    "       po.notes "
+    "FROM purchase_orders po "
+    "JOIN purchase_order_fts_map m ON m.order_id = po.id "
+    "LEFT JOIN customers c ON c.id = po.customer_id "
+    "WHERE po.id IN :ids"
+).bindparams(bindparam('ids', expanding=True))
+
+_UNMAP_DELETED = text(
+    "DELETE FROM purchase_order_fts_map WHERE order_id IN :ids "
+    "AND order_id NOT IN (SELECT id FROM purchase_orders)"
+).bindparams(bindparam('ids', expanding=True))
+
+# SQLite caps bound parameters per statement; stay well under the old 999 limit
+_ID_CHUNK = 500
+
+
+def reindex_orders(order_ids):
+    """Refresh the search documents of the given orders in the current transaction.
+
+    Orders that no longer exist are removed from the index. Call after the
+    changes are flushed and before the commit.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    for start in range(0, len(order_ids), _ID_CHUNK):
+        ids = order_ids[start:start + _ID_CHUNK]
+        db.session.execute(_DELETE_DOCUMENTS, {'ids': ids})
+        db.session.execute(_MAP_ORDERS, {'ids': ids})
+        db.session.execute(_INSERT_DOCUMENTS, {'ids': ids})
+        db.session.execute(_UNMAP_DELETED, {'ids': ids})
+
+
+def rebuild_search_index():
+    """Rebuild every search document from the order tables."""
+    db.session.execute(text("DELETE FROM purchase_order_fts"))
+    db.session.execute(text("DELETE FROM purchase_order_fts_map"))
+    db.session.execute(text("INSERT INTO purchase_order_fts_map (order_id) SELECT id FROM purchase_orders"))
+    db.session.execute(text(
+        "INSERT INTO purchase_order_fts (rowid, order_number, customer_name, customer_email, items, notes) "
+        "SELECT m.doc_id, po.order_number, c.name, c.email, "
+        "       (SELECT group_concat(li.description, ' ') FROM line_items li WHERE li.purchase_order_id = po.id), "
+        "       po.notes "
+        "FROM purchase_orders po "
+        "JOIN purchase_order_fts_map m ON m.order_id = po.id "
+        "LEFT JOIN customers c ON c.id = po.customer_id"))
+    db.session.execute(text("INSERT INTO purchase_order_fts (purchase_order_fts) VALUES ('optimize')"))
+    db.session.commit()
+    count = db.session.execute(text("SELECT COUNT(*) FROM purchase_order_fts_map")).scalar()
+    logger.info("Search index rebuilt with %s orders", count)
+    return count
+
+
+def build_match_query(user_query):
+    """Turn free text into an FTS5 query: every word must match, as a prefix.
+
+    Words are quoted so FTS5 operators and punctuation in the input are
+    treated as plain text; "PO-2025" becomes "PO"* AND "2025"*.
+    """
+    terms = re.findall(r'\w+', user_query or '', flags=re.UNICODE)
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+_SEARCH = (
+    "SELECT m.order_id, bm25(purchase_order_fts, {weights}) AS rank FROM purchase_order_fts "
+    "JOIN purchase_order_fts_map m ON m.doc_id = purchase_order_fts.rowid "
+    "WHERE purchase_order_fts MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset"
+)
+
+# The archive's index (archive.py) keys documents by archive.purchase_orders.doc_id
+_SEARCH_ARCHIVE = (
+    "SELECT a.id, bm25(purchase_order_fts, {weights}) AS rank FROM archive.purchase_order_fts "
+    "JOIN archive.purchase_orders a ON a.doc_id = purchase_order_fts.rowid "
+    "WHERE purchase_order_fts MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset"
+)
+
+
+def _ranked(statement, match, limit, offset):
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+    return db.session.execute(text(statement.format(weights=weights)),
+                              {'match': match, 'limit': limit, 'offset': offset}).all()
+
+
+def search_order_ids(user_query, limit, offset=0):
+    """Return ids of the best matching orders, best first."""
+    match = build_match_query(user_query)
+    if not match:
+        return []
+    return [row[0] for row in _ranked(_SEARCH, match, limit, offset)]
+
+
+def search_with_archive(user_query, limit, offset=0):
+    """Like search_order_ids, with archived orders ranked among the others; returns (order_id, archived) pairs.
+
+    The two indexes score documents against their own statistics, and the
+    scores are compared as they are.
+    """
+    match = build_match_query(user_query)
+    if not match:
+        return []
+    hot = _ranked(_SEARCH, match, offset + limit, 0)
+    hot_ids = {order_id for order_id, _ in hot}
+    # An order in both databases (see archive.py) is found once, as the main copy
+    archived = [row for row in _ranked(_SEARCH_ARCHIVE, match, offset + limit, 0) if row[0] not in hot_ids]
+    merged = heapq.merge(((rank, order_id, False) for order_id, rank in hot),
+                         ((rank, order_id, True) for order_id, rank in archived))
+    return [(order_id, is_archived) for _, order_id, is_archived in merged][offset:offset + limit]
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app({'MAIL_WORKER_ENABLED': False, 'SQLITE_WAL_CHECKPOINT_INTERVAL': 0})
+    with app.app_context():
+        print(f"Indexed {rebuild_search_index()} purchase orders.")
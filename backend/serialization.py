@@ -0,0 +1,172 @@
+"""Fast JSON encoding of purchase orders for list, search and export responses.
+
+PurchaseOrder.to_dict() needs a fully loaded ORM object per order, plus one
+per line item and customer, and jsonify then encodes the whole list in one
+go. OrderEncoder instead reads plain column rows. SQLite builds each order's
+line item array as JSON text (json_group_array), each customer is encoded
+once per response, and both fragments are spliced into the order's encoded
+scalar fields without being parsed again. The output equals to_dict()
+apart from key order.
+
+orjson is used for encoding when it is installed, with the stdlib json
+module as the fallback.
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import bindparam, text
+
+from extensions import db
+from models import ArchivedPurchaseOrder, PurchaseOrder
+from pagination import keyset_filter, keyset_order
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Orders encoded per query when streaming a list
+STREAM_CHUNK_SIZE = 1000
+
+# Column rows OrderEncoder works from; pass them to Query.with_entities()
+ORDER_COLUMNS = (
+    PurchaseOrder.id, PurchaseOrder.order_number, PurchaseOrder.customer_id, PurchaseOrder.subtotal_cents,
+    PurchaseOrder.tax_rate, PurchaseOrder.tax_amount_cents, PurchaseOrder.total_cents, PurchaseOrder.notes,
+    PurchaseOrder.status, PurchaseOrder.created_at, PurchaseOrder.due_date, PurchaseOrder.updated_at,
+    PurchaseOrder.version,
+)
+# The same columns of archived orders, for OrderEncoder(archived=True)
+ARCHIVED_ORDER_COLUMNS = tuple(getattr(ArchivedPurchaseOrder, column.key) for column in ORDER_COLUMNS)
+
+# The subquery's ORDER BY is the order rows are fed to json_group_array in
+_LINE_ITEMS_JSON = (
+    "SELECT purchase_order_id, json_group_array(json_object("
+    "'id', item_id, 'description', description, 'quantity', quantity, 'unitPrice', unit_price_cents / 100.0)) "
+    "FROM (SELECT * FROM {table} WHERE purchase_order_id IN :ids ORDER BY purchase_order_id, position) "
+    "GROUP BY purchase_order_id"
+)
+_LINE_ITEMS = text(_LINE_ITEMS_JSON.format(table='main.line_items')).bindparams(
+    bindparam('ids', expanding=True))
+_ARCHIVED_LINE_ITEMS = text(_LINE_ITEMS_JSON.format(table='archive.line_items')).bindparams(
+    bindparam('ids', expanding=True))
+
+_CUSTOMERS = text(
+    "SELECT id, name, email, phone, address FROM customers WHERE id IN :ids"
+).bindparams(bindparam('ids', expanding=True))
+
+
+def dumps(obj):
+    """Encode obj as compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class OrderEncoder:
+    """Encodes rows of ORDER_COLUMNS as JSON documents, caching customers between calls.
+
+    With archived=True it encodes rows of ARCHIVED_ORDER_COLUMNS, marked "archived": true.
+    """
+
+    def __init__(self, archived=False):
+        self.archived = archived
+        self._customers = {}
+
+    def _load_customers(self, customer_ids):
+        missing = [customer_id for customer_id in set(customer_ids) if customer_id not in self._customers]
+        if not missing:
+            return
+        for customer_id, *values in db.session.execute(_CUSTOMERS, {'ids': missing}).all():
+            # Same shape as Customer.to_dict(): fields that were never provided stay absent
+            self._customers[customer_id] = dumps({field: value for field, value in
+                                                  zip(('name', 'email', 'phone', 'address'), values)
+                                                  if value is not None})
+
+    def encode(self, rows):
+        """Return the encoded JSON object of each row, in the same order."""
+        if not rows:
+            return []
+        items = {order_id: items_json.encode('utf-8') for order_id, items_json in
+                 db.session.execute(_ARCHIVED_LINE_ITEMS if self.archived else _LINE_ITEMS,
+                                    {'ids': [row[0] for row in rows]}).all()}
+        self._load_customers(row[2] for row in rows)
+
+        documents = []
+        # Unpacked positionally: Row attribute lookups cost more than the encoding
+        for (order_id, order_number, customer_id, subtotal, tax_rate, tax_amount, total, notes, status,
+             created_at, due_date, updated_at, version) in rows:
+            fields = {
+                'id': order_id,
+                'orderNumber': order_number,
+                'subtotal': subtotal / 100,
+                'taxRate': tax_rate,
+                'taxAmount': tax_amount / 100,
+                'total': total / 100,
+                'notes': notes,
+                'status': status,
+                'createdAt': created_at.isoformat(),
+                'dueDate': due_date.isoformat() if due_date else None,
+                'updatedAt': updated_at.isoformat(),
+                'version': version,
+            }
+            if self.archived:
+                fields['archived'] = True
+            scalars = dumps(fields)
+            documents.append(b''.join((
+                scalars[:-1],
+                b',"customer":', self._customers.get(customer_id, b'null'),
+                b',"lineItems":', items.get(order_id, b'[]'),
+                b'}',
+            )))
+        return documents
+
+
+def iter_order_chunks(query, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield lists of encoded orders matched by an ORM query, in (created_at, id) order."""
+    encoder = OrderEncoder()
+    query = query.with_entities(*ORDER_COLUMNS)
+    order = keyset_order(PurchaseOrder.created_at, PurchaseOrder.id, 'asc')
+    last = None
+    while True:
+        chunk_query = query
+        if last:
+            chunk_query = chunk_query.filter(
+                keyset_filter(PurchaseOrder.created_at, PurchaseOrder.id, 'asc', *last))
+        rows = chunk_query.order_by(*order).limit(chunk_size).all()
+        if not rows:
+            return
+        yield encoder.encode(rows)
+        last = (rows[-1].created_at, rows[-1].id)
+
+
+def stream_json_array(query, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield a JSON array of every order matched by query, one chunk at a time."""
+    separator = b'['
+    for documents in iter_order_chunks(query, chunk_size):
+        yield separator + b','.join(documents)
+        separator = b','
+    yield b']' if separator == b',' else b'[]'
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, encoding with orjson when it is installed.
+
+    Dates still go through Flask's default() so jsonify output is unchanged;
+    pretty-printed (debug) responses and values orjson rejects fall back to
+    the stdlib encoder.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except TypeError:
+            return super().dumps(obj)
+
+
+def init_json(app):
+    app.json = JSONProvider(app)
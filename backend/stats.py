@@ -0,0 +1,225 @@
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert
+
+from extensions import db, logger
+from models import OrderSummary, ReportRollup
+from money import from_cents, line_amount_cents
+
+# Orders in these statuses are never overdue
+CLOSED_STATUSES = ('paid', 'cancelled')
+# Cancelled orders are left out of revenue buckets
+NON_REVENUE_STATUSES = ('cancelled',)
+# session.info['report_periods'] collects the created_at months touched by
+# the transaction, plus these markers for changes to every month and to the
+# open orders by due date
+ALL_PERIODS = '*'
+DUE_DATES = 'due'
+
+
+def order_snapshot(order):
+    """Capture the fields of an order that feed the summary and rollup tables."""
+    return {
+        'status': order.status,
+        'total_cents': order.total_cents or 0,
+        'created_at': order.created_at or datetime.utcnow(),
+        'due_date': order.due_date,
+        'customer': order.customer_record.name if order.customer_record else '',
+        # None until the session is flushed for a customer created with the order
+        'customer_id': order.customer_record.id if order.customer_record else order.customer_id,
+        'items': [(item.description, item.quantity, line_amount_cents(item.quantity, item.unit_price_cents))
+                  for item in order.items],
+    }
+
+
+def _buckets(snapshot):
+    yield 'status', snapshot['status']
+    if snapshot['status'] not in NON_REVENUE_STATUSES:
+        yield 'day', snapshot['created_at'].strftime('%Y-%m-%d')
+        yield 'month', snapshot['created_at'].strftime('%Y-%m')
+    if snapshot['status'] not in CLOSED_STATUSES and snapshot['due_date']:
+        yield 'due', snapshot['due_date'].strftime('%Y-%m-%d')
+
+
+def _rollups(snapshot):
+    """Yield ((dimension, period, key), count, quantity, cents) for the rollup rows of a snapshot."""
+    period = snapshot['created_at'].strftime('%Y-%m')
+    yield ('status', period, snapshot['status']), 1, 0, snapshot['total_cents']
+    if snapshot['status'] not in NON_REVENUE_STATUSES:
+        yield ('customer', period, snapshot.get('customer') or ''), 1, 0, snapshot['total_cents']
+        for description, quantity, amount_cents in snapshot.get('items', ()):
+            yield ('item', period, description), 1, quantity, amount_cents
+
+
+def record_order_change(old=None, new=None):
+    """Apply the difference between two order snapshots to the summary and rollup tables.
+
+    Pass only ``new`` for a created order, only ``old`` for a deleted one and
+    both for an update. The upserts run in the caller's session, so they are
+    committed or rolled back together with the order itself.
+    """
+    record_order_changes([(old, new)])
+
+
+def record_order_changes(changes):
+    """Apply many (old, new) snapshot pairs with one upsert per touched bucket."""
+    deltas = defaultdict(lambda: [0, 0])
+    rollup_deltas = defaultdict(lambda: [0, 0, 0])
+    customer_ids = set()
+    for old, new in changes:
+        for snapshot, sign in ((old, -1), (new, 1)):
+            if not snapshot:
+                continue
+            if snapshot.get('customer_id') is not None:
+                customer_ids.add(snapshot['customer_id'])
+            for key in _buckets(snapshot):
+                deltas[key][0] += sign
+                deltas[key][1] += sign * snapshot['total_cents']
+            for key, count, quantity, cents in _rollups(snapshot):
+                delta = rollup_deltas[key]
+                delta[0] += sign * count
+                delta[1] += sign * quantity
+                delta[2] += sign * cents
+
+    # One statement per table, executed with a parameter set per touched bucket
+    table = OrderSummary.__table__
+    periods = set()
+    rows = []
+    for (dimension, bucket), (count, total) in deltas.items():
+        if count == 0 and total == 0:
+            continue
+        if dimension in ('due', 'status'):
+            periods.add(DUE_DATES)
+        rows.append({'dimension': dimension, 'bucket': bucket, 'order_count': count, 'total_cents': total})
+    if rows:
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.dimension, table.c.bucket],
+            set_={
+                'order_count': table.c.order_count + stmt.excluded.order_count,
+                'total_cents': table.c.total_cents + stmt.excluded.total_cents,
+            },
+        )
+        db.session.execute(stmt, rows)
+
+    table = ReportRollup.__table__
+    rows = []
+    for (dimension, period, key), (count, quantity, total) in rollup_deltas.items():
+        if count == 0 and quantity == 0 and total == 0:
+            continue
+        periods.add(period)
+        rows.append({'dimension': dimension, 'period': period, 'key': key, 'order_count': count,
+                     'quantity': quantity, 'total_cents': total})
+    if rows:
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.dimension, table.c.period, table.c.key],
+            set_={
+                'order_count': table.c.order_count + stmt.excluded.order_count,
+                'quantity': table.c.quantity + stmt.excluded.quantity,
+                'total_cents': table.c.total_cents + stmt.excluded.total_cents,
+            },
+        )
+        db.session.execute(stmt, rows)
+    # Cached reports over these months are dropped when the transaction commits,
+    # and these customers are re-read by the suggestion index (customers.py)
+    db.session.info.setdefault('report_periods', set()).update(periods)
+    db.session.info.setdefault('customer_ids', set()).update(customer_ids)
+
+
+# Archived orders (archive.py) still count, so rebuilds read both databases
+_ALL_ORDERS = ("(SELECT id, customer_id, total_cents, status, created_at, due_date FROM main.purchase_orders "
+               "UNION ALL SELECT id, customer_id, total_cents, status, created_at, due_date "
+               "FROM archive.purchase_orders)")
+_ALL_LINE_ITEMS = ("(SELECT purchase_order_id, description, quantity, unit_price_cents FROM main.line_items "
+                   "UNION ALL SELECT purchase_order_id, description, quantity, unit_price_cents "
+                   "FROM archive.line_items)")
+
+# {orders} and {line_items} stand for the rows of both databases
+_REBUILD_STATEMENTS = [
+    "DELETE FROM order_summary",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total_cents)
+       SELECT 'status', status, COUNT(*), COALESCE(SUM(total_cents), 0)
+       FROM {orders} GROUP BY status""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total_cents)
+       SELECT 'day', strftime('%Y-%m-%d', created_at), COUNT(*), COALESCE(SUM(total_cents), 0)
+       FROM {orders} WHERE status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m-%d', created_at)""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total_cents)
+       SELECT 'month', strftime('%Y-%m', created_at), COUNT(*), COALESCE(SUM(total_cents), 0)
+       FROM {orders} WHERE status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m', created_at)""",
+    """INSERT INTO order_summary (dimension, bucket, order_count, total_cents)
+       SELECT 'due', strftime('%Y-%m-%d', due_date), COUNT(*), COALESCE(SUM(total_cents), 0)
+       FROM {orders}
+       WHERE status NOT IN ('paid', 'cancelled') AND due_date IS NOT NULL
+       GROUP BY strftime('%Y-%m-%d', due_date)""",
+    "DELETE FROM report_rollups",
+    """INSERT INTO report_rollups (dimension, period, key, order_count, quantity, total_cents)
+       SELECT 'status', strftime('%Y-%m', created_at), status, COUNT(*), 0, COALESCE(SUM(total_cents), 0)
+       FROM {orders} GROUP BY strftime('%Y-%m', created_at), status""",
+    """INSERT INTO report_rollups (dimension, period, key, order_count, quantity, total_cents)
+       SELECT 'customer', strftime('%Y-%m', po.created_at), COALESCE(c.name, ''), COUNT(*), 0,
+              COALESCE(SUM(po.total_cents), 0)
+       FROM {orders} po LEFT JOIN customers c ON c.id = po.customer_id
+       WHERE po.status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m', po.created_at), COALESCE(c.name, '')""",
+    """INSERT INTO report_rollups (dimension, period, key, order_count, quantity, total_cents)
+       SELECT 'item', strftime('%Y-%m', po.created_at), li.description, COUNT(*), SUM(li.quantity),
+              CAST(SUM(ROUND(li.quantity * li.unit_price_cents)) AS INTEGER)
+       FROM {line_items} li JOIN {orders} po ON po.id = li.purchase_order_id
+       WHERE po.status NOT IN ('cancelled')
+       GROUP BY strftime('%Y-%m', po.created_at), li.description""",
+]
+
+
+def rebuild_order_stats():
+    """Recompute the summary and report rollup tables from the orders, archived ones included."""
+    for statement in _REBUILD_STATEMENTS:
+        db.session.execute(text(statement.format(orders=_ALL_ORDERS, line_items=_ALL_LINE_ITEMS)))
+    db.session.info.setdefault('report_periods', set()).add(ALL_PERIODS)
+    db.session.commit()
+    logger.info("Order summary and report rollups rebuilt")
+
+
+def _bucket_rows(dimension, since):
+    rows = (OrderSummary.query
+            .filter(OrderSummary.dimension == dimension,
+                    OrderSummary.bucket >= since,
+                    OrderSummary.order_count > 0)
+            .order_by(OrderSummary.bucket)
+            .all())
+    return [{'period': row.bucket, 'count': row.order_count, 'total': from_cents(row.total_cents)} for row in rows]
+
+
+def get_order_stats(days=30, months=12, today=None):
+    """Read dashboard aggregates from the summary table."""
+    today = today or datetime.utcnow().date()
+    today_key = today.strftime('%Y-%m-%d')
+
+    by_status = {}
+    total_cents = 0
+    for row in OrderSummary.query.filter(OrderSummary.dimension == 'status').all():
+        if row.order_count > 0:
+            by_status[row.bucket] = {'count': row.order_count, 'total': from_cents(row.total_cents)}
+            total_cents += row.total_cents
+
+    overdue_count, overdue_total = (db.session.query(db.func.coalesce(db.func.sum(OrderSummary.order_count), 0),
+                                                     db.func.coalesce(db.func.sum(OrderSummary.total_cents), 0))
+                                    .filter(OrderSummary.dimension == 'due', OrderSummary.bucket < today_key)
+                                    .one())
+
+    day_start = datetime.fromordinal(today.toordinal() - (days - 1)).strftime('%Y-%m-%d')
+    month_index = today.year * 12 + today.month - 1 - (months - 1)
+    month_start = f"{month_index // 12:04d}-{month_index % 12 + 1:02d}"
+
+    return {
+        'totalOrders': sum(s['count'] for s in by_status.values()),
+        'totalAmount': from_cents(total_cents),
+        'byStatus': by_status,
+        'overdue': {'count': int(overdue_count), 'total': from_cents(int(overdue_total))},
+        'revenueByDay': _bucket_rows('day', day_start),
+        'revenueByMonth': _bucket_rows('month', month_start),
+    }
@@ -0,0 +1,153 @@
+"""Check stored order totals against the line items, and fix the ones that drifted.
+
+The write handlers calculate totals on the server (see money.py), but
+orders stored before that, or changed behind the API's back, may not
+match their line items. verify_totals() recomputes every order's totals in
+SQL, one chunk of orders per query, and returns the ones that disagree;
+with fix=True it also corrects them, adds them to the change feed and
+rebuilds the order summary. Rounding in SQL matches money.py exactly, so an order
+written through the API always verifies.
+
+Meant to run nightly:
+
+    python totals.py            # report orders whose totals disagree
+    python totals.py --fix      # recalculate them
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from extensions import db, logger
+from changes import record_changes
+from money import from_cents
+from stats import rebuild_order_stats
+
+# Orders checked per query (and per transaction when fixing)
+DEFAULT_CHUNK_SIZE = 5000
+# Mismatching orders listed in a report before truncating
+MAX_REPORTED_MISMATCHES = 100
+
+_CHUNK_END = text(
+    "SELECT MAX(rowid), COUNT(*) FROM "
+    "(SELECT rowid FROM purchase_orders WHERE rowid > :after ORDER BY rowid LIMIT :limit)")
+
+# The line item sum is an index lookup per order on ix_line_items_order_position
+_MISMATCHES = text("""
+    WITH subtotals AS (
+        SELECT po.id, po.version, po.tax_rate,
+               po.subtotal_cents, po.tax_amount_cents, po.total_cents,
+               COALESCE((SELECT CAST(SUM(ROUND(li.quantity * li.unit_price_cents)) AS INTEGER)
+                         FROM line_items li WHERE li.purchase_order_id = po.id), 0) AS expected_subtotal
+        FROM purchase_orders po
+        WHERE po.rowid > :after AND po.rowid <= :until
+    ), expected AS (
+        SELECT *, CAST(ROUND(expected_subtotal * tax_rate / 100.0) AS INTEGER) AS expected_tax
+        FROM subtotals
+    )
+    SELECT id, version, subtotal_cents, tax_amount_cents, total_cents,
+           expected_subtotal, expected_tax, expected_subtotal + expected_tax AS expected_total
+    FROM expected
+    WHERE subtotal_cents != expected_subtotal OR tax_amount_cents != expected_tax
+       OR total_cents != expected_subtotal + expected_tax
+""")
+
+_FIX_ORDER = text(
+    "UPDATE purchase_orders SET subtotal_cents = :subtotal, tax_amount_cents = :tax, total_cents = :total, "
+    "version = version + 1, updated_at = :now WHERE id = :id AND version = :version")
+
+
+def _fix(rows):
+    """Write the expected totals of mismatching rows; return the ids that were fixed."""
+    now = datetime.utcnow()
+    fixed = []
+    for row in rows:
+        result = db.session.execute(_FIX_ORDER, {
+            'subtotal': row.expected_subtotal, 'tax': row.expected_tax, 'total': row.expected_total,
+            'now': now, 'id': row.id, 'version': row.version})
+        # rowcount 0: the order was updated since it was read, which recalculated its totals
+        if result.rowcount:
+            fixed.append(row.id)
+    record_changes(fixed)
+    return fixed
+
+
+def _describe(row):
+    return {
+        'id': row.id,
+        'stored': {'subtotal': from_cents(row.subtotal_cents), 'taxAmount': from_cents(row.tax_amount_cents),
+                   'total': from_cents(row.total_cents)},
+        'expected': {'subtotal': from_cents(row.expected_subtotal), 'taxAmount': from_cents(row.expected_tax),
+                     'total': from_cents(row.expected_total)},
+    }
+
+
+def verify_totals(fix=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Recompute the totals of every order and return a report dict.
+
+    Each chunk is read (and with fix=True, corrected) in its own
+    transaction, so writers are held up for one chunk at most.
+    """
+    started = time.perf_counter()
+    checked = mismatched = fixed = 0
+    mismatches = []
+    after = 0
+    while True:
+        until, count = db.session.execute(_CHUNK_END, {'after': after, 'limit': chunk_size}).one()
+        if until is None:
+            break
+        rows = db.session.execute(_MISMATCHES, {'after': after, 'until': until}).all()
+        checked += count
+        mismatched += len(rows)
+        mismatches.extend(_describe(row) for row in rows[:MAX_REPORTED_MISMATCHES - len(mismatches)])
+        if fix and rows:
+            fixed += len(_fix(rows))
+            db.session.commit()
+        else:
+            db.session.rollback()
+        after = until
+    if fixed:
+        # Totals that drifted behind the API's back never reached the summary
+        # table either, so recompute it rather than applying deltas
+        rebuild_order_stats()
+
+    elapsed = time.perf_counter() - started
+    logger.info("Checked the totals of %s orders in %.2fs: %s mismatched, %s fixed",
+                checked, elapsed, mismatched, fixed)
+    return {
+        'checked': checked,
+        'mismatched': mismatched,
+        'fixed': fixed,
+        'seconds': round(elapsed, 3),
+        'mismatches': mismatches,
+        'mismatchesTruncated': mismatched > len(mismatches),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check order totals against their line items")
+    parser.add_argument('--fix', action='store_true', help='recalculate the totals that do not match')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    from app import create_app
+
+    app = create_app({'MAIL_WORKER_ENABLED': False, 'SQLITE_WAL_CHECKPOINT_INTERVAL': 0})
+    with app.app_context():
+        report = verify_totals(fix=args.fix, chunk_size=args.chunk_size)
+    for mismatch in report['mismatches']:
+        stored, expected = mismatch['stored'], mismatch['expected']
+        print(f"{mismatch['id']}  stored {stored['subtotal']:.2f} + {stored['taxAmount']:.2f} = "
+              f"{stored['total']:.2f}  expected {expected['subtotal']:.2f} + {expected['taxAmount']:.2f} = "
+              f"{expected['total']:.2f}")
+    if report['mismatchesTruncated']:
+        print(f"... and {report['mismatched'] - len(report['mismatches'])} more")
+    print(f"{report['checked']} orders checked in {report['seconds']}s, {report['mismatched']} mismatched, "
+          f"{report['fixed']} fixed.")
+    return 1 if report['mismatched'] > report['fixed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+from models import Customer, LineItem
+from money import from_cents, order_totals, parse_number, to_cents
+from order_numbers import next_order_number
+
+REQUIRED_FIELDS = ['customer', 'lineItems', 'taxRate']
+
+# Totals a client may send along; they are checked against the server's own
+# calculation. API field name -> OrderTotals field.
+TOTAL_FIELDS = {
+    'subtotal': 'subtotal_cents',
+    'taxAmount': 'tax_amount_cents',
+    'total': 'total_cents',
+}
+# A client that rounds at a different step may be off by this much
+TOTALS_TOLERANCE_CENTS = 1
+
+
+class ValidationError(ValueError):
+    """Raised when purchase order data from a client is invalid."""
+
+
+def parse_date(value, field='dueDate'):
+    """Parse an ISO (optionally Z-suffixed) or YYYY-MM-DD date string."""
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValidationError(f"Invalid {field} format. Use ISO format or YYYY-MM-DD.")
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            return datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            raise ValidationError(f"Invalid {field} format. Use ISO format or YYYY-MM-DD.")
+
+
+def check_client_totals(data, totals):
+    """Reject totals sent by the client that disagree with the server-side OrderTotals."""
+    for field, attribute in TOTAL_FIELDS.items():
+        if data.get(field) is None:
+            continue
+        try:
+            sent = to_cents(data[field], field)
+        except ValueError as e:
+            raise ValidationError(str(e))
+        expected = getattr(totals, attribute)
+        if abs(sent - expected) > TOTALS_TOLERANCE_CENTS:
+            raise ValidationError(f"{field} {data[field]} does not match the line items "
+                                  f"(expected {from_cents(expected):.2f})")
+
+
+def validate_order_data(data):
+    """Check a new purchase order payload and return PurchaseOrder column values.
+
+    The money columns are calculated from the line items; subtotal, taxAmount
+    and total in the payload are optional and only checked against them.
+    Raises ValidationError with a client-facing message on the first problem.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError("Purchase order must be a JSON object")
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            raise ValidationError(f"Missing required field: {field}")
+
+    values = {}
+    try:
+        values['tax_rate'] = parse_number(data['taxRate'], 'taxRate')
+        values['customer'] = Customer.normalize(data['customer'])
+        if not isinstance(data['lineItems'], list):
+            raise ValueError("lineItems must be a list")
+        items = [LineItem.from_dict(item) for item in data['lineItems']]
+    except (TypeError, ValueError) as e:
+        raise ValidationError(str(e))
+
+    totals = order_totals([(item.quantity, item.unit_price_cents) for item in items], values['tax_rate'])
+    check_client_totals(data, totals)
+    values.update(totals._asdict())
+    values['line_items'] = [item.to_dict() for item in items]
+
+    values['order_number'] = str(data.get('orderNumber') or next_order_number())
+    values['notes'] = data.get('notes', '')
+    values['status'] = data.get('status', 'unpaid')
+    values['due_date'] = parse_date(data.get('dueDate'))
+    return values
@@ -27,17 +27,8 @@ const CreatePurchaseOrder: React.FC = () => {
   const { settings } = useSettings();
   const [isSubmitting, setIsSubmitting] = useState(false);
   
-  const [orderNumber, setOrderNumber] = useState(() => {
-    // Generate PO number based on current date (e.g., PO-20250501-001)
-    const date = new Date();
-    const dateStr = date.getFullYear().toString() +
-      (date.getMonth() + 1).toString().padStart(2, '0') +
-      date.getDate().toString().padStart(2, '0');
-    
-    // Math.random for uniqueness - in a real app you'd use a sequence
-    const unique = Math.floor(Math.random() * 1000).toString().padStart(3, '0');
-    return `PO-${dateStr}-${unique}`;
-  });
+  // Left empty, the server assigns the next number of the day (e.g., PO-20250501-0001)
+  const [orderNumber, setOrderNumber] = useState('');
   
   const [customer, setCustomer] = useState<Customer>(emptyCustomer());
   const [lineItems, setLineItems] = useState<LineItem[]>([emptyLineItem()]);
@@ -155,8 +146,8 @@ const CreatePurchaseOrder: React.FC = () => {
                 type="text"
                 value={orderNumber}
                 onChange={(e) => setOrderNumber(e.target.value)}
+                placeholder="Assigned automatically"
                 className="w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-blue-500"
-                required
               />
             </div>
             